@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Streaming attachment upload and download.
+
+The XML-RPC API can only transfer an attachment as a single base64-encoded xmlrpclib.Binary,
+so uploading or downloading a 2 GB file needs several GB of memory.
+The StreamingAttachmentTransport instead transfers attachments over plain HTTP, in chunks:
+    download:   GET <attachment url> (the 'url' field of the attachment struct), written to
+                <filepath>.part in chunks and renamed when complete.
+    upload:     multipart/form-data, with the file read in chunks while the request body is sent, to
+                POST <baseurl>/rest/api/content/<pageid>/child/attachment/<attachmentid>/data
+                if the page already has an attachment with that filename (a new version), otherwise to
+                POST <baseurl>/rest/api/content/<pageid>/child/attachment (which only creates attachments).
+Memory use is bounded by the chunk size. A digest (default md5) is computed while streaming, and
+an optional progress callback is invoked after each chunk as progress(bytes transferred, total bytes).
+
+Authentication is done by the url opener, e.g. a urllib OpenerDirector with a basic-auth or
+cookie handler. StreamingAttachmentTransport.fromServer uses the server's BaseUrl and UrlOpener
+attributes; if the server has no UrlOpener, no transport is made (requests would not be authenticated),
+and attachments are transferred with XML-RPC.
+
+"""
+from __future__ import print_function
+import os
+import json
+import uuid
+import hashlib
+import mimetypes
+import logging
+logger = logging.getLogger(__name__)
+try:
+    from urllib.request import Request, build_opener
+    from urllib.parse import urljoin, quote
+except ImportError:
+    from urllib2 import Request, build_opener     # python 2
+    from urlparse import urljoin
+    from urllib import quote
+
+DEFAULT_CHUNKSIZE = 2**20  # 1 MB
+
+
+class MultipartFileBody(object):
+    """
+    File-like multipart/form-data request body with a single file part.
+    The file is read in chunks when the request body is sent (http.client/httplib read() the body
+    object until it is exhausted), so the file is never read into memory at once.
+    The digest of the file content is updated while it is read.
+    """
+
+    def __init__(self, filepath, fieldname='file', comment=None, digesttype='md5', progress=None):
+        self.Boundary = uuid.uuid4().hex
+        self.Filepath = filepath
+        self.Filesize = os.path.getsize(filepath)
+        self.Digest = hashlib.new(digesttype) if digesttype else None
+        self.Progress = progress
+        filename = os.path.basename(filepath)
+        contenttype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        preamble = ''
+        if comment:
+            preamble += '--%s\r\nContent-Disposition: form-data; name="comment"\r\n\r\n%s\r\n' % (self.Boundary, comment)
+        preamble += '--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\nContent-Type: %s\r\n\r\n' \
+                    % (self.Boundary, fieldname, filename, contenttype)
+        self._preamble = preamble.encode('utf-8')
+        self._epilogue = ('\r\n--%s--\r\n' % self.Boundary).encode('ascii')
+        self._fd = None
+        self._sent = 0
+        self._parts = [self._preamble, None, self._epilogue]   # None = the file content.
+
+    @property
+    def ContentType(self):
+        """ The Content-Type header for the request. """
+        return 'multipart/form-data; boundary=%s' % self.Boundary
+
+    def __len__(self):
+        return len(self._preamble) + self.Filesize + len(self._epilogue)
+
+    def read(self, size=DEFAULT_CHUNKSIZE):
+        """ Returns the next (up to) size bytes of the request body; b'' when done. """
+        if size is None or size < 0:
+            size = DEFAULT_CHUNKSIZE
+        while self._parts:
+            part = self._parts[0]
+            if part is not None:
+                self._parts.pop(0)
+                if part:
+                    return part
+                continue
+            if self._fd is None:
+                self._fd = open(self.Filepath, 'rb')
+            chunk = self._fd.read(size)
+            if chunk:
+                self._sent += len(chunk)
+                if self.Digest is not None:
+                    self.Digest.update(chunk)
+                if self.Progress:
+                    self.Progress(self._sent, self.Filesize)
+                return chunk
+            self.close()
+            self._parts.pop(0)
+        return b''
+
+    def close(self):
+        """ Closes the file. """
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def hexdigest(self):
+        """ Hex digest of the file content (only complete after the whole body has been read). """
+        return self.Digest.hexdigest() if self.Digest is not None else None
+
+
+class StreamingAttachmentTransport(object):
+    """
+    Chunked HTTP attachment transfer with bounded memory, see module docstring.
+
+    Args:
+        :baseurl:       Wiki base url, e.g. 'https://wiki.example.org'.
+        :opener:        urllib OpenerDirector used for requests (handles authentication). Default: build_opener().
+        :chunksize:     Bytes per read/write.
+        :digesttype:    hashlib digest computed while streaming (None to disable).
+    """
+
+    def __init__(self, baseurl, opener=None, chunksize=DEFAULT_CHUNKSIZE, digesttype='md5'):
+        self.BaseUrl = baseurl.rstrip('/') + '/'
+        self.Opener = opener or build_opener()
+        self.Chunksize = chunksize
+        self.Digesttype = digesttype
+
+    def __repr__(self):
+        return "StreamingAttachmentTransport('%s')" % self.BaseUrl
+
+    @classmethod
+    def fromServer(cls, server, **kwargs):
+        """
+        Makes a transport for server, using server.BaseUrl and server.UrlOpener (which handles authentication).
+        Returns None if there is no server, or it has no BaseUrl or UrlOpener.
+        """
+        baseurl = getattr(server, 'BaseUrl', None) if server is not None else None
+        opener = getattr(server, 'UrlOpener', None) if server is not None else None
+        if not baseurl or opener is None:
+            return None
+        return cls(baseurl, opener=opener, **kwargs)
+
+    def download(self, attachment, filepath, progress=None):
+        """
+        Downloads attachment (an attachment struct with 'url', or a url) to filepath in chunks.
+        The file is written to filepath + '.part' and renamed when complete, so an interrupted
+        download does not leave a truncated file at filepath.
+        Returns (bytes written, hex digest).
+        """
+        url = attachment['url'] if isinstance(attachment, dict) else attachment
+        url = urljoin(self.BaseUrl, url)
+        total = int(attachment.get('fileSize') or 0) if isinstance(attachment, dict) else 0
+        digest = hashlib.new(self.Digesttype) if self.Digesttype else None
+        nbytes = 0
+        partpath = filepath + '.part'
+        response = self.Opener.open(Request(url))
+        try:
+            with open(partpath, 'wb') as fd:
+                while True:
+                    chunk = response.read(self.Chunksize)
+                    if not chunk:
+                        break
+                    fd.write(chunk)
+                    nbytes += len(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+                    if progress:
+                        progress(nbytes, total)
+        except Exception:
+            # e.g. http.client.IncompleteRead if the connection is closed early.
+            if os.path.exists(partpath):
+                os.remove(partpath)
+            raise
+        finally:
+            response.close()
+        if total and nbytes != total:
+            os.remove(partpath)
+            raise IOError("Incomplete download of %s: got %s of %s bytes." % (url, nbytes, total))
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        os.rename(partpath, filepath)
+        logger.info("Downloaded %s bytes from %s to %s", nbytes, url, filepath)
+        return nbytes, digest.hexdigest() if digest is not None else None
+
+    def _getJson(self, path):
+        """ GET BaseUrl + path and return the decoded json response. """
+        response = self.Opener.open(Request(urljoin(self.BaseUrl, path), headers={'Accept': 'application/json'}))
+        try:
+            return json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+
+    def findAttachmentId(self, pageid, filename):
+        """ Returns the id of page pageid's attachment with filename, or None if there is none. """
+        result = self._getJson('rest/api/content/%s/child/attachment?filename=%s' % (pageid, quote(filename)))
+        return next((att['id'] for att in result.get('results', []) if att.get('title') == filename), None)
+
+    def upload(self, pageid, filepath, comment=None, progress=None, attachmentid=None):
+        """
+        Uploads filepath as an attachment to page pageid, streaming the file in chunks.
+        If the page already has an attachment with the same filename (attachmentid, or looked up with
+        findAttachmentId if not given), a new version of that attachment is uploaded; otherwise a new
+        attachment is created.
+        Returns (attachment response (decoded json, if possible), hex digest).
+        """
+        if attachmentid is None:
+            attachmentid = self.findAttachmentId(pageid, os.path.basename(filepath))
+        if attachmentid is not None:
+            url = urljoin(self.BaseUrl, 'rest/api/content/%s/child/attachment/%s/data' % (pageid, attachmentid))
+        else:
+            url = urljoin(self.BaseUrl, 'rest/api/content/%s/child/attachment' % pageid)
+        body = MultipartFileBody(filepath, comment=comment, digesttype=self.Digesttype, progress=progress)
+        request = Request(url, data=body, headers={'Content-Type': body.ContentType,
+                                                   'Content-Length': str(len(body)),
+                                                   'X-Atlassian-Token': 'no-check'})
+        try:
+            response = self.Opener.open(request)
+            try:
+                result = response.read()
+            finally:
+                response.close()
+        finally:
+            body.close()
+        try:
+            result = json.loads(result.decode('utf-8'))
+        except ValueError:
+            pass
+        logger.info("Uploaded %s (%s bytes) to page %s", filepath, body.Filesize, pageid)
+        return result, body.hexdigest()
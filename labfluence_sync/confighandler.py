@@ -73,6 +73,7 @@ import os
 import os.path
 import yaml
 import json
+import threading
 from datetime import datetime
 import collections
 from collections import OrderedDict
@@ -84,6 +85,7 @@ except ImportError:
     from Tkinter import TclError # Python 2
 
 from pathutils import getPathParents
+from tracing import traced
 
 MODELDIR = os.path.dirname(os.path.realpath(__file__))
 APPDIR = os.path.dirname(MODELDIR)
@@ -123,8 +125,8 @@ def check_cfgs_and_merge(cfginmemory, cfgfromfile):
         i.e. the keys that are present in one of the configs but not the other.
 
     """
-    #keysupdatedinmemory = set()
-    #keysupdatedfromfile = set()
+    keysupdatedinmemory = set()
+    keysupdatedfromfile = set()
     if not 'lastsaved' in cfgfromfile or cfgfromfile['lastsaved'] <= cfginmemory.get('lastsaved', datetime.fromordinal(1)):
         # cfgfromfile is NOT newer (they might be the same)
         # check what has been updated in cfginmemory since last save:
@@ -190,10 +192,17 @@ def saveConfig(outputfn, config, updatelastsaved=True):
         # because yaml.dumper.Emitter checks if width > self.best_indent*2 (and reverts to 80 otherwise)
         # setting width=400 to only wrap very long lines...
         # line_break is the line-termination (EOL) character.
+        old_lastsaved = config.get('lastsaved')
         if updatelastsaved:
-            old_lastsaved = config.get('lastsaved')
             config['lastsaved'] = datetime.now()
-        yaml.dump(config, open(outputfn, 'wb'), default_flow_style=False, width=400)
+        # Dump to a temporary file that replaces the config file when complete,
+        # so an interrupted save never leaves a partially written config:
+        tmpfn = outputfn + '.tmp'
+        with open(tmpfn, 'w') as fd:
+            yaml.dump(config, fd, default_flow_style=False, width=400)
+        if not hasattr(os, 'replace') and os.path.exists(outputfn):
+            os.remove(outputfn)     # python 2 (os.rename does not replace on Windows)
+        getattr(os, 'replace', os.rename)(tmpfn, outputfn)
         logger.info("Config saved to file: %s", outputfn)
         return True
     except IOError as e:
@@ -210,7 +219,7 @@ def loadConfig(inputfn, storage_format='yaml'):
         if storage_format == 'json':
             cfg = json.load(fd)
         else:
-            cfg = yaml.load(fd)
+            cfg = yaml.load(fd, Loader=getattr(yaml, 'UnsafeLoader', yaml.Loader))
     return cfg
 
 def _printConfig(config, indent=2):
@@ -292,6 +301,8 @@ class ConfigHandler(object):
         # Attributes for the callback system:
         self.EntryChangeCallbacks = dict()   # dict with: config_key : <list of callbacks>
         self.ChangedEntriesForCallbacks = set() # which config keys has been changed.
+        # Lock for config writes, e.g. when experiments are loaded from several threads (ExperimentManager.hydrateExperiments):
+        self.Lock = threading.RLock()
         logger.debug("ConfigPaths : %s", self.ConfigPaths)
 
 
@@ -407,8 +418,9 @@ class ConfigHandler(object):
             if key in config:
                 return config[key]
         # If key is not found, set default in default config (usually 'user')
-        val = self.Configs[self.DefaultConfig].setdefault(key, value)
-        self.ChangedEntriesForCallbacks.add(key)
+        with self.Lock:
+            val = self.Configs[self.DefaultConfig].setdefault(key, value)
+            self.ChangedEntriesForCallbacks.add(key)
         if autosave:
             self.saveConfig(self.DefaultConfig)
         return val
@@ -449,13 +461,14 @@ class ConfigHandler(object):
             if cfgtype is None:
                 cfgtype = self.DefaultConfig
         # Set config key to value:
-        try:
-            self.Configs.get(cfgtype)[key] = value
-        except TypeError:
-            logger.warning("TypeError when trying to set key '%s' in cfgtype '%s', self.Configs.get('%s') returned: %s, self.Configs.keys(): %s",
-                           key, cfgtype, cfgtype, self.Configs.get(cfgtype), self.Configs.keys())
-            return False
-        self.ChangedEntriesForCallbacks.add(key)
+        with self.Lock:
+            try:
+                self.Configs.get(cfgtype)[key] = value
+            except TypeError:
+                logger.warning("TypeError when trying to set key '%s' in cfgtype '%s', self.Configs.get('%s') returned: %s, self.Configs.keys(): %s",
+                               key, cfgtype, cfgtype, self.Configs.get(cfgtype), self.Configs.keys())
+                return False
+            self.ChangedEntriesForCallbacks.add(key)
         logger.debug("cfgtype:key=type(value) | %s:%s=%s", cfgtype, key, type(value))
         if autosave:
             logger.debug("Autosaving config: %s", cfgtype)
@@ -918,6 +931,7 @@ class ExpConfigHandler(ConfigHandler):
         in the relative directory 'setup/configs/test_configs/local_test_setup_1'.
 
     """
+    @traced('ExpConfigHandler.__init__')
     def __init__(self, systemconfigfn=None, userconfigfn=None, expconfigfn=None,
                  readfiles=True, pathscheme='default1', hierarchy_rootdir_config_key='local_exp_rootDir',
                  enableHierarchy=True):
@@ -1051,9 +1065,10 @@ class ExpConfigHandler(ConfigHandler):
         updated based on the the config from file.
         """
         exps = self.HierarchicalConfigHandler.Configs
-        cfg = exps.setdefault(path, dict())
-        if props:
-            cfg.update(props)
+        with self.HierarchicalConfigHandler.Lock:
+            cfg = exps.setdefault(path, dict())
+            if props:
+                cfg.update(props)
         if update:
             self.loadExpConfig(path, doloadparent='never', update=update)
         self.saveExpConfig(path)
@@ -1085,11 +1100,14 @@ class HierarchicalConfigHandler(object):
     Notice that I originally intended to always automatically load the hierarchy;
     however, it is probably better to do this dynamically/on request, to speed up startup time.
 
+    Configs may be loaded and saved from several threads (see ExperimentManager.hydrateExperiments).
+    Config files are read outside the lock, but all changes to self.Configs are done while holding self.Lock.
     """
     def __init__(self, rootdir, ignoredirs=None, parent=None, doautoloadroothierarchy=False, VERBOSE=0):
         self.VERBOSE = VERBOSE
         self._parent = parent
         self.Configs = dict() # dict[path] --> yaml config
+        self.Lock = threading.RLock()
         self.ConfigSearchFn = '.labfluence.yml'
         self.Rootdir = rootdir
         if ignoredirs is None:
@@ -1129,10 +1147,10 @@ class HierarchicalConfigHandler(object):
         """
         Implemented dynamic read; will try to load if config if not already loaded.
         """
-        if path not in self.Configs:
-            return self.loadConfig(path)
-        else:
+        try:
             return self.Configs[path]
+        except KeyError:
+            return self.loadConfig(path)
 
 
     def getConfigFileAndDirPath(self, path):
@@ -1183,14 +1201,15 @@ class HierarchicalConfigHandler(object):
         try:
             #cfg = yaml.load(open(fpath))
             cfg = loadConfig(fpath)
-            if update and dpath in self.Configs:
-                if update == 'file':
-                    cfg.update(self.Configs[dpath])
+            with self.Lock:
+                if update and dpath in self.Configs:
+                    if update == 'file':
+                        cfg.update(self.Configs[dpath])
+                        self.Configs[dpath] = cfg
+                    elif update == 'memory':
+                        self.Configs[dpath].update(cfg)
+                else:
                     self.Configs[dpath] = cfg
-                elif update == 'memory':
-                    self.Configs[dpath].update(cfg)
-            else:
-                self.Configs[dpath] = cfg
         except IOError as e:
             if self.VERBOSE:
                 logger.warning("HierarchicalConfigHandler.loadConfig() :: Could not open path '%s'. Error is: %s", path, e)
@@ -1199,7 +1218,9 @@ class HierarchicalConfigHandler(object):
                              but it does exists (maybe directory or broken link);
                              I cannot just create a new config then.""", path)
                 raise IOError(e)
-            cfg = self.Configs[dpath] = dict() # Best thing is probably to create a new dict then...
+            with self.Lock:
+                # Another thread may have created the config while we tried to read the file:
+                cfg = self.Configs.setdefault(dpath, dict()) # Best thing is probably to create a new dict then...
         parentdirpath = os.path.dirname(dpath)
         if (doloadparent == 'new' and parentdirpath not in self.Configs) or doloadparent == 'reload':
             self.loadConfig(parentdirpath, doloadparent='never')
@@ -1237,19 +1258,20 @@ class HierarchicalConfigHandler(object):
 
         # EDIT: It is no longer possible to 'skip' the check, but you can
         # make sure that cfg will override, by setting cfg['lastsaved'] = datetime.now() - although that is a hack.
-        try:
-            cfgfromfile = loadConfig(fpath)
-        except IOError as e:
-            logger.debug("Could not load file '%s', it probably doesn't exists yet (will be the case for all newly created experiments): %s", fpath, e)
-            keysupdatedfromfile, keysupdatedinmemory, changedkeys = None, None, None
-        else:
-            keysupdatedfromfile, keysupdatedinmemory, changedkeys = check_cfgs_and_merge(cfg, cfgfromfile) # This will merge cfg with the one from file...
-        #if keysupdatedfromfile:
-        #    if self._parent:
-        #        self._parent.invokeEntryChangeCallback(path, keysupdatedfromfile)
+        with self.Lock:
+            try:
+                cfgfromfile = loadConfig(fpath)
+            except IOError as e:
+                logger.debug("Could not load file '%s', it probably doesn't exists yet (will be the case for all newly created experiments): %s", fpath, e)
+                keysupdatedfromfile, keysupdatedinmemory, changedkeys = None, None, None
+            else:
+                keysupdatedfromfile, keysupdatedinmemory, changedkeys = check_cfgs_and_merge(cfg, cfgfromfile) # This will merge cfg with the one from file...
+            #if keysupdatedfromfile:
+            #    if self._parent:
+            #        self._parent.invokeEntryChangeCallback(path, keysupdatedfromfile)
 
-        #cfg['lastsaved'] = datetime.now() # This is now added by saveConfig()
-        res = saveConfig(fpath, cfg, updatelastsaved=True)
+            #cfg['lastsaved'] = datetime.now() # This is now added by saveConfig()
+            res = saveConfig(fpath, cfg, updatelastsaved=True)
         logger.debug("%s :: saveConfig(%s, <cfg>) returned: '%s'", self.__class__.__name__, fpath, res)
         return keysupdatedfromfile, keysupdatedinmemory, changedkeys
 
@@ -1260,7 +1282,8 @@ class HierarchicalConfigHandler(object):
         Note: This only works for regular dicts;
         for OrderedDict you probably need to rebuild...
         """
-        self.Configs[newpath] = self.Configs.pop(oldpath)
+        with self.Lock:
+            self.Configs[newpath] = self.Configs.pop(oldpath)
 
 
 
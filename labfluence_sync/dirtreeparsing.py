@@ -24,10 +24,100 @@ Utility functions for parsing directory trees.
 from __future__ import print_function
 from six import string_types
 import os
+import re
+from datetime import date, datetime
+try:
+    from sys import intern
+except ImportError:
+    pass    # python 2: intern is a builtin
 import logging
 logger = logging.getLogger(__name__)
 
 
+def expidIndex(expid):
+    """
+    Returns the numeric part of an expid as an int, e.g. 340 for 'RS340', or -1 if there is no number.
+    Use this to compare expids; plain string comparison fails once expids have different widths ('RS99' > 'RS100').
+    """
+    match = re.search(r"([0-9]+)", expid or '')
+    return int(match.group(1)) if match else -1
+
+
+def parseDate(datestr):
+    """
+    Parse a date string as used in folder names and on the command line, e.g. '20140301' or '2014-03-01'.
+    Returns a datetime.date, or None if datestr cannot be parsed.
+    """
+    if not datestr:
+        return None
+    if isinstance(datestr, datetime):
+        return datestr.date()
+    if isinstance(datestr, date):
+        return datestr
+    digits = re.sub(r"[^0-9]", "", datestr)
+    try:
+        return datetime.strptime(digits[:8], "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+class ExpFilter(object):
+    """
+    Match filter used to prune the directory tree traversal early, e.g. to only
+    sync experiments with expid index >= 340 or only experiments from the last two years.
+    Instances are callable with signature (schemekey, match) -> bool, so they can be passed
+    as matchfilter to genPathmatchTupsByPathscheme: Year folders older than the
+    requested date are skipped without being listed, and so are experiment folders
+    (and the subentries below them) with a lower expid index or an older date.
+    Folders where the information is not available (e.g. no date in the folder name) are kept.
+
+    Args:
+        :since_expid:   Only include experiments with expid index >= that of since_expid, e.g. 'RS340'.
+        :since_date:    Only include folders dated on or after this date ('20140301', '2014-03-01' or a date).
+        :last_n_years:  Only include folders from the last n years (converted to a since_date).
+    Raises ValueError if since_expid has no number or since_date cannot be parsed
+    (rather than silently not filtering).
+    """
+    def __init__(self, since_expid=None, since_date=None, last_n_years=None):
+        self.SinceExpid = since_expid
+        self.MinExpIndex = expidIndex(since_expid) if since_expid else None
+        if self.MinExpIndex is not None and self.MinExpIndex < 0:
+            raise ValueError("Invalid since_expid '%s': no expid number." % since_expid)
+        if since_date and parseDate(since_date) is None:
+            raise ValueError("Invalid since_date '%s': expected e.g. '20140301' or '2014-03-01'." % since_date)
+        since_date = parseDate(since_date)
+        if last_n_years:
+            today = date.today()
+            years_date = date(today.year - int(last_n_years), today.month, min(today.day, 28))
+            since_date = max(since_date, years_date) if since_date else years_date
+        self.SinceDate = since_date
+
+    def __repr__(self):
+        return "ExpFilter(since_expid=%r, since_date=%r)" % (self.SinceExpid, self.SinceDate)
+
+    def __bool__(self):
+        return self.MinExpIndex is not None or self.SinceDate is not None
+    __nonzero__ = __bool__  # python 2
+
+    def __call__(self, schemekey, match):
+        """ Returns True if the folder for <match> at level <schemekey> should be included. """
+        gd = match.groupdict()
+        if self.SinceDate is not None:
+            year = gd.get('year')
+            if not year and schemekey.startswith('year'):
+                yearmatch = re.match(r"([0-9]{4})", match.string)
+                year = yearmatch.group(1) if yearmatch else None
+            if year and year.isdigit() and int(year) < self.SinceDate.year:
+                return False
+            folderdate = parseDate(next((gd[k] for k in ('date', 'date1', 'date2') if gd.get(k)), None))
+            if folderdate and folderdate < self.SinceDate:
+                return False
+        if self.MinExpIndex is not None and gd.get('expid'):
+            if expidIndex(gd['expid']) < self.MinExpIndex:
+                return False
+        return True
+
+
 
 
 def getFolderschemeUpTo(folderscheme, rightmost):
@@ -45,7 +135,7 @@ def getFolderschemeUpTo(folderscheme, rightmost):
 
 def genPathmatchTupsByPathscheme(basepath, folderscheme, regexs,
                                  filterfun=None, matchcombiner=None, matchinit=None,
-                                 rightmost=None, fs=None):
+                                 rightmost=None, fs=None, matchfilter=None):
     """
     Args:
         :basepath:      Where to start, e.g. '/User/me/experiments/'
@@ -65,6 +155,9 @@ def genPathmatchTupsByPathscheme(basepath, folderscheme, regexs,
         :rightmost:     Convenience parameter to truncate the folderscheme, e.g. with rightmost='experiment'
                         the folderscheme above is converted to './year/experiment'
         :fs:            The filesystem module to use. By default, this is just the 'os' standard python module.
+        :matchfilter:   A function (schemekey, match) -> bool, applied to each regex match during traversal.
+                        Folders for which it returns False are pruned, i.e. not included and not recursed into.
+                        See ExpFilter for an example.
 
 
     Edits/Changelog:
@@ -166,9 +259,10 @@ def genPathmatchTupsByPathscheme(basepath, folderscheme, regexs,
         # Make tuples with folder path and regex match
         pathmatchtup = ((fs.path.join(basefolder, foldername), regexpat.match(foldername))
                         for foldername in foldernames)
-        # Filter out non-matches and create result with matchcombiner.
+        # Filter out non-matches (and matches rejected by matchfilter) and create result with matchcombiner.
         foldertups = ((folderpath, matchcombiner(basematch, schemekey, match))
-                      for folderpath, match in pathmatchtup if match)
+                      for folderpath, match in pathmatchtup
+                      if match and (matchfilter is None or matchfilter(schemekey, match)))
 
         """
         # This is the part that actually produces the flat/linear two-tuple output.
@@ -209,7 +303,7 @@ def genPathmatchTupsByPathscheme(basepath, folderscheme, regexs,
 
 
 def genPathGroupdictTupByPathscheme(basepath, folderscheme, regexs,
-                                    fs=None, filterfun=None, rightmost=None):
+                                    fs=None, filterfun=None, rightmost=None, matchfilter=None):
     """
     Example to demonstrate how to use the matchcombiner argument in self.genPathmatchTupsByPathscheme.
     This also sets a starting basematch using matchinit argument (rather than handling the case in matchcombiner).
@@ -230,7 +324,7 @@ def genPathGroupdictTupByPathscheme(basepath, folderscheme, regexs,
         return dict(basematch, **match.groupdict())
     return genPathmatchTupsByPathscheme(basepath=basepath, folderscheme=folderscheme, regexs=regexs, fs=fs,
                                         filterfun=filterfun, matchcombiner=matchcombiner,
-                                        matchinit={}, rightmost=rightmost)
+                                        matchinit={}, rightmost=rightmost, matchfilter=matchfilter)
 
 
 def makeFolderByMatchgroupForScheme(group, basepath, folderscheme, regexs,
@@ -272,3 +366,69 @@ def getFoldersWithSameProperty(group, basepath, folderscheme, regexs,
     if countlim:
         listfoldersbyexp = {expid: folderlist for expid, folderlist in listfoldersbyexp.items() if len(folderlist) >= countlim}
     return listfoldersbyexp
+
+
+def makeFolderIndex(group, basepath, folderscheme, regexs,
+                    fs=None, filterfun=None, rightmost=None, matchfilter=None):
+    """
+    Returns a compact index of the folders in a directory tree, for use with findMismatchingGroups:
+        index[group-values] = ((parentdir, basename), ...)
+    where group-values is e.g. (expid, subentry_idx) if group is ('expid', 'subentry_idx').
+    Parent dirs and basenames are interned, so the many subentry folders below the same
+    experiment folder share a single parentdir string, and basenames that are identical across
+    locations are stored only once. Most groups only have a single folder, but duplicates are kept.
+    Unlike getFoldersWithSameProperty, no per-group lists are created.
+    """
+    if fs is None:
+        fs = os
+    foldermatchtuples = genPathGroupdictTupByPathscheme(basepath, folderscheme, regexs, fs=fs, filterfun=filterfun,
+                                                        rightmost=rightmost, matchfilter=matchfilter)
+    if isinstance(group, (tuple, list)):
+        def groupgetter(match):
+            """ Return tuple (list is not hashable) """
+            return tuple(match[g] for g in group)
+    else:
+        def groupgetter(match):
+            " Just return group "
+            return match[group]
+    index = {}
+    split = fs.path.split
+    for folderpath, matchdict in foldermatchtuples:
+        key = groupgetter(matchdict)
+        parentdir, basename = split(folderpath)
+        entry = (intern(parentdir), intern(basename))
+        # index.get returns () for new keys; concatenating tuples is fine since duplicates are rare.
+        index[key] = index.get(key, ()) + (entry,)
+    return index
+
+
+def _groupSortKey(key):
+    """
+    Sort key for group values (or tuples of group values) that may be None, which happens when a
+    regex group does not participate in the match; None sorts after all other values.
+    """
+    if isinstance(key, tuple):
+        return tuple(_groupSortKey(value) for value in key)
+    return (key is None, str(key))
+
+
+def findMismatchingGroups(indexes):
+    """
+    Hash join of folder indexes (as produced by makeFolderIndex), e.g. one index for the local
+    experiment tree and one for each satellite location.
+    Returns an ordered list of (group, [folderpaths]) for groups where the folder basenames differ
+    between (or within) the indexes, i.e. folders that has been renamed or duplicated.
+    Paths are listed in the order of the indexes, so the first path is from the first index (e.g. local).
+    Only the mismatching groups are materialized; for all others we only compare the (interned) basenames.
+    """
+    firstbasename = {}
+    mismatching = set()
+    for index in indexes:
+        for key, entries in index.items():
+            basename = firstbasename.setdefault(key, entries[0][1])
+            # Interned strings can be compared by identity, fall back to equality for non-interned.
+            if any(entry[1] is not basename and entry[1] != basename for entry in entries):
+                mismatching.add(key)
+    return [(key, [os.path.join(parentdir, basename)
+                   for index in indexes for parentdir, basename in index.get(key, ())])
+            for key in sorted(mismatching, key=_groupSortKey)]
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Module with the ExperimentCatalog, a persisted snapshot of the local experiments.
+
+Without a catalog, ExperimentManager has to list and regex-parse the local experiment directory
+on every startup, and load the .labfluence.yml file and list the subentry folders of each experiment
+before e.g. subentries or wiki page ids are available.
+
+The catalog is a single json file with one entry per experiment:
+    expid, localdir, groupdict, exp_subentries, wiki_pageId, mtimes
+where mtimes are the modification times of the experiment folder and its .labfluence.yml file
+when the entry was recorded. The catalog also records the path and mtime of the directory
+containing the experiment folders.
+
+Entries for new or changed experiments are made from the folder name groupdict only, without loading
+the experiment (exp_subentries and wiki_pageId are then None); they are completed when the
+experiment is loaded (ExperimentManager.updateCatalogEntry), so building the catalog does not
+load all experiments.
+Values that json cannot represent (datetime and date, e.g. in subentries) are stored as
+{"__datetime__": <isoformat>} / {"__date__": <isoformat>} and converted back on load.
+
+On startup, an entry is still valid if the experiment folder and .labfluence.yml have the same mtimes
+(i.e. no subentry folders were added, removed or renamed, and the props file was not saved since).
+Only experiments with stale entries need to be re-parsed.
+If the experiment directory's mtime is unchanged, no experiment folders were added, removed or renamed,
+so the directory does not have to be listed and parsed either.
+
+The catalog is enabled with the config entry 'exp_manager_use_catalog'. The catalog file is
+'local_exp_catalog_path' if given, otherwise experiment_catalog.json in the user config directory.
+
+"""
+from __future__ import print_function
+import os
+import json
+from datetime import datetime, date
+import logging
+logger = logging.getLogger(__name__)
+
+
+CATALOG_VERSION = 2     # 2: datetimes are stored as {"__datetime__": <isoformat>} (version 1 used str()).
+
+
+def _jsonDefault(obj):
+    """ json.dump default: datetime and date -> tagged isoformat dicts (see _jsonObjectHook). """
+    if isinstance(obj, datetime):
+        return {'__datetime__': obj.isoformat()}
+    if isinstance(obj, date):
+        return {'__date__': obj.isoformat()}
+    raise TypeError("%r is not JSON serializable" % (obj, ))
+
+def _jsonObjectHook(obj):
+    """ json.load object_hook: converts the dicts made by _jsonDefault back to datetime and date. """
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            dtstr = obj['__datetime__']
+            return datetime.strptime(dtstr, "%Y-%m-%dT%H:%M:%S.%f" if '.' in dtstr else "%Y-%m-%dT%H:%M:%S")
+        if '__date__' in obj:
+            return datetime.strptime(obj['__date__'], "%Y-%m-%d").date()
+    return obj
+
+
+def getMtime(path):
+    """ Returns the modification time of path, or None if path does not exist. """
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class ExperimentCatalog(object):
+    """
+    Persisted snapshot of the local experiments, see module docstring.
+
+    Args:
+        :filepath:      Path of the json catalog file.
+        :configfn:      Name of the experiment props file, whose mtime is recorded for each experiment.
+    """
+
+    def __init__(self, filepath, configfn='.labfluence.yml'):
+        self.Filepath = os.path.expanduser(filepath)
+        self.ConfigFn = configfn
+        self.Entries = {}       # expid -> entry dict
+        self.Expsdir = None     # The directory with the experiment folders,
+        self.ExpsdirMtime = None    # and its mtime when the catalog was made.
+        self.Changed = False
+
+    def __repr__(self):
+        return "ExperimentCatalog('%s', %s entries)" % (self.Filepath, len(self.Entries))
+
+    def load(self):
+        """
+        Loads the catalog from self.Filepath.
+        Returns True if the catalog was loaded, False if the file does not exist or cannot be used.
+        """
+        try:
+            with open(self.Filepath) as fd:
+                catalog = json.load(fd, object_hook=_jsonObjectHook)
+        except (IOError, OSError, ValueError) as e:
+            logger.info("Could not load experiment catalog %s: %s", self.Filepath, e)
+            return False
+        if catalog.get('version') != CATALOG_VERSION:
+            logger.info("Experiment catalog %s has version %s, expected %s; ignoring it.",
+                        self.Filepath, catalog.get('version'), CATALOG_VERSION)
+            return False
+        self.Expsdir = catalog.get('expsdir')
+        self.ExpsdirMtime = catalog.get('expsdir_mtime')
+        self.Entries = {entry['expid']: entry for entry in catalog.get('experiments', [])}
+        self.Changed = False
+        logger.debug("Loaded experiment catalog %s with %s entries.", self.Filepath, len(self.Entries))
+        return True
+
+    def save(self):
+        """ Saves the catalog to self.Filepath (via a temporary file, so a crash does not leave a broken catalog). """
+        dirname = os.path.dirname(self.Filepath)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        catalog = dict(version=CATALOG_VERSION, expsdir=self.Expsdir, expsdir_mtime=self.ExpsdirMtime,
+                       experiments=[self.Entries[expid] for expid in sorted(self.Entries)])
+        tmppath = self.Filepath + '.tmp'
+        with open(tmppath, 'w') as fd:
+            json.dump(catalog, fd, default=_jsonDefault)
+        if os.path.exists(self.Filepath):
+            os.remove(self.Filepath)    # os.rename does not overwrite on Windows.
+        os.rename(tmppath, self.Filepath)
+        self.Changed = False
+        logger.info("Saved experiment catalog with %s entries to %s", len(self.Entries), self.Filepath)
+
+    def statExperiment(self, localdir):
+        """ Returns [folder mtime, props file mtime] for the experiment folder localdir. """
+        return [getMtime(localdir), getMtime(os.path.join(localdir, self.ConfigFn))]
+
+    def isExpsdirValid(self, expsdir):
+        """ Returns True if the catalog was made for expsdir, and expsdir has not been modified since. """
+        return bool(self.Entries) and self.Expsdir == expsdir and self.ExpsdirMtime == getMtime(expsdir)
+
+    def isValid(self, entry):
+        """ Returns True if the experiment folder and props file of a catalog entry are unchanged. """
+        return self.statExperiment(entry['localdir']) == entry.get('mtimes')
+
+    def setExpsdir(self, expsdir):
+        """ Record expsdir (and its current mtime) as the directory with the experiment folders. """
+        mtime = getMtime(expsdir)
+        if (self.Expsdir, self.ExpsdirMtime) != (expsdir, mtime):
+            self.Expsdir, self.ExpsdirMtime = expsdir, mtime
+            self.Changed = True
+
+    def getPathGroupdictTuples(self):
+        """ Returns (localdir, groupdict) tuples for all entries, as returned by getLocalExpsDirGroupdictTuples. """
+        return [(entry['localdir'], dict(entry['groupdict'])) for entry in self.Entries.values()]
+
+    def getValidEntry(self, expid, localdir):
+        """ Returns the entry for expid if it is for localdir and is still valid, otherwise None. """
+        entry = self.Entries.get(expid)
+        if entry is not None and entry['localdir'] == localdir and self.isValid(entry):
+            return entry
+        return None
+
+    def updateEntry(self, expid, localdir, groupdict, subentries=None, wiki_pageId=None):
+        """
+        Adds or updates the entry for expid, recording the current mtimes of the experiment folder.
+        subentries and wiki_pageId are None if the experiment has not been loaded.
+        """
+        self.Entries[expid] = dict(expid=expid, localdir=localdir, groupdict=groupdict,
+                                   exp_subentries=subentries, wiki_pageId=wiki_pageId,
+                                   mtimes=self.statExperiment(localdir))
+        self.Changed = True
+
+    def removeMissing(self, expids):
+        """ Removes entries for experiments that are not in expids. """
+        expids = set(expids)
+        for expid in [expid for expid in self.Entries if expid not in expids]:
+            del self.Entries[expid]
+            self.Changed = True
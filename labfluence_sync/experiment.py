@@ -91,6 +91,10 @@ Changes:
 import os
 import yaml
 import re
+import time
+import atexit
+import threading
+import copy
 from datetime import datetime
 from collections import OrderedDict
 from operator import itemgetter
@@ -107,6 +111,187 @@ from decorators.cache_decorator import cached_property
 from labfluencebase import LabfluenceBase
 
 
+# Compiled wiki regexes, keyed by (regex or format, expid), and parsed wiki subentries, keyed by
+# (page id, page version, expid, ...). Journal pages can be large, and the page usually has not changed
+# since it was last parsed, see parseSubentriesFromWikipage. Both are LRU caches with a max size.
+_wikiregexcache = OrderedDict()
+_wikiregexcachelock = threading.Lock()
+WIKI_REGEX_CACHE_SIZE = 512
+_wikisubentriescache = OrderedDict()
+_wikisubentriescachelock = threading.Lock()
+WIKI_SUBENTRIES_CACHE_SIZE = 256
+
+
+class PropsWriteBehind(object):
+    """
+    Debounced write-behind of experiment props (.labfluence.yml files).
+
+    With 'exp_props_save_delay' > 0 in the config, Experiment.saveProps() does not write immediately,
+    but schedules the experiment here; repeated saves of the same experiment within the delay are
+    coalesced into a single write, made by a background thread when the experiment has not been
+    saved for <delay> seconds (or at the latest <maxdelayfactor> x delay after the first pending save).
+    Pending writes are flushed by Experiment.saveAll(), Experiment.saveProps(now=True) and at exit.
+
+    An experiment is kept (as in-flight) until its write has succeeded; a write that fails is
+    re-scheduled <delay> seconds later. flush() and cancel() first wait for a write that is in
+    progress, so a flush at exit does not return while the background thread is writing a file.
+    """
+
+    def __init__(self, maxdelayfactor=5):
+        self.MaxDelayFactor = maxdelayfactor
+        self._pending = OrderedDict()   # id(experiment) -> [experiment, first scheduled time, due time, delay]
+        self._inflight = {}             # id(experiment) -> pending entry, while its props are being written
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, experiment, delay):
+        """ Schedules (or postpones) writing experiment's props <delay> seconds from now. """
+        now = time.time()
+        with self._cond:
+            entry = self._pending.get(id(experiment))
+            if entry is None:
+                self._pending[id(experiment)] = [experiment, now, now + delay, delay]
+            else:
+                entry[2] = min(now + delay, entry[1] + self.MaxDelayFactor*delay)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='PropsWriteBehind')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+
+    def cancel(self, experiment):
+        """ Removes experiment from the pending writes (after any write in progress); returns True if it was pending. """
+        with self._cond:
+            self._waitInflight([id(experiment)])
+            return self._pending.pop(id(experiment), None) is not None
+
+    def isPending(self, experiment):
+        """ Returns True if experiment has a pending (or in-progress) props write. """
+        with self._cond:
+            return id(experiment) in self._pending or id(experiment) in self._inflight
+
+    def flush(self, experiment=None):
+        """
+        Writes the pending props of experiment (or of all pending experiments) now,
+        after waiting for writes in progress. Writes that fail are re-scheduled.
+        """
+        with self._cond:
+            self._waitInflight(None if experiment is None else [id(experiment)])
+            keys = list(self._pending) if experiment is None else [key for key in [id(experiment)] if key in self._pending]
+            entries = self._take(keys)
+        self._writeEntries(entries)
+
+    def _waitInflight(self, keys=None):
+        """ Waits until no write of keys (default: of any experiment) is in progress. Call holding self._cond. """
+        while self._inflight if keys is None else any(key in self._inflight for key in keys):
+            self._cond.wait()
+
+    def _take(self, keys):
+        """ Moves the pending entries of keys to in-flight and returns them. Call holding self._cond. """
+        entries = [(key, self._pending.pop(key)) for key in keys]
+        self._inflight.update(entries)
+        return entries
+
+    def _writeEntries(self, entries):
+        """ Writes the props of (key, entry) entries; entries that fail are re-scheduled. """
+        for key, entry in entries:
+            ok = False
+            try:
+                ok = self._write(entry[0])
+            finally:
+                self._done(key, entry, ok)
+
+    def _done(self, key, entry, ok):
+        """ Removes a written entry from in-flight, re-scheduling it if the write failed. """
+        with self._cond:
+            del self._inflight[key]
+            if not ok and key not in self._pending:
+                # (If the experiment was scheduled again during the write, that write is made instead.)
+                now = time.time()
+                entry[1], entry[2] = now, now + entry[3]
+                self._pending[key] = entry
+            self._cond.notify_all()
+
+    def _write(self, experiment):
+        """ Writes experiment's props, logging (not raising) errors. Returns False if the write failed. """
+        try:
+            experiment._writeProps()    # pylint: disable=W0212
+        except Exception as e:          # pylint: disable=W0703
+            logger.error("Could not save props of experiment %s (will retry): %s", experiment, e)
+            return False
+        return True
+
+    def _run(self):
+        """ Background thread: writes experiments as they become due. """
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.time()
+                due = [key for key, entry in self._pending.items() if entry[2] <= now]
+                if not due:
+                    self._cond.wait(min(entry[2] for entry in self._pending.values()) - now)
+                    continue
+                entries = self._take(due)
+            self._writeEntries(entries)
+
+_propswriter = PropsWriteBehind()
+atexit.register(_propswriter.flush)
+
+
+def compileWikiRegex(regex_fmt, expid=None):
+    """
+    Returns a compiled (DOTALL, MULTILINE) regex for regex_fmt. If expid is given, regex_fmt is
+    formatted with expid and a named subentry_idx group first. Compiled regexes are cached per (regex_fmt, expid).
+    Raises TypeError, AttributeError or KeyError if regex_fmt is None or cannot be formatted
+    (and re.error if the regex is invalid).
+    """
+    key = (regex_fmt, expid)
+    with _wikiregexcachelock:
+        regex_prog = _wikiregexcache.pop(key, None)
+        if regex_prog is not None:
+            _wikiregexcache[key] = regex_prog   # Most recently used last.
+            return regex_prog
+    regex = regex_fmt if expid is None else regex_fmt.format(expid=expid, subentry_idx=r"(?P<subentry_idx>[a-zA-Z]+)")
+    logger.debug("Compiling wiki regex: '%s'", regex)
+    regex_prog = re.compile(regex, flags=re.DOTALL+re.MULTILINE)
+    with _wikiregexcachelock:
+        _wikiregexcache[key] = regex_prog
+        while len(_wikiregexcache) > WIKI_REGEX_CACHE_SIZE:
+            _wikiregexcache.popitem(last=False)
+    return regex_prog
+
+
+def deriveHeaderRegexFmt(subentry_regex_fmt):
+    """
+    Derives a subentry header regex format from a full subentry regex format of the form
+        (?P<subentry_xhtml><header>.*?)<lookahead>
+    i.e. returns <header>, or None if subentry_regex_fmt does not have that form.
+    The header regex can be used with splitWikiSubentries.
+    """
+    prefix, body = '(?P<subentry_xhtml>', '.*?)'
+    if not subentry_regex_fmt or not subentry_regex_fmt.startswith(prefix) or body not in subentry_regex_fmt:
+        return None
+    header = subentry_regex_fmt[len(prefix):subentry_regex_fmt.rindex(body)]
+    return header if '{subentry_idx}' in header else None
+
+
+def splitWikiSubentries(xhtml, header_regex_prog):
+    """
+    Finds subentries in xhtml with a single linear scan for subentry headers, rather than matching each
+    full subentry (header and body) with a DOTALL regex.
+    Yields the groupdict of each header match, with 'subentry_xhtml' set to the xhtml from the header
+    to the next header (or the end of xhtml).
+    """
+    match = header_regex_prog.search(xhtml)
+    while match:
+        nextmatch = header_regex_prog.search(xhtml, match.end())
+        gd = match.groupdict()
+        gd['subentry_xhtml'] = xhtml[match.start():nextmatch.start() if nextmatch else len(xhtml)]
+        yield gd
+        match = nextmatch
+
+
 class Experiment(LabfluenceBase):
     """
     This class is the main model for a somewhat abstract "Experiment".
@@ -152,6 +337,7 @@ class Experiment(LabfluenceBase):
         self._last_attachmentslist = None
         self._exp_regex_prog = None
         self._cache = dict() # cached_property cache
+        self._propslock = threading.RLock() # Held while Props are changed, and while copied for writing (see _writeProps).
         self._allowmanualpropssavetofile = False # Set to true if you want to let this experiment handle Props file persisting without a confighandler.
         self._doserversearch = False
         localdir = localdir or props.get('localdir')
@@ -171,14 +357,16 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         ### Experiment properties/config related
         ### Manual handling is deprecated; Props are now a property that deals soly with confighandler.
         if props:
-            self.Props.update(props)
+            with self._propslock:
+                self.Props.update(props)
             logger.debug("Experiment %s updated with props argument, is now %s", self, self.Props)
         if regex_match:
             gd = regex_match.groupdict()
             # In case the groupdict has multiple date fields, find out which one to use and discart the other keys:
             gd['date'] = next((date for date in [gd.pop(k, None) for k in ('date1', 'date2', 'date')] if date), None)
             ## regex is often_like "(?P<expid>RS[0-9]{3}) (?P<exp_title_desc>.*)"
-            self.Props.update(gd)
+            with self._propslock:
+                self.Props.update(gd)
         elif not 'expid' in self.Props:
             logger.debug("self.Props is still too empty (no expid field). Attempting to populate it using 1) the localdirpath and 2) the wikipage.")
             if self.Foldername:
@@ -206,6 +394,7 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
     def Props(self):
         """
         If localdirpath is provided, use that to get props from the confighandler.
+        Hold self._propslock while changing the returned props.
         """
         if self.Localdirpath:
             props = self.Confighandler.getExpConfig(self.Localdirpath)
@@ -226,14 +415,16 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             if not props.get('wiki_pagetitle') and wikipage and wikipage.Struct \
                         and props.get('wiki_pagetitle') != wikipage.Struct['title']:
                 logger.info("Updating experiment props['wiki_pagetitle'] to '%s'", wikipage.Struct['title'])
-                props['wiki_pagetitle'] = wikipage.Struct['title']
+                with self._propslock:
+                    props['wiki_pagetitle'] = wikipage.Struct['title']
         except AttributeError as e:
             logger.debug("AttributeError: %s", e)
         return props
     @property
     def Subentries(self):
         """Should always be located one place and one place only: self.Props."""
-        return self.Props.setdefault('exp_subentries', OrderedDict())
+        with self._propslock:
+            return self.Props.setdefault('exp_subentries', OrderedDict())
     @Subentries.setter
     def Subentries(self, subentries):
         """
@@ -241,7 +432,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         should be an OrderedDict alá subentries['a'] = dict-with-subentry-props.
         """
         if subentries != self.Props.get('exp_subentries'):
-            self.Props['exp_subentries'] = subentries
+            with self._propslock:
+                self.Props['exp_subentries'] = subentries
             self.invokePropertyCallbacks('Subentries', subentries)
     @property
     def Expid(self):
@@ -253,7 +445,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         if self.Props.get('expid') != expid:
             logger.info("Overriding old self.Expid '%s' with new expid '%s', localpath='%s'",
                         self.Expid, expid, self.Localdirpath)
-            self.Props['expid'] = expid
+            with self._propslock:
+                self.Props['expid'] = expid
             self.invokePropertyCallbacks('Expid', expid)
     @property
     def Wiki_pagetitle(self):
@@ -268,7 +461,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         No. Thus, using self._wikipage and not self.WikiPage.
         """
         if self._wikipage and self._wikipage.PageId:
-            self.Props.setdefault('wiki_pageId', self._wikipage.PageId)
+            with self._propslock:
+                self.Props.setdefault('wiki_pageId', self._wikipage.PageId)
             return self._wikipage.PageId
         elif self.Props.get('wiki_pageId'):
             pageid = self.Props.get('wiki_pageId')
@@ -288,7 +482,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             if self._wikipage.PageId != pageid:
                 self._wikipage.PageId = pageid
                 self._wikipage.reloadFromServer()
-        self.Props['wiki_pageId'] = pageid
+        with self._propslock:
+            self.Props['wiki_pageId'] = pageid
         self.flagPropertyChanged('PageId')
 
 
@@ -446,8 +641,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
     def saveAll(self):
         """
         Method for remembering to do all things that must be saved before closing experiment.
-         - self.Props, dict in .labfluence.yml
-         - self.Fileshistory, dict in .labfluence/files_history.yml
+         - self.Props, dict in .labfluence.yml (including any pending write-behind save)
+         - self.Fileshistory, sqlite store in .labfluence/files_history.sqlite
         What else is stored in <localdirpath>/.labfluence/ ??
          - what about journal assistant files?
 
@@ -455,7 +650,7 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         e.g.
             return self.saveProps() and self.saveFileshistory()
         """
-        self.saveProps()
+        self.saveProps(now=True)
         self.Filemanager.saveFileshistory()
 
 
@@ -489,7 +684,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         only the explicidly loaded 'system', 'user', 'exp', 'cache', etc.
         """
         if cfgkey in self.Props:
-            self.Props[cfgkey] = value
+            with self._propslock:
+                self.Props[cfgkey] = value
         else:
             self.Confighandler.setkey(cfgkey, value)
 
@@ -502,17 +698,39 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
     def saveIfChanged(self):
         """
         Saves props if the self.PropsChanged flag has been switched to True.
-        Can be invoked as frequently as you'd like.
+        Can be invoked as frequently as you'd like; with 'exp_props_save_delay' set,
+        repeated saves are coalesced into a single write (see saveProps).
         """
         if self.PropsChanged:
             self.saveProps()
             self.PropsChanged = False
 
-    def saveProps(self, path=None):
+    def saveProps(self, path=None, now=False):
         """
         Saves content of self.Props to file.
         If a confighandler is attached, allow it to do it; otherwise just persist as yaml to default location.
         Returns True if suceed and false if unsuccessful.
+        If the config entry 'exp_props_save_delay' is set (seconds), and path is not given and now is False,
+        the save is deferred to the PropsWriteBehind thread and coalesced with other saves within the delay;
+        True is then returned when the save has been scheduled.
+        """
+        delay = self.Confighandler.get('exp_props_save_delay', 0) if self.Confighandler else 0
+        if delay and not path and not now and self.Localdirpath:
+            _propswriter.schedule(self, delay)
+            return True
+        _propswriter.cancel(self)
+        return self._writeProps(path)
+
+    def flushProps(self):
+        """ Writes any pending (write-behind) props save now. """
+        _propswriter.flush(self)
+
+    def _writeProps(self, path=None):
+        """
+        Writes self.Props to file (the actual save, see saveProps).
+        Props may be changed by other threads while the write-behind thread is writing,
+        so a copy taken under self._propslock is written, in both branches.
+        The copy is deep, since the subentries are nested dicts.
         """
         logger.debug("(Experiment.saveProps() triggered; confighandler: %s", self.Confighandler)
         if self.VERBOSE > 2:
@@ -521,19 +739,35 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         if not path:
             logger.info("No path provided to saveProps and Experiment.Localdirpath is also '%s'", path)
             return False
+        with self._propslock:
+            props = copy.deepcopy(self.Props)
         if self.Confighandler:
             if not os.path.isdir(path):
                 path = os.path.dirname(path)
+            # The confighandler merges the copy with the file and dumps it while holding its lock:
             logger.debug("Invoking self.Confighandler.saveExpConfig(path=%s)", path)#, self.Props)
             #self.Confighandler.updateAndPersist(path, self.Props)
             # Why use updateAndPersist? If there is a confighandler, just use
-            ret = self.Confighandler.saveExpConfig(path)
+            ret = self.Confighandler.saveExpConfig(path, props)
             logger.debug("self.Confighandler.saveExpConfig returned value: %s", ret)
+            # Bring entries updated from file, and the new 'lastsaved', back into self.Props:
+            keysupdatedfromfile = ret[0] if ret else None
+            with self._propslock:
+                for key in (keysupdatedfromfile or ()):
+                    self.Props[key] = props[key]
+                if 'lastsaved' in props:
+                    self.Props['lastsaved'] = props['lastsaved']
         elif self._allowmanualpropssavetofile:
             if os.path.isdir(path):
                 path = os.path.normpath(os.path.join(self.Localdirpath, self.ConfigFn))
             logger.debug("Experiment.saveProps() :: No confighandler, saving manually to file '%s'", path)
-            yaml.dump(self.Props, open(path, 'wb'))
+            # Dump to a temporary file that replaces the props file when complete.
+            tmppath = path + '.tmp'
+            with open(tmppath, 'w') as fd:
+                yaml.dump(props, fd)
+            if not hasattr(os, 'replace') and os.path.exists(path):
+                os.remove(path)     # python 2 (os.rename does not replace on Windows)
+            getattr(os, 'replace', os.rename)(tmppath, path)
             if self.VERBOSE > 4:
                 logger.debug("Content of exp config/properties file after save:")
                 logger.debug(open(os.path.join(path, self.ConfigFn)).read())
@@ -556,7 +790,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             gd = regex_match.groupdict()
             if next((True for key, value in gd.items() if key not in self.Props or value != self.Props[key]), False):
                 props = self.Props
-                props.update(gd)
+                with self._propslock:
+                    props.update(gd)
                 logger.debug("Props updated using foldername %s and regex, returning groupdict %s", self.Foldername, regex_match.groupdict())
                 if self.SavePropsOnChange:
                     self.saveProps()
@@ -581,7 +816,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             gd = regex_match.groupdict()
             if next((True for key, value in gd.items() if key not in self.Props or value != self.Props[key]), False):
                 props = self.Props
-                props.update(regex_match.groupdict())
+                with self._propslock:
+                    props.update(regex_match.groupdict())
                 logger.debug("Props updated using wikipage.Struct['title'] %s and regex, returning groupdict %s", regex_match.string, regex_match.groupdict())
                 if self.SavePropsOnChange:
                     self.saveProps()
@@ -640,6 +876,21 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         self.Localdirpath = localdirpath
         logger.debug("self.Parentdirpath=%s, self.Foldername=%s, self.Localdirpath=%s", self.Parentdirpath, self.Foldername, self.Localdirpath)
 
+    def detachLocaldir(self):
+        """
+        Detaches the experiment from its local directory, e.g. after the folder has been removed,
+        keeping the props (and wiki page) in memory, as for an experiment that only exists on the wiki.
+        Pending (write-behind) props saves are dropped, since the folder is gone.
+        """
+        with self._propslock:
+            props = dict(self.Props)
+        _propswriter.cancel(self)
+        self.Localdirpath = None
+        self.Foldername = None
+        with self._propslock:
+            self.Props.update(props)
+        self.flagPropertyChanged('Localdirpath')
+
     def _getFoldernameAndParentdirpath(self, localdir):
         """
         Takes a localdir, either absolute or relative (to local_exp_subDir),
@@ -735,6 +986,7 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             else:
                 logger.warning("renameLocaldir with relative foldername is only allowed if exp Parentdirpath has been set; ABORTING... (newfolder = %s)", newfolder)
                 return False
+        _propswriter.flush(self)    # Pending saves are for the old path.
         try:
             os.rename(oldlocaldirpath, newlocaldirpath)
         except (OSError, IOError) as e:
@@ -761,6 +1013,7 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         oldpath = self.Localdirpath
         logger.info("Renaming exp folder: %s -> %s", oldpath, newpath)
         #os.rename(oldname_full, newname_full)
+        _propswriter.flush(self)    # Pending saves are for the old path.
         self.Localdirpath = newpath
         self.Foldername = newname
         # Note: there is NO reason to have a key 'dirname' in self.Props;
@@ -793,7 +1046,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             elif createNonexisting:
                 logger.info("Making new subentry folder: %s", newname_full)
                 #os.mkdir(newname_full)
-            subentry['dirname'] = newname
+            with self._propslock:
+                subentry['dirname'] = newname
 
     def sortSubentrires(self):
         """
@@ -835,7 +1089,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         subentry = dict(subentry_idx=subentry_idx, subentry_titledesc=subentry_titledesc, date=subentry_date, datetime=subentry_datetime)
         if extraprops:
             subentry.update(extraprops)
-        self.Subentries[subentry_idx] = subentry
+        with self._propslock:
+            self.Subentries[subentry_idx] = subentry
         if makefolder:
             self.makeSubentryFolder(subentry_idx)
         if makewikientry:
@@ -920,7 +1175,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         except OSError as e:
             logger.error("ERROR making new folder: '%s'; Will return False; OSError is: '%s'", newfolderpath, e)
             return False
-        subentry['foldername'] = subentry_foldername
+        with self._propslock:
+            subentry['foldername'] = subentry_foldername
         if self.SavePropsOnChange:
             self.saveProps()
         return subentry_foldername
@@ -931,10 +1187,11 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         Make sure all subentries are initiated up to subentry <subentry_idx>.
         """
         count = 0
-        for idx in idx_generator(subentry_idx):
-            if idx not in self.Subentries:
-                self.Subentries[idx] = dict()
-                count += 1
+        with self._propslock:
+            for idx in idx_generator(subentry_idx):
+                if idx not in self.Subentries:
+                    self.Subentries[idx] = dict()
+                    count += 1
         if count:
             self.invokePropertyCallbacks('Subentries', self.Subentries)
 
@@ -968,7 +1225,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             # Note that if subentry_idx is not present, simply making a new index could be dangerous; what if the directories are not sorted and the next index is not right?
             # check whether something will be updated:
             if next((True for key, value in gd.items() if key not in subentries or value != subentries[key]), False):
-                subentries.setdefault(idx, dict()).update(gd)
+                with self._propslock:
+                    subentries.setdefault(idx, dict()).update(gd)
                 count += 1
         if count:
             self.invokePropertyCallbacks('Subentries', subentries)
@@ -992,30 +1250,62 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         If return_subentry_xhtml is set to True, then the subentry-dict in the returned subentries dict
         will include the current xhtml source for that subentry. This is generally NOT desired.
         Note: wikipage is a WikiPage object, not a page struct.
+
+        Compiled regexes are cached (see compileWikiRegex), and when parsing a wikipage, the parsed
+        subentries are memoized per (page id, page version), so an unchanged page is only parsed once.
+        Subentries are found with a linear scan for subentry headers (splitWikiSubentries), rather than
+        matching the full wiki_subentry_regex_fmt regex (header and body) over the page. The header regex is
+        config entry 'wiki_subentry_header_regex_fmt' if set (a regex matching only the subentry header,
+        with the same groups as wiki_subentry_regex_fmt except subentry_xhtml), otherwise it is derived
+        from wiki_subentry_regex_fmt (see deriveHeaderRegexFmt). The derived header regex is not used if
+        return_subentry_xhtml is True, since the subentry xhtml would then extend to the next subentry header
+        rather than to the end defined by wiki_subentry_regex_fmt; neither is it used if it cannot be derived.
         """
         ### Uh, it would seem that the wiki_experiment_section config entry has gone missing,
         ### returning none until it is back up.
+        expsection_regex = self.getConfigEntry('wiki_experiment_section')
+        subentry_regex_fmt = self.getConfigEntry('wiki_subentry_regex_fmt')
+        header_regex_fmt = self.getConfigEntry('wiki_subentry_header_regex_fmt')
+        if not header_regex_fmt and not return_subentry_xhtml:
+            header_regex_fmt = deriveHeaderRegexFmt(subentry_regex_fmt)
+        cachekey = None
         if xhtml is None:
             if wikipage is None:
                 wikipage = self.WikiPage
             xhtml = wikipage.Content
+            version = (wikipage.Struct or {}).get('version')
+            if version is not None:
+                cachekey = (wikipage.PageId, version, self.Expid, expsection_regex,
+                            header_regex_fmt or subentry_regex_fmt, return_subentry_xhtml)
+                with _wikisubentriescachelock:
+                    cached = _wikisubentriescache.pop(cachekey, None)
+                    if cached is not None:
+                        _wikisubentriescache[cachekey] = cached     # Most recently used last.
+                if cached is not None:
+                    logger.debug("Using cached subentries for wiki page %s version %s", wikipage.PageId, version)
+                    # Return copies, the subentry dicts are typically merged into self.Subentries:
+                    return OrderedDict((idx, dict(gd)) for idx, gd in cached.items())
         # GENERATE required regex programs:
         try:
-            expsection_regex_prog = re.compile(self.getConfigEntry('wiki_experiment_section'), flags=re.DOTALL+re.MULTILINE)
+            expsection_regex_prog = compileWikiRegex(expsection_regex)
             logger.debug("wiki_experiment_section regex is: %s", expsection_regex_prog.pattern)
         except TypeError as e:
             logger.warning("TypeError: %s while creating regex prog; self.getConfigEntry('wiki_experiment_section')=%s; (If None, then 'wiki_experiment_section' is probably not set in config) - ABORTING...",
-                           e, self.getConfigEntry('wiki_experiment_section'))
+                           e, expsection_regex)
             return
         try:
-            subentry_regex_fmt = self.getConfigEntry('wiki_subentry_regex_fmt')
-            logger.debug("wiki_subentry_regex_fmt is: '%s'", subentry_regex_fmt)
-            subentry_regex = subentry_regex_fmt.format(expid=self.Expid, subentry_idx=r"(?P<subentry_idx>[a-zA-Z]+)") # alternatively, throw in **self.Props
-            logger.debug("Subentry regex after format substitution: '%s'", subentry_regex)
-            subentry_regex_prog = re.compile(subentry_regex, flags=re.DOTALL+re.MULTILINE)
-        except (TypeError, KeyError) as e:
+            logger.debug("wiki_subentry_regex_fmt is: '%s', wiki_subentry_header_regex_fmt is: '%s'", subentry_regex_fmt, header_regex_fmt)
+            if header_regex_fmt:
+                try:
+                    header_regex_prog = compileWikiRegex(header_regex_fmt, self.Expid)
+                except re.error as e:
+                    logger.warning("Invalid subentry header regex '%s' (%s), using wiki_subentry_regex_fmt.", header_regex_fmt, e)
+                    header_regex_fmt = None
+            if not header_regex_fmt:
+                subentry_regex_prog = compileWikiRegex(subentry_regex_fmt, self.Expid)
+        except (TypeError, KeyError, AttributeError, re.error) as e:
             logger.warning("%r while creating wiki subentry regex prog; self.getConfigEntry('wiki_subentry_regex_fmt')=%s; ABORTING...",
-                           e, self.getConfigEntry('wiki_subentry_regex_fmt'))
+                           e, subentry_regex_fmt)
             return
         # PARSE the wiki xhtml:
         expsection_match = expsection_regex_prog.match(xhtml) # consider using search instead of match?
@@ -1029,19 +1319,27 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             logger.warning("Aborting, exp_section_body is empty: %s", exp_xhtml)
             return
         wiki_subentries = OrderedDict()
-        for match in subentry_regex_prog.finditer(exp_xhtml):
-            gd = match.groupdict()
+        if header_regex_fmt:
+            groupdicts = splitWikiSubentries(exp_xhtml, header_regex_prog)
+        else:
+            groupdicts = (match.groupdict() for match in subentry_regex_prog.finditer(exp_xhtml))
+        for gd in groupdicts:
             logger.debug("Match groupdict: {%s}", ", ".join(u"{} : {}".format(key, value[0:20]+' (....) '+value[-20:] if value and len(value) > 50 else value)
                                                             for key, value in gd.items()))
             if not return_subentry_xhtml:
                 gd.pop('subentry_xhtml')
             # If a datestring is present, convert it to a datetime type.
-            datestring = gd.pop('subentry_date_string')
+            datestring = gd.pop('subentry_date_string', None)
             if datestring:
                 gd['date'] = datetime.strptime(datestring, "%Y%m%d")
             if gd['subentry_idx'] in wiki_subentries:
                 logger.warning("Duplicate subentry_idx '%s' encountered while parsing subentries from xhtml.", gd['subentry_idx'])
             wiki_subentries[gd['subentry_idx']] = gd
+        if cachekey is not None:
+            with _wikisubentriescachelock:
+                _wikisubentriescache[cachekey] = OrderedDict((idx, dict(gd)) for idx, gd in wiki_subentries.items())
+                while len(_wikisubentriescache) > WIKI_SUBENTRIES_CACHE_SIZE:
+                    _wikisubentriescache.popitem(last=False)
         return wiki_subentries
 
 
@@ -1062,7 +1360,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             if subentry_idx in subentries:
                 logger.debug("Subentry '%s' from wikipage already in Subentries", subentry_idx)
             else:
-                subentries[subentry_idx] = subentry_props
+                with self._propslock:
+                    subentries[subentry_idx] = subentry_props
                 count += 1
                 logger.debug("Subentry '%s' from wikipage added to Subentries, props are: %s",
                              subentry_idx, subentry_props)
@@ -1205,7 +1504,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             pagestruct = self.searchForWikiPage()
             if pagestruct:
                 logger.debug("searchForWikiPage returned a pagestruct with id: %s", pagestruct['id'])
-                self.Props['wiki_pageId'] = pageId = pagestruct['id']
+                with self._propslock:
+                    self.Props['wiki_pageId'] = pageId = pagestruct['id']
                 if self.SavePropsOnChange:
                     self.saveProps()
         logger.debug("Params are: pageId: %s  server: %s   pagestruct: %s", pageId, self.Server, pagestruct)
@@ -1218,7 +1518,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         # Update self.Props for offline access to the title of the wiki page:
         if struct:
             logger.debug("Setting experiment props['wiki_pagetitle'] = %s", struct['title'])
-            self.Props['wiki_pagetitle'] = struct['title']
+            with self._propslock:
+                self.Props['wiki_pagetitle'] = struct['title']
         else:
             logger.info("Wiki page struct obtained with pageId %s is: %s", pageId, struct)
         return wikipage
@@ -1276,7 +1577,8 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
         fmt_params = dict(datetime=current_datetime, date=current_datetime)
         fmt_params.update(self.Props)
         self.WikiPage = wikipage = pagefactory.new('exp_page', fmt_params=fmt_params)
-        self.Props['wiki_pageId'] = self.WikiPage.Struct['id']
+        with self._propslock:
+            self.Props['wiki_pageId'] = self.WikiPage.Struct['id']
         # Always save/persist props after making a wiki page, otherwise the pageId might be lost.
         self.saveProps()
         self.invokePropertyCallbacks('WikiPage', wikipage)
@@ -1411,3 +1713,147 @@ props=%s, regex_match=%s, wikipage='%s'", props, regex_match, wikipage)
             return self.getExpRepr()
         else:
             return default
+
+
+
+class ExperimentProxy(object):
+    """
+    Lazy stand-in for an Experiment, as used by ExperimentManager.ExperimentsById.
+
+    Creating a full Experiment object is relatively expensive: It loads the .labfluence.yml file
+    (through confighandler.getExpConfig), parses the subentry folders in the experiment's local directory,
+    and creates a JournalAssistant and a Filemanager. With thousands of local experiment folders,
+    doing this for all of them on startup takes a long time, even though most are never used.
+
+    An ExperimentProxy only knows the expid, the local directory and the folder name regex groupdict.
+    These are available as attributes without loading anything:
+        Expid, Localdirpath, Foldername, Parentdirpath, Groupdict, isLoaded
+    Any other attribute access (e.g. Props, Subentries, JournalAssistant, getUrl(), ...)
+    creates the real Experiment on first use and forwards the access to it.
+    The real experiment is available as proxy.Experiment.
+    If the proxy was made from an ExperimentCatalog entry, getProp() can return the cached
+    subentries and wiki_pageId without loading the experiment. When the experiment is loaded,
+    the manager's catalog entry is updated (manager.updateCatalogEntry), if the manager has one.
+
+    Setting attributes other than the ones above also forwards to (and loads) the real experiment.
+
+    Proxies can be loaded from several threads (see ExperimentManager.hydrateExperiments);
+    if two threads load the same proxy at the same time, only the first experiment is kept.
+    """
+
+    _proxyattrs = ('_localdir', '_groupdict', '_cached', '_kwargs', '_experiment')
+    _loadlock = threading.Lock()    # Only held while storing the loaded experiment, not while loading.
+
+    def __init__(self, localdir, groupdict, cached=None, **kwargs):
+        """
+        Arguments:
+        - localdir: path to the experiment's local directory.
+        - groupdict: folder name regex groupdict; must include 'expid'. Used as props for the real experiment.
+        - cached: A (valid) expcatalog.ExperimentCatalog entry for this experiment, or None.
+        - kwargs: Keyword arguments for the Experiment, e.g. manager and confighandler.
+        """
+        object.__setattr__(self, '_localdir', localdir)
+        object.__setattr__(self, '_groupdict', groupdict)
+        object.__setattr__(self, '_cached', cached)
+        object.__setattr__(self, '_kwargs', kwargs)
+        object.__setattr__(self, '_experiment', None)
+
+    @property
+    def Experiment(self):
+        """ The real Experiment object, created on first access. """
+        if self._experiment is None:
+            logger.debug("Loading experiment %s from %s", self.Expid, self._localdir)
+            experiment = Experiment(props=self._groupdict, localdir=self._localdir, **self._kwargs)
+            with self._loadlock:
+                if self._experiment is not None:
+                    return self._experiment
+                object.__setattr__(self, '_experiment', experiment)
+            manager = self._kwargs.get('manager')
+            if hasattr(manager, 'updateCatalogEntry'):
+                manager.updateCatalogEntry(self)
+        return self._experiment
+
+    @property
+    def isLoaded(self):
+        """ Returns True if the real experiment has been created. """
+        return self._experiment is not None
+
+    @property
+    def Expid(self):
+        """ The expid, as parsed from the folder name (or from the experiment's Props, if loaded). """
+        if self._experiment is not None:
+            return self._experiment.Expid
+        return self._groupdict.get('expid')
+
+    def getProp(self, key, default=None, load=True):
+        """
+        Returns Props[key] without loading the experiment if the value is known,
+        i.e. if it is in the folder name groupdict or the cached catalog entry
+        (exp_subentries, wiki_pageId). Otherwise the experiment is loaded,
+        unless load is False, in which case default is returned.
+        """
+        if self._experiment is None:
+            if key in self._groupdict:
+                return self._groupdict[key]
+            if self._cached is not None and self._cached.get(key) is not None:
+                return self._cached[key]
+            if not load:
+                return default
+        return self.Experiment.Props.get(key, default)
+
+    def invalidateCache(self):
+        """ Drops the cached catalog entry, e.g. after the experiment's subentry folders have changed. """
+        object.__setattr__(self, '_cached', None)
+
+    @property
+    def Groupdict(self):
+        """ The folder name regex groupdict. """
+        return self._groupdict
+
+    @property
+    def Localdirpath(self):
+        """ Path to the experiment's local directory. """
+        if self._experiment is not None:
+            return self._experiment.Localdirpath
+        return self._localdir
+
+    @property
+    def Foldername(self):
+        """ Basename of the local directory. """
+        if self._experiment is not None:
+            return self._experiment.Foldername
+        return os.path.basename(self._localdir)
+
+    @property
+    def Parentdirpath(self):
+        """ Parent directory of the local directory. """
+        if self._experiment is not None:
+            return self._experiment.Parentdirpath
+        return os.path.dirname(self._localdir)
+
+    def __getattr__(self, name):
+        # Only invoked for attributes not found on the proxy itself.
+        if name.startswith('__') or name in self._proxyattrs:
+            raise AttributeError(name)
+        return getattr(self.Experiment, name)
+
+    def __setattr__(self, name, value):
+        if name in self._proxyattrs:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.Experiment, name, value)
+
+    def __eq__(self, other):
+        if isinstance(other, ExperimentProxy):
+            return self is other or (self._experiment is not None and self._experiment is other._experiment)
+        return self._experiment is not None and self._experiment is other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        if self._experiment is not None:
+            return repr(self._experiment)
+        return "e>" + str(self.Foldername)
@@ -27,8 +27,18 @@ from __future__ import print_function
 from six import string_types
 import os
 import re
+import threading
 import logging
 from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping  # python 2
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # python 2 without the 'futures' backport; experiments are hydrated one at a time.
+    ThreadPoolExecutor = None
 try:
     from itertools import ifilter   # pylint: disable=E0611
 except ImportError:
@@ -36,13 +46,81 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 # Model classes:
-from experiment import Experiment
+from experiment import Experiment, ExperimentProxy
 from labfluencebase import LabfluenceBase
 
-from dirtreeparsing import genPathmatchTupsByPathscheme, getFoldersWithSameProperty
+from dirtreeparsing import genPathmatchTupsByPathscheme, getFoldersWithSameProperty, makeFolderIndex, expidIndex
 
 # Decorators:
 from decorators.cache_decorator import cached_property
+from tracing import traced
+from memorymonitor import SpillDict
+from expcatalog import ExperimentCatalog, getMtime
+from records import ExpRecord
+from expidindex import ExpidIndex
+from wikipagecache import WikiPageCache
+from wikifetch import WikiFetchPool
+
+
+class ExperimentsByIdDiff(Mapping):
+    """
+    Read-only view of ExperimentsById, with lists of the expids that were
+    Added, Removed, Renamed (local folder) and Changed (subentries re-parsed, local folder removed,
+    wiki page id or props updated, experiment loaded) by a merge or other update.
+    Passed to all 'ExperimentsById' property callbacks, so callbacks can either use it as the
+    full ExperimentsById map (as before), or only update the changed experiments.
+    As for other mappings, the diff is true if ExperimentsById is non-empty; use isChanged
+    to check if anything changed.
+    """
+
+    def __init__(self, experimentsbyid):
+        self._experimentsbyid = experimentsbyid
+        self.Added = []
+        self.Removed = []
+        self.Renamed = []
+        self.Changed = []
+
+    def __getitem__(self, expid):
+        return self._experimentsbyid[expid]
+
+    def __iter__(self):
+        return iter(self._experimentsbyid)
+
+    def __len__(self):
+        return len(self._experimentsbyid)
+
+    @property
+    def isChanged(self):
+        """ True if any experiments were added, removed, renamed or changed. """
+        return bool(self.Added or self.Removed or self.Renamed or self.Changed)
+
+    def __repr__(self):
+        return "ExperimentsByIdDiff(added=%s, removed=%s, renamed=%s, changed=%s)" % (
+            len(self.Added), len(self.Removed), len(self.Renamed), len(self.Changed))
+
+
+def moveIntoSortedPosition(experimentsbyid, newexpids):
+    """
+    Moves newexpids, which have just been added to the end of the (otherwise sorted) OrderedDict
+    experimentsbyid, into their sorted position. Sorting is by expid index, then expid.
+    Only the new expids and the existing items that sort after them are moved (to the end, in sorted order),
+    so adding new experiments with the highest expids does not touch the other items.
+    """
+    if not newexpids:
+        return
+    sortkey = lambda expid: (expidIndex(expid), expid)
+    newset = set(newexpids)
+    firstnew = min(sortkey(expid) for expid in newexpids)
+    tail = []
+    for expid in reversed(experimentsbyid):
+        if expid in newset:
+            continue
+        if sortkey(expid) <= firstnew:
+            break
+        tail.append(expid)
+    for expid in sorted(tail + list(newexpids), key=sortkey):
+        # Popping and re-inserting moves the item to the end:
+        experimentsbyid[expid] = experimentsbyid.pop(expid)
 
 
 class ExperimentManager(LabfluenceBase):
@@ -72,6 +150,16 @@ class ExperimentManager(LabfluenceBase):
         self._experiments = list()
         self._localexpdirsparsed = False
         self._regexpats = None  # Cached compiled regular expressions
+        self._catalog = None    # ExperimentCatalog, if enabled.
+        self._wikipagecache = None  # WikiPageCache, if enabled.
+        self._wikifetchpool = None  # WikiFetchPool, created on first use.
+        self._wikipageversions = dict() # pageid -> version, from the last listing of the wiki experiment pages.
+        self._expidindex = None # Sorted ExpidIndex of the expids in ExperimentsById, created on first use.
+        self._localexpscans = dict()    # For incremental merge: expsdir -> (mtime, {path: expid}) from last scan.
+        self._expfoldermtimes = dict()  # For incremental merge: localdirpath -> mtime, for loaded experiments.
+        # Lock for updates of the catalog and experiments that can happen on other threads
+        # (experiments loaded by hydrateExperiments, attached wiki pages, LocalExperimentsWatcher):
+        self.Lock = threading.RLock()
         if autoinit:
             logger.info("Auto-initiating experiments for ExperimentManager...")
             self.mergeLocalExperiments()
@@ -149,6 +237,8 @@ class ExperimentManager(LabfluenceBase):
     def ExperimentsById(self):
         """
         Returns a dictionary map, mapping [expid] -> expriment object.
+        Local experiments are ExperimentProxy objects; use exp.Expid, exp.Localdirpath, etc
+        if you do not want to load the full experiment.
         """
         if self._experimentsbyid is None:
             #if 'local' in self._experimentsources:
@@ -161,7 +251,68 @@ class ExperimentManager(LabfluenceBase):
     def ExperimentsById(self, value):
         """property setter"""
         self._experimentsbyid = value
+        self._expidindex = None
+        self._localexpscans.clear()
+        self._expfoldermtimes.clear()
+
+
+
+    @property
+    def ExpidIndex(self):
+        """
+        Sorted index of the expids in ExperimentsById (an expidindex.ExpidIndex), created on first access.
+        The index is kept up to date by mergeLocalExperiments, mergeCurrentWikiExperiments and addNewExperiment.
+        """
+        if self._expidindex is None:
+            self._expidindex = ExpidIndex(self.ExperimentsById.keys(), regex_str=self.Confighandler.get('expid_regex'))
+        return self._expidindex
+
+    def _updateExpidIndex(self, newexpids):
+        """ Add newexpids to the expid index, if the index has been created. """
+        if self._expidindex is not None:
+            self._expidindex.update(newexpids)
+
+    @property
+    def Catalog(self):
+        """
+        The ExperimentCatalog with a snapshot of the local experiments (see the expcatalog module),
+        or None if not enabled by config entry 'exp_manager_use_catalog'.
+        The catalog is loaded from file on first access.
+        """
+        if self._catalog is None and self.Confighandler.get('exp_manager_use_catalog'):
+            catalogpath = self.Confighandler.get('local_exp_catalog_path') \
+                          or os.path.join(self.Confighandler.getConfigDir('user') or os.path.expanduser('~/.Labfluence'),
+                                          'experiment_catalog.json')
+            self._catalog = ExperimentCatalog(catalogpath)
+            self._catalog.load()
+        return self._catalog
 
+    @property
+    def WikiPageCache(self):
+        """
+        On-disk cache of wiki experiment pages keyed by page id and version (see the wikipagecache module),
+        or None if not enabled by config entry 'exp_manager_use_wiki_page_cache'.
+        The cache directory is 'local_wiki_page_cache_dir' if given, otherwise wikipagecache/ in the user config directory.
+        """
+        if self._wikipagecache is None and self.Confighandler.get('exp_manager_use_wiki_page_cache'):
+            cachedir = self.Confighandler.get('local_wiki_page_cache_dir') \
+                       or os.path.join(self.Confighandler.getConfigDir('user') or os.path.expanduser('~/.Labfluence'),
+                                       'wikipagecache')
+            self._wikipagecache = WikiPageCache(cachedir)
+        return self._wikipagecache
+
+    @property
+    def WikiFetchPool(self):
+        """
+        Pool of server connections for batch fetching of wiki pages and attachment lists (see the wikifetch module).
+        The number of connections is set by config entry 'wiki_fetch_max_connections' (default 4).
+        Returns None if no server is connected.
+        """
+        if not self.Server:
+            return None
+        if self._wikifetchpool is None or self._wikifetchpool.Server is not self.Server:
+            self._wikifetchpool = WikiFetchPool(self.Server, maxconnections=self.Confighandler.get('wiki_fetch_max_connections', 4))
+        return self._wikifetchpool
 
 
     @cached_property(ttl=120) # 2 minutes cache...
@@ -238,7 +389,7 @@ class ExperimentManager(LabfluenceBase):
         and adding it to the list of recent experiments instead.
         """
         if not isinstance(exp, string_types):
-            expid = exp.Props['expid'] # When you eventually implement file: and wiki: notations in addition to expid:, use try-except clause
+            expid = exp.Expid # When you eventually implement file: and wiki: notations in addition to expid:, use try-except clause
         else:
             expid = exp
         try:
@@ -266,7 +417,7 @@ class ExperimentManager(LabfluenceBase):
         for exp in exps:
             if not isinstance(exp, string_types):
                 # Assume Experiment-like object, or fail hard.
-                exp = exp.Props['expid']
+                exp = exp.Expid
             self.addActiveExperimentId(exp, removeFromRecent)
         self.sortActiveExprimentIds()
         self.sortRecentExprimentIds()
@@ -427,6 +578,18 @@ class ExperimentManager(LabfluenceBase):
                                           rightmost=rightmost,
                                           countlim=countlim)
 
+    def getFolderIndex(self, group, rightmost=None):
+        """
+        Returns a compact folder index for the local experiment tree, see dirtreeparsing.makeFolderIndex.
+        Used by SyncManager.check_duplicates to crosscheck local and remote folders.
+        """
+        return makeFolderIndex(group=group,
+                               basepath=self.Rootdir,
+                               folderscheme=self.Folderscheme,
+                               regexs=self.Regexs,
+                               filterfun=self.getFilterFun(),
+                               rightmost=rightmost)
+
     def getDuplicates(self, local=True, subentries=False):
         """ Convenience method for getDuplicateExps and getDuplicateSubentries dispatch. """
         if subentries:
@@ -465,10 +628,13 @@ class ExperimentManager(LabfluenceBase):
         folderpaths = (os.path.join(directory, dirname) for dirname in localdirs)
         return folderpaths
 
-    def getLocalExpsDirMatchTuples(self, basedir=None):
+    def getLocalExpsDirMatchTuples(self, basedir=None, expfilter=None):
         """
         Returns a generator with
           (localdirpath, regex_match) for local experiment folders
+        If expfilter is given (e.g. a dirtreeparsing.ExpFilter), it is called as
+        expfilter('experiment', match) and folders for which it returns False are skipped,
+        e.g. to only include experiments after RS340 or from the last two years.
         """
         exp_paths = self.getLocalExperimentFolderpaths(basedir)
         if not exp_paths:
@@ -481,9 +647,11 @@ class ExperimentManager(LabfluenceBase):
         logger.debug("Parsing local folders with regex: %s", regex_str)
         regex_prog = re.compile(regex_str)
         pathmatchtuples = (tup for tup in ((path, regex_prog.match(os.path.basename(path))) for path in exp_paths) if tup[1])
+        if expfilter:
+            pathmatchtuples = (tup for tup in pathmatchtuples if expfilter('experiment', tup[1]))
         return pathmatchtuples
 
-    def getLocalExpsDirGroupdictTuples(self, basedir=None):
+    def getLocalExpsDirGroupdictTuples(self, basedir=None, expfilter=None):
         """
         Returns a generator with (path, match.groupdict()) tuples,
         for local experiment folders.
@@ -492,7 +660,7 @@ class ExperimentManager(LabfluenceBase):
 
         This is similar to satellite_location.SatelliteLocation.genPathGroupdictTupByPathscheme method.
         """
-        pathgds = ((path, match.groupdict()) for path, match in self.getLocalExpsDirMatchTuples(basedir))
+        pathgds = ((path, match.groupdict()) for path, match in self.getLocalExpsDirMatchTuples(basedir, expfilter=expfilter))
         # gd.pop is in a list comprehension not generator because we want to pop all date groups.
         return ((path, dict(date=next(ifilter(None, [gd.pop('date', None), gd.pop('date1', None), gd.pop('date2', None)]), None),
                             **gd))
@@ -513,6 +681,7 @@ class ExperimentManager(LabfluenceBase):
         - 'tuple'               -> Returns a tuple of (foldername, expid, exp_titledesc, date, path)
         - 'expid'               -> Returns the expid only
         - 'display-tuple'       -> (<display>, <identifier>, <full object>) tuples. Well, currently not with the full object.
+        - 'record'              -> Returns compact records.ExpRecord objects (for bulk operations)
         Changelog:
             Renamed to genLocalExperiments to emphasize the fact that it returns a generator (and does not 'get' any property from self)
         """
@@ -531,54 +700,315 @@ class ExperimentManager(LabfluenceBase):
             exps = (tup[1].get('expid') for tup in self.getLocalExpsDirGroupdictTuples(basedir))
         elif ret == 'display-tuple':
             exps = ((os.path.basename(exppath), gd.get('expid'), None) for exppath, gd in self.getLocalExpsDirGroupdictTuples(basedir))
+        elif ret in ('record', 'records'):
+            exps = (ExpRecord.fromGroupdict(gd, path=exppath) for exppath, gd in self.getLocalExpsDirGroupdictTuples(basedir))
         else:
             logger.warning("ret argument '%s' not recognized, will not return anything...", ret)
             raise ValueError("ret argument '%s' not recognized, will not return anything..." % ret)
         return exps
 
-    def findLocalExpsPathGdTupByExpid(self, basedir=None):
+    @traced('ExperimentManager.findLocalExpsPathGdTupByExpid')
+    def findLocalExpsPathGdTupByExpid(self, basedir=None, expfilter=None, memorybudget=None):
         """
         Convenience method.
         Returns dict with:
             experiments[expid] = (path, match-groupdict)
+        expfilter can be used to only include some experiments, see getLocalExpsDirMatchTuples.
+        If memorybudget (a memorymonitor.MemoryBudget) is given, the result is a SpillDict
+        which is moved to disk if memory usage approaches the budget.
+        """
+        pathgdtups = self.getLocalExpsDirGroupdictTuples(basedir=basedir, expfilter=expfilter)
+        if memorybudget is None:
+            return {gd.get('expid'): (path, gd) for path, gd in pathgdtups}
+        experiments = SpillDict(memorybudget, name='local-experiments')
+        for path, gd in pathgdtups:
+            experiments[gd.get('expid')] = (path, gd)
+        return experiments
+
+    @traced('ExperimentManager.findLocalExpRecordsByExpid')
+    def findLocalExpRecordsByExpid(self, basedir=None, expfilter=None, memorybudget=None):
+        """
+        Like findLocalExpsPathGdTupByExpid, but returns a dict with compact records:
+            experiments[expid] = records.ExpRecord(expid, path, titledesc, date)
+        This uses a lot less memory than a (path, groupdict) tuple per experiment and is used by SyncManager.
         """
-        return {gd.get('expid'): (path, gd) for path, gd in self.getLocalExpsDirGroupdictTuples(basedir=basedir)}
+        records = (ExpRecord.fromGroupdict(gd, path=path)
+                   for path, gd in self.getLocalExpsDirGroupdictTuples(basedir=basedir, expfilter=expfilter))
+        experiments = {} if memorybudget is None else SpillDict(memorybudget, name='local-experiments')
+        for record in records:
+            experiments[record.Expid] = record
+        return experiments
 
 
-    def mergeLocalExperiments(self, basedir=None, addtoactive=False):#, sync_exptitledesc=None):
+    def mergeLocalExperiments(self, basedir=None, addtoactive=False, force=False):#, sync_exptitledesc=None):
         """
         Merges the current wiki experiments with the experiments from the local directory.
+        New local experiments are added as ExperimentProxy objects, which only create the
+        full Experiment (loading props, subentries, etc) on first use.
+
+        The merge is incremental: The mtime of the experiment directory is remembered, and if it has not
+        changed since the last merge, the directory is not listed or parsed again. Otherwise only added,
+        removed and renamed experiment folders are processed. For experiments that have been loaded,
+        subentries are re-parsed if the experiment folder's mtime has changed.
+        Set force=True to re-list the directory regardless of its mtime.
+        If anything changed, 'ExperimentsById' callbacks are invoked with an ExperimentsByIdDiff,
+        which is a read-only view of ExperimentsById with the lists Added, Removed, Renamed and Changed.
+        (All 'ExperimentsById' callbacks are invoked with an ExperimentsByIdDiff.)
+        If the folder of an experiment with a wiki page is removed, the experiment is kept (without local
+        directory, like other wiki-only experiments) and listed as Changed; otherwise it is removed.
+
+        If the experiment catalog is enabled (see Catalog), the experiment directory is only parsed
+        if it has changed since the catalog was saved. Stale catalog entries are replaced by entries
+        made from the folder groupdicts; experiments are not loaded (see updateCatalog).
         sync_exptitledesc can be either of: (not implemented)
         - None = Do not change anyting.
         - 'foldername' = Change wikipage to match the local foldername
         - 'wikipage' = Change local folder to match the wiki
+        Returns a list of new expids.
         """
         logger.debug("mergeLocalExperiments called with basedir='%s', addtoactive=%s", basedir, addtoactive)
-        newexpids = list()
-        if self._experimentsbyid is None:
-            self._experimentsbyid = OrderedDict()
-        for path, gd in self.getLocalExpsDirGroupdictTuples(basedir):
+        # The merge can also be made from a LocalExperimentsWatcher thread; callbacks are invoked without the lock:
+        with self.Lock:
+            if self._experimentsbyid is None:
+                self._experimentsbyid = OrderedDict()
+            expsdir = basedir or self.getLocalExpSubDir()
+            diff = ExperimentsByIdDiff(self._experimentsbyid)
+            dirmtime = getMtime(expsdir)
+            # previous scan of this directory: (mtime, {path: expid}):
+            lastmtime, lastfolders = self._localexpscans.get(expsdir, (None, {}))
+            if force or dirmtime is None or dirmtime != lastmtime:
+                newexpids = self._mergeLocalFolders(basedir, expsdir, dirmtime, lastfolders, diff)
+            else:
+                logger.debug("Experiment directory %s not changed since last merge.", expsdir)
+                newexpids = []
+            self._refreshChangedExperiments(diff)
+            self.saveCatalog()
+        if addtoactive and newexpids:
+            logger.debug("Adding new expids to active experiments: %s", newexpids)
+            self.addActiveExperiments(newexpids) # This will take care of invoking registrered callbacks in confighandler.
+        logger.info("mergeLocalExperiments(basedir=%s, addtoactive=%s) completed: %s", basedir, addtoactive, diff)
+        firstmerge = not self._localexpdirsparsed
+        self._localexpdirsparsed = True
+        if diff.isChanged or firstmerge:
+            self.invokePropertyCallbacks('ExperimentsById', diff)
+        return newexpids
+
+    def _mergeLocalFolders(self, basedir, expsdir, dirmtime, lastfolders, diff):
+        """
+        Lists and parses the experiment directory and merges added, removed and renamed
+        experiment folders into ExperimentsById, recording the changes in diff.
+        Used by mergeLocalExperiments; returns a list of new expids.
+        """
+        catalog = self.Catalog if basedir is None else None
+        if catalog is not None and catalog.isExpsdirValid(expsdir):
+            logger.debug("Experiment directory unchanged, using experiments from catalog %s", catalog)
+            pathgdtups = catalog.getPathGroupdictTuples()
+        else:
+            if catalog is not None:
+                catalog.setExpsdir(expsdir)
+            pathgdtups = self.getLocalExpsDirGroupdictTuples(basedir)
+        # Directory listings are not ordered, so sort by expid to make the order of ExperimentsById deterministic:
+        pathgdtups = sorted(pathgdtups, key=lambda tup: (expidIndex(tup[1]['expid']), tup[1]['expid'], tup[0]))
+        folders = {path: gd['expid'] for path, gd in pathgdtups}
+        # Folders that were removed since last scan, path -> expid; if the expid is still present, the folder was renamed.
+        # (Keyed by path, since several removed folders can have the same expid.)
+        removedpaths = {path: expid for path, expid in lastfolders.items() if path not in folders}
+        newexpids, staleexpids = list(), list()
+        for path, gd in pathgdtups:
+            if path in lastfolders:
+                continue
             logger.debug("Processing path: %s", path)
             expid = gd['expid']
             if expid in self._experimentsbyid: # do NOT use self.ExperimentsById as this property calls this method (cyclic reference!)
                 exp = self._experimentsbyid[expid]
-                if exp.Localdirpath != path:
+                if exp.Localdirpath == path:
+                    continue
+                if removedpaths.get(exp.Localdirpath) == expid:
+                    removedpaths.pop(exp.Localdirpath)
+                    logger.info("Exp %s : Experiment folder renamed (%s -> %s)", exp, exp.Localdirpath, path)
+                    self._renameLocalExperiment(expid, path, gd, catalog)
+                    diff.Renamed.append(expid)
+                else:
                     logger.info("Exp %s : exp.Localdirpath != path ( %s != %s)", exp, exp.Localdirpath, path)
             else:
-                exp = Experiment(props=gd, localdir=path,
-                                 manager=self, confighandler=self.Confighandler,
-                                 doparseLocaldirSubentries=True)
-                logger.info("New experiment created: %s, with localdir: %s", exp, exp.Localdirpath)
+                # Experiments are loaded lazily; only expid, path and groupdict are known until first use:
+                entry = catalog.getValidEntry(expid, path) if catalog is not None else None
+                if catalog is not None and entry is None:
+                    staleexpids.append(expid)
+                exp = ExperimentProxy(path, gd, cached=entry, manager=self, confighandler=self.Confighandler,
+                                      doparseLocaldirSubentries=True)
+                logger.debug("New experiment proxy created: %s, with localdir: %s", exp, exp.Localdirpath)
                 self._experimentsbyid[expid] = exp
                 newexpids.append(expid)
-        if addtoactive and newexpids:
-            logger.debug("Adding new expids to active experiments: %s", newexpids)
-            self.addActiveExperiments(newexpids) # This will take care of invoking registrered callbacks in confighandler.
-        logger.info("mergeLocalExperiments(basedir=%s, addtoactive=%s) completed. Local experiment directory parsed and merged.", basedir, addtoactive)
-        self._localexpdirsparsed = True
-        self.invokePropertyCallbacks('ExperimentsById', self._experimentsbyid)
+        for path, expid in removedpaths.items():
+            exp = self._experimentsbyid.get(expid)
+            if exp is None or exp.Localdirpath != path:
+                continue
+            # Do not load unloaded experiments from a removed folder; only use what is already known:
+            pageid = exp.getProp('wiki_pageId', load=False) if isinstance(exp, ExperimentProxy) else exp.Props.get('wiki_pageId')
+            if not pageid:
+                logger.info("Exp %s : Experiment folder removed: %s", exp, path)
+                del self._experimentsbyid[expid]
+                if self._expidindex is not None:
+                    self._expidindex.remove(expid)
+                diff.Removed.append(expid)
+                continue
+            logger.info("Exp %s : Experiment folder removed: %s; keeping the experiment for wiki page %s.", exp, path, pageid)
+            if isinstance(exp, ExperimentProxy) and not exp.isLoaded:
+                self._experimentsbyid[expid] = Experiment(props=dict(exp.Groupdict, wiki_pageId=pageid), manager=self,
+                                                          confighandler=self.Confighandler, doparseLocaldirSubentries=False)
+            else:
+                exp.detachLocaldir()
+            self._expfoldermtimes.pop(path, None)
+            diff.Changed.append(expid)
+        # Keep ExperimentsById sorted (in place, others may have a reference to it):
+        moveIntoSortedPosition(self._experimentsbyid, newexpids)
+        diff.Added.extend(newexpids)
+        self._updateExpidIndex(newexpids)
+        self._localexpscans[expsdir] = (dirmtime, folders)
+        if catalog is not None:
+            self.updateCatalog(catalog, staleexpids, pathgdtups)
         return newexpids
 
+    def _renameLocalExperiment(self, expid, path, gd, catalog=None):
+        """
+        Updates experiment <expid> after its local folder has been renamed to <path>.
+        Unloaded experiments are simply replaced by a new proxy, loaded experiments are updated
+        and the experiment's config is moved to the new path in the HierarchicalConfigHandler.
+        """
+        exp = self._experimentsbyid[expid]
+        if isinstance(exp, ExperimentProxy) and not exp.isLoaded:
+            entry = catalog.getValidEntry(expid, path) if catalog is not None else None
+            self._experimentsbyid[expid] = ExperimentProxy(path, gd, cached=entry, manager=self, confighandler=self.Confighandler,
+                                                           doparseLocaldirSubentries=True)
+            return
+        oldpath = exp.Localdirpath
+        hch = getattr(self.Confighandler, 'HierarchicalConfigHandler', None)
+        if hch is not None and oldpath in hch.Configs:
+            self.Confighandler.renameConfigKey(oldpath, path)
+        exp.setLocaldirpathAndFoldername(path)
+        self._expfoldermtimes.pop(oldpath, None)
+
+    def _refreshChangedExperiments(self, diff):
+        """
+        Re-parses subentries of loaded local experiments whose folder mtime has changed since last merge.
+        Unloaded experiments (ExperimentProxy) parse their subentries when loaded, so they are not checked.
+        """
+        for expid, exp in self._experimentsbyid.items():
+            if isinstance(exp, ExperimentProxy) and not exp.isLoaded:
+                continue
+            path = exp.Localdirpath
+            if not path:
+                continue
+            mtime = getMtime(path)
+            lastmtime = self._expfoldermtimes.get(path)
+            self._expfoldermtimes[path] = mtime
+            if lastmtime is not None and mtime is not None and mtime != lastmtime:
+                logger.debug("Experiment folder %s changed, re-parsing subentries.", path)
+                exp.parseLocaldirSubentries()
+                diff.Changed.append(expid)
+
+
+    def updateCatalog(self, catalog, staleexpids, pathgdtups):
+        """
+        Updates the catalog entries of the experiments with stale entries (staleexpids),
+        removes catalog entries for experiments that are not in pathgdtups (the local experiments),
+        and saves the catalog if anything changed.
+        Experiments are not loaded to do this: entries of unloaded experiments are made from the folder
+        groupdict, and props (subentries, wiki_pageId) are added when the experiment is loaded,
+        see updateCatalogEntry. (Otherwise the first run would load every experiment.)
+        """
+        pathsbyexpid = {gd['expid']: path for path, gd in pathgdtups}
+        with self.Lock:
+            if staleexpids:
+                logger.info("Updating %s stale experiment catalog entries...", len(staleexpids))
+                for expid in staleexpids:
+                    exp = self._experimentsbyid[expid]
+                    if exp.isLoaded:
+                        catalog.updateEntry(expid, pathsbyexpid[expid], exp.Groupdict,
+                                            subentries=exp.Props.get('exp_subentries'), wiki_pageId=exp.Props.get('wiki_pageId'))
+                    else:
+                        catalog.updateEntry(expid, pathsbyexpid[expid], exp.Groupdict)
+            catalog.removeMissing(pathsbyexpid)
+        self.saveCatalog()
+
+    def updateCatalogEntry(self, proxy):
+        """
+        Records the props (subentries, wiki_pageId) of a just-loaded experiment proxy in its catalog entry.
+        Invoked by ExperimentProxy when the experiment is loaded. Only existing entries for the proxy's
+        local directory are updated; the catalog is saved by saveCatalog.
+        Proxies can be loaded on hydrateExperiments' worker threads, so the update is made with self.Lock held.
+        """
+        catalog = self._catalog
+        if catalog is None:
+            return
+        props = proxy.Experiment.Props
+        with self.Lock:
+            entry = catalog.Entries.get(proxy.Expid)
+            if entry is None or entry['localdir'] != proxy.Localdirpath:
+                return
+            if entry.get('exp_subentries') != props.get('exp_subentries') or entry.get('wiki_pageId') != props.get('wiki_pageId'):
+                catalog.updateEntry(proxy.Expid, proxy.Localdirpath, proxy.Groupdict,
+                                    subentries=props.get('exp_subentries'), wiki_pageId=props.get('wiki_pageId'))
+
+    def saveCatalog(self):
+        """ Saves the experiment catalog, if enabled and changed. """
+        catalog = self._catalog
+        if catalog is None or not catalog.Changed:
+            return
+        with self.Lock:
+            try:
+                catalog.save()
+            except (IOError, OSError) as e:
+                logger.warning("Could not save experiment catalog %s: %s", catalog.Filepath, e)
+
+
+    def hydrateExperiments(self, expids=None, workers=8):
+        """
+        Loads the full Experiment objects (props, subentries, etc) for the experiment proxies in
+        ExperimentsById, using a pool of up to <workers> threads.
+        Loading an experiment is mostly I/O (reading .labfluence.yml and listing the subentry folders),
+        so this is a lot faster than loading all experiments one at a time, e.g. when the GUI needs
+        all subentries.
+        If expids is None, all experiments are loaded. Experiments that are already loaded are skipped.
+        The order of ExperimentsById is not changed.
+        Returns a list of the loaded expids (in ExperimentsById order).
+        Callbacks are not invoked from the worker threads; if anything was loaded,
+        'ExperimentsById' callbacks are invoked once when all experiments have been loaded.
+        """
+        experimentsbyid = self.ExperimentsById
+        if expids is None:
+            expids = list(experimentsbyid.keys())
+        else:
+            wanted = set(expids)
+            expids = [expid for expid in experimentsbyid if expid in wanted]
+        proxies = [experimentsbyid[expid] for expid in expids
+                   if isinstance(experimentsbyid[expid], ExperimentProxy) and not experimentsbyid[expid].isLoaded]
+        if not proxies:
+            return []
+        def load(proxy):
+            """ Load a single experiment; returns the error (if any) instead of raising it. """
+            try:
+                proxy.Experiment
+            except Exception as e:     # pylint: disable=W0703
+                # E.g. a broken .labfluence.yml (yaml.YAMLError); must not abort the other experiments.
+                logger.warning("Could not load experiment %s from %s: %r", proxy.Expid, proxy.Localdirpath, e)
+                return e
+        logger.info("Hydrating %s experiments using %s threads...", len(proxies), workers)
+        if ThreadPoolExecutor is not None and workers > 1 and len(proxies) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(proxies))) as executor:
+                errors = list(executor.map(load, proxies))
+        else:
+            errors = [load(proxy) for proxy in proxies]
+        loaded = [proxy.Expid for proxy, error in zip(proxies, errors) if error is None]
+        logger.info("Hydrated %s experiments (%s failed).", len(loaded), len(proxies) - len(loaded))
+        self.saveCatalog()
+        if loaded:
+            diff = ExperimentsByIdDiff(self._experimentsbyid)
+            diff.Changed.extend(loaded)
+            self.invokePropertyCallbacks('ExperimentsById', diff)
+        return loaded
+
 
 
     ########################################
@@ -595,26 +1025,130 @@ class ExperimentManager(LabfluenceBase):
         It should not be a problem to create a wikipage with a pagesummary dict, though,
         since the wikipage object should try to re-load the full pagestruct if a content
         field is not available.
+        If the wiki page cache is enabled, pages whose version has changed since they were cached
+        are dropped from the cache, and the cached listing is returned if the server is not connected.
         """
+        cache = self.WikiPageCache
         if not self.Server:
-            if self.Server is None:
+            if self.Server is None and cache is None:
                 logger.info("No server defined, aborting.")
                 return
             # There might have been a temporary issue with server, see if it is ressolved:
-            logger.info("Server info: %s", self.ServerInfo) # This will handle cache etc and attempt to reconnect at most every two minutes.
-            if not self.Server:
+            if self.Server is not None:
+                logger.info("Server info: %s", self.ServerInfo) # This will handle cache etc and attempt to reconnect at most every two minutes.
+            if not self.Server and cache is None:
                 logger.warning("Server not connected, aborting")
                 return
         wiki_exp_root_pageid = self.getWikiExpRootPageId()
         if not wiki_exp_root_pageid:
             logger.warning("wiki_exp_root_pageid is boolean False ('%s'), aborting...", wiki_exp_root_pageid)
             return
-        wiki_pages = self.Server.getChildren(wiki_exp_root_pageid)
+        if cache is not None:
+            wiki_pages = cache.listChildren(self.Server, wiki_exp_root_pageid)
+        else:
+            wiki_pages = self.Server.getChildren(wiki_exp_root_pageid)
+        # Page versions (if listed), so hydrateWikiData can use current cached pages:
+        self._wikipageversions.update((str(page['id']), page.get('version')) for page in wiki_pages or [])
         if not wiki_pages:
             logger.info("No wiki pages found for wiki_exp_root_pageid %s, server returned: %s", wiki_exp_root_pageid, wiki_pages)
         return wiki_pages
 
 
+    def getWikiPagestruct(self, page, fetch=True):
+        """
+        Returns the full pagestruct (with 'content') for page, which can be a page id or a page summary struct.
+        If the wiki page cache is enabled, the cached pagestruct is returned if its version is current
+        (i.e. the page summary has a version, matching the cached page; any cached version is used if
+        the server is not connected); otherwise the page is fetched from the server (if fetch is True)
+        and added to the cache.
+        Returns a page summary (or None) if the full page is neither cached nor fetched.
+        """
+        summary = page if isinstance(page, dict) else dict(id=page)
+        cache = self.WikiPageCache
+        if cache is not None:
+            pagestruct = cache.getPage(summary['id'], summary.get('version'), allowstale=not self.Server)
+            if pagestruct is not None:
+                return pagestruct
+        if not fetch or not self.Server:
+            return page if isinstance(page, dict) else None
+        pagestruct = self.Server.getPage(pageId=summary['id'])
+        if pagestruct and cache is not None:
+            cache.putPage(pagestruct)
+        return pagestruct or (page if isinstance(page, dict) else None)
+
+
+    def hydrateWikiData(self, expids=None, attachments=True):
+        """
+        Fetches the wiki pages (and attachment lists) of many experiments in a single concurrent batch
+        using the WikiFetchPool, instead of one server call at a time when each experiment first
+        accesses its WikiPage and Attachments.
+        If expids is None, all active experiments are hydrated.
+        Experiments without a wiki_pageId are skipped. Experiments without an attached wiki page get
+        their page attached and wiki subentries merged, as the Experiment.WikiPage property would do;
+        the same is done for experiments whose attached page only has a page summary (no 'content'),
+        e.g. experiments created by mergeCurrentWikiExperiments.
+        Fetched pages are added to the wiki page cache, if enabled; pages whose cached version matches
+        the version from the last listing of the wiki experiment pages are not fetched again.
+        Only the server calls are made concurrently; the results are applied to the experiments and the cache
+        on the calling thread, with self.Lock held (so e.g. hydrateExperiments' threads do not see half-attached pages).
+        Invoked by mergeCurrentWikiExperiments if hydration is enabled (see there).
+        Returns a list of the hydrated expids.
+        """
+        pool = self.WikiFetchPool
+        if pool is None:
+            logger.info("hydrateWikiData: No server connected, aborting.")
+            return []
+        if expids is None:
+            expids = self.ActiveExperimentIds
+        exps = [self.ExperimentsById[expid] for expid in expids if expid in self.ExperimentsById]
+        # Loads experiment proxies, since pages are attached to the experiments:
+        expsbypageid = OrderedDict((exp.Props.get('wiki_pageId'), exp) for exp in exps if exp.Props.get('wiki_pageId'))
+        if not expsbypageid:
+            return []
+        cache = self.WikiPageCache
+        pagestructs = {}
+        fetchpages = []
+        for pageid, exp in expsbypageid.items():
+            wikipage = exp._wikipage    # pylint: disable=W0212
+            if wikipage and wikipage.Struct and 'content' in wikipage.Struct:
+                continue        # Full page already attached.
+            pagestructs[pageid] = cache.getPage(pageid, self._wikipageversions.get(str(pageid))) if cache is not None else None
+            if pagestructs[pageid] is None:
+                fetchpages.append(pageid)
+        # Pages and attachment lists are fetched in the same batch:
+        calls = [('getPage', (pageid, )) for pageid in fetchpages] \
+                + ([('getAttachments', (pageid, )) for pageid in expsbypageid] if attachments else [])
+        for (methodname, args), result in zip(calls, pool.callMany(calls)):
+            pageid = args[0]
+            if result is None:
+                continue
+            if methodname == 'getAttachments':
+                expsbypageid[pageid].Filemanager.setPrefetchedAttachments(result)
+            else:
+                pagestructs[pageid] = result
+                if cache is not None:
+                    cache.putPage(result, saveindex=False)
+        if cache is not None and fetchpages:
+            cache.saveIndex()
+        hydrated = []
+        for pageid, exp in expsbypageid.items():
+            pagestruct = pagestructs.get(pageid)
+            if not pagestruct:
+                continue
+            with self.Lock:
+                wikipage = exp._wikipage    # pylint: disable=W0212
+                if wikipage and wikipage.PageId == pageid:
+                    wikipage.Struct = pagestruct    # Replace the page summary with the full pagestruct.
+                elif not exp.attachWikiPage(pageId=pageid, pagestruct=pagestruct):
+                    continue
+                exp.mergeWikiSubentries(exp.WikiPage)
+            # Callbacks are invoked without the lock held:
+            exp.invokePropertyCallbacks('WikiPage', exp.WikiPage)
+            hydrated.append(exp.Expid)
+        logger.info("Hydrated wiki data for %s experiments (%s pages fetched).", len(hydrated), len(fetchpages))
+        return hydrated
+
+
     def getCurrentWikiExpsPageMatchTuples(self):
         """
         old name: getExpRootWikiPageMatchTuples
@@ -662,6 +1196,7 @@ class ExperimentManager(LabfluenceBase):
             'expid'
             'tuple'
             'display-tuple'     : (<display>, <identifier>, <full object>) tuples.
+            'record'            : records.ExpRecord objects with expid, titledesc, date and page id.
             'pagestruct-by-expid': Returns dict with {expid: page} entries.
         Notes:
           * Passing ret='experiment-object' might initialize a new/duplicate of experiments.
@@ -689,6 +1224,8 @@ class ExperimentManager(LabfluenceBase):
                     for page, gd in self.getCurrentWikiExpsPageGroupdictTuples())
         elif ret in ('expid', 'expids'):
             exps = (gd.get('expid') for page, gd in self.getCurrentWikiExpsPageGroupdictTuples())
+        elif ret in ('record', 'records'):
+            exps = (ExpRecord.fromGroupdict(gd, pageid=page.get('id')) for page, gd in self.getCurrentWikiExpsPageGroupdictTuples())
         elif ret in ('display-tuple', 'display-tuples'):
             exps = ((page['title'], match.groupdict().get('expid'), None) for page, match in self.getCurrentWikiExpsPageMatchTuples())
         elif ret in ('experiment-object', 'experiment-objects'):
@@ -700,9 +1237,12 @@ class ExperimentManager(LabfluenceBase):
         return exps
 
 
-    def mergeCurrentWikiExperiments(self, autocreatelocaldirs=None, mergeonlyexpids=None):#, sync_exptitledesc=None):
+    def mergeCurrentWikiExperiments(self, autocreatelocaldirs=None, mergeonlyexpids=None, hydrate=None):#, sync_exptitledesc=None):
         """
         Merges the current wiki experiments with the experiments from the local directory.
+        If hydrate is True (default: config entry 'exp_manager_hydrate_wiki_data', default False), the wiki pages
+        and attachment lists of all active experiments are then fetched in one concurrent batch (hydrateWikiData),
+        instead of one page at a time when each experiment's WikiPage is first used.
         sync_exptitledesc can be either of: (not implemented)
         - None = Do not change anyting.
         - 'foldername' = Change wikipage to match the local foldername
@@ -719,6 +1259,7 @@ class ExperimentManager(LabfluenceBase):
         newexpids = list()
         if self._experimentsbyid is None:
             self._experimentsbyid = OrderedDict()
+        diff = ExperimentsByIdDiff(self._experimentsbyid)
         for page, gd in self.getCurrentWikiExpsPageGroupdictTuples():
             expid = gd['expid']
             if expid in self.ExperimentsById:
@@ -726,28 +1267,37 @@ class ExperimentManager(LabfluenceBase):
                 exp = self.ExperimentsById[expid]
                 # Uh, notice: Calling exp.PageId property will call exp.WikiPage, which will attach it if not already attached.
                 # Thus, it is much better to use exp.Props.get('wiki_pageId')
-                if not exp.Props.get('wiki_pageId'):
+                pageid = exp.getProp('wiki_pageId') if isinstance(exp, ExperimentProxy) else exp.Props.get('wiki_pageId')
+                if not pageid:
                     logger.info("Experiment %s : Updating exp.PageId to '%s', since expid was matched in title of page: %s", exp, page['id'], page['title'])
                     exp.Props['wiki_pageId'] = page['id']
+                    diff.Changed.append(expid)
             elif mergeonlyexpids is None or expid in mergeonlyexpids:
                 logger.debug("mergeonlyexpids=%s is None or expid(=%s) in mergeonlyexpids(=%s), creating new experiment instance with props/gd=%s and makelocaldir=%s",
                              mergeonlyexpids, expid, mergeonlyexpids, gd, autocreatelocaldirs)
+                # Use the cached full pagestruct, if available, so the WikiPage does not have to fetch it:
                 exp = Experiment(props=gd, makelocaldir=autocreatelocaldirs,
                                  manager=self, confighandler=self.Confighandler,
-                                 doparseLocaldirSubentries=False, wikipage=page)
+                                 doparseLocaldirSubentries=False, wikipage=self.getWikiPagestruct(page, fetch=False))
                 logger.info("New experiment created: %s, with localdir: %s, and wikipage: %s", exp, exp.Localdirpath, exp.PageId)
                 logger.debug("Adding newly created experiment to list of active experiments...")
                 self.ExperimentsById[expid] = exp
                 newexpids.append(expid)
             else:
                 logger.debug("Not merging expid %s (it is not in self.ExperimentsById, but mergeonlyexpids is: %s)", expid, mergeonlyexpids)
+        self._updateExpidIndex(newexpids)
         if newexpids:
             logger.debug("Adding new expids to active experiments: %s", newexpids)
             self.addActiveExperiments(newexpids) # This will take care of invoking registrered callbacks in confighandler.
         logger.info("Completed mergeCurrentWikiExperiments(autocreatelocaldirs=%s, mergeonlyexpids=%s), saving configs...:", autocreatelocaldirs, mergeonlyexpids)
         self.Confighandler.saveConfigs()
+        if hydrate is None:
+            hydrate = self.Confighandler.get('exp_manager_hydrate_wiki_data', False)
+        if hydrate and self.Server:
+            self.hydrateWikiData()
         logger.debug("Returning newexpids: %s", newexpids)
-        self.invokePropertyCallbacks('ExperimentsById', self._experimentsbyid)
+        diff.Added.extend(newexpids)
+        self.invokePropertyCallbacks('ExperimentsById', diff)
         return newexpids
 
 
@@ -770,7 +1320,7 @@ class ExperimentManager(LabfluenceBase):
             return
         expByIdMap = self._experimentsbyid if updateSelf else OrderedDict()
         for experiment in experiments:
-            expid = experiment.Props.get('expid')
+            expid = experiment.Expid
             if not expid:
                 logger.warning("Non-True expid '%s' provided; exp foldername is '%s', exp.Props is: %s", expid, experiment.Foldername, experiment.Props)
             # probably do some testing if there is already an exp with this expid !
@@ -782,6 +1332,8 @@ class ExperimentManager(LabfluenceBase):
                     #expByIdMap[expId].update(experiment) # Not implemented; and should probably do some thorough checking before simply merging.
             else:
                 expByIdMap[expid] = experiment
+                if updateSelf:
+                    self._updateExpidIndex((expid, ))
         return expByIdMap
 
 
@@ -790,9 +1342,10 @@ class ExperimentManager(LabfluenceBase):
         Returns a list of experiment indices, i.e. for expids list:
             ['RS102','RS104','RS105']
         return [102, 104, 105]
+        If expByIdMap is not given, the indices are taken from the sorted ExpidIndex.
         """
         if expByIdMap is None:
-            expByIdMap = self.ExperimentsById
+            return self.ExpidIndex.getIndices()
         regex_str = self.Confighandler.get('expid_regex')
         if not regex_str:
             logger.info("No expid regex in config, aborting.")
@@ -808,9 +1361,16 @@ class ExperimentManager(LabfluenceBase):
         # an expid is expected to be the form "RS123",
         # where "RS" is the user initials and "123" is the experiment number/index.
         """
-        indices = self.getExperimentsIndices()
-        m = max(indices) if indices else 0
-        return m+1
+        return self.ExpidIndex.getNextIndex()
+
+    def getExpidsInRange(self, first=None, last=None):
+        """
+        Returns a list of expids with first <= experiment index <= last, sorted by index.
+        first and last can be expids or numeric indices, e.g. getExpidsInRange('RS340')
+        returns all experiments from RS340 and onwards.
+        Raises ValueError if first or last is an expid without an experiment index.
+        """
+        return self.ExpidIndex.getRange(first, last)
 
     def getNewExpid(self):
         """
@@ -856,8 +1416,11 @@ class ExperimentManager(LabfluenceBase):
         logger.info("New experiment created: %s, with localdir: %s, and wikipage with pageId %s", exp, exp.Localdirpath, exp.PageId)
         logger.debug("Adding newly created experiment to list of active experiments...")
         self.ExperimentsById[expid] = exp
+        self._updateExpidIndex((expid, ))
         self.addActiveExperiments((expid, )) # This will take care of invoking registrered callbacks in confighandler.
-        self.invokePropertyCallbacks('ExperimentsById', self._experimentsbyid)
+        diff = ExperimentsByIdDiff(self._experimentsbyid)
+        diff.Added.append(expid)
+        self.invokePropertyCallbacks('ExperimentsById', diff)
         return exp
 
 
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Sorted index of experiment ids, used by ExperimentManager.
+
+Expids like 'RS123' have a numeric experiment index (123). The ExpidIndex keeps the numeric
+indices sorted in an array, with the corresponding expids in a list, so that
+    - the next experiment index (getNewExpIndex) is just the last index + 1, and
+    - range queries ("experiments >= RS340") are two bisections,
+instead of re-parsing all expids with the expid regex every time.
+
+The index is updated incrementally with update(), add() and remove() when experiments are merged or added.
+Inserting into the sorted arrays is O(n), so update() adds many expids at once with a single sort
+(or by appending, if they all come after the indexed expids).
+
+"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+import logging
+logger = logging.getLogger(__name__)
+
+from dirtreeparsing import expidIndex
+
+
+class ExpidIndex(object):
+    """
+    Sorted index of numeric experiment indices -> expids.
+
+    Args:
+        :expids:        Initial expids.
+        :regex_str:     Regex for the expid, with the numeric index as the first group (config entry 'expid_regex').
+                        If not given, the first number in the expid is used.
+    """
+
+    def __init__(self, expids=(), regex_str=None):
+        self._regex_prog = re.compile(regex_str) if regex_str else None
+        self._indices = array('l')  # sorted numeric indices
+        self._expids = []           # expids, aligned with self._indices
+        self._known = set()
+        self.update(expids)
+
+    def __repr__(self):
+        return "ExpidIndex(%s expids)" % len(self._expids)
+
+    def __len__(self):
+        return len(self._expids)
+
+    def __contains__(self, expid):
+        return expid in self._known
+
+    def __iter__(self):
+        return iter(self._expids)
+
+    def parseIndex(self, expid):
+        """ Returns the numeric index of expid (int), or None if expid does not match the expid regex. """
+        if self._regex_prog is None:
+            index = expidIndex(expid)
+            return index if index >= 0 else None
+        match = self._regex_prog.match(expid or '')
+        try:
+            return int(match.group(1))
+        except (AttributeError, IndexError, TypeError, ValueError):
+            return None
+
+    def add(self, expid):
+        """
+        Adds expid to the index. Returns False if expid is already indexed or does not have an index.
+        This is O(n), use update() to add many expids.
+        """
+        index = self.parseIndex(expid)
+        if expid in self._known or index is None:
+            return False
+        # Insert after any expids with the same index, keeping them in the order they were added:
+        pos = bisect_right(self._indices, index)
+        self._indices.insert(pos, index)
+        self._expids.insert(pos, expid)
+        self._known.add(expid)
+        return True
+
+    def update(self, expids):
+        """
+        Adds all expids to the index (expids that are already indexed or do not have an index are skipped).
+        New expids are sorted by index and expid, and appended if they all come after the indexed expids;
+        otherwise the index is rebuilt with a single sort. Existing expids stay before new expids with the same index.
+        """
+        new = []
+        for expid in expids:
+            if expid in self._known:
+                continue
+            index = self.parseIndex(expid)
+            if index is None:
+                continue
+            self._known.add(expid)
+            new.append((index, expid))
+        if not new:
+            return
+        new.sort()
+        if self._indices and new[0][0] < self._indices[-1]:
+            # sorted() is stable, so existing expids stay before new expids with the same index:
+            new = sorted(list(zip(self._indices, self._expids)) + new, key=lambda item: item[0])
+            del self._indices[:]
+            del self._expids[:]
+        self._indices.extend(index for index, _ in new)
+        self._expids.extend(expid for _, expid in new)
+
+    def remove(self, expid):
+        """ Removes expid from the index (if present). """
+        if expid not in self._known:
+            return
+        index = self.parseIndex(expid)
+        pos = bisect_left(self._indices, index)
+        while self._expids[pos] != expid:
+            pos += 1
+        del self._indices[pos]
+        del self._expids[pos]
+        self._known.discard(expid)
+
+    def getIndices(self):
+        """ Returns a sorted list of all experiment indices. """
+        return self._indices.tolist()
+
+    def getMaxIndex(self):
+        """ Returns the largest experiment index, or 0 if the index is empty. """
+        return self._indices[-1] if self._indices else 0
+
+    def getNextIndex(self):
+        """ Returns the next (new) experiment index. """
+        return self.getMaxIndex() + 1
+
+    def getRange(self, first=None, last=None):
+        """
+        Returns a list of expids with first <= index <= last, sorted by index.
+        first and last can be numeric indices or expids, e.g. getRange('RS340') for "all experiments from RS340".
+        Raises ValueError if first or last is an expid without an index.
+        """
+        first, last = self._rangeLimit(first), self._rangeLimit(last)
+        lo = 0 if first is None else bisect_left(self._indices, first)
+        hi = len(self._indices) if last is None else bisect_right(self._indices, last)
+        return self._expids[lo:hi]
+
+    def _rangeLimit(self, limit):
+        """ Returns the numeric index for a getRange limit (None, index or expid). """
+        if limit is None or isinstance(limit, int):
+            return limit
+        index = self.parseIndex(limit)
+        if index is None:
+            raise ValueError("Cannot get the experiment index of %r." % (limit, ))
+        return index
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+File hashing engine.
+
+hashFile reads a file once and feeds every requested digest from the same buffer, e.g.
+    hashFile(filepath, ('md5', 'sha1'))  -> {'md5': '...', 'sha1': '...'}
+instead of reading a multi-GB file once per digest type.
+
+The file is read with readinto() into a single preallocated buffer (default 4 MB), or with mmap.
+hashlib releases the GIL while hashing chunks larger than 2 kB, so with large buffers several
+files can be hashed in parallel threads (hashFiles).
+
+Digest types are hashlib names (md5, sha1, sha256, blake2b, ...), plus
+    'xxh64', 'xxh3_64', 'xxh128'    (requires the xxhash package),
+    'blake3'                        (requires the blake3 package),
+    'fast'                          the fastest available of the above, otherwise 'blake2b'.
+The non-cryptographic digests are much faster than md5 and are only meant for change detection.
+Results are keyed by the resolved digest type, i.e. 'fast' is returned as e.g. 'xxh3_64'.
+
+Tree hashing (treeHashFile), for very large files:
+The file is split into fixed-size chunks (default 64 MB), which are hashed concurrently by a
+thread pool (or a process pool) using os.pread, so a single file can be hashed on several cores.
+The root digest is the digest of the concatenated (binary) chunk digests. The chunk digests are
+returned as well, so two versions of a file can later be compared chunk by chunk (diffTreeHashes),
+e.g. to find the corrupted or changed part of a file, or to resume a transfer.
+A tree digest is not the same as the plain digest of the file; in fileshistory entries it is
+stored as 'tree-<digesttype>', e.g. 'tree-sha256'. digestEntry computes a mix of plain and
+tree digests, reading the file in a single pass only if there are plain digests.
+
+"""
+from __future__ import print_function
+import os
+import mmap
+import binascii
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = ProcessPoolExecutor = None     # python 2 without the futures backport; files are hashed one at a time.
+
+
+BUFFERSIZE = 4*2**20    # 4 MB
+TREEHASH_CHUNKSIZE = 64*2**20   # 64 MB
+TREEHASH_MIN_SIZE = 1024*2**20  # Files above 1 GB are tree-hashed by the sync verifier.
+TREEHASH_WORKERS = min(8, (getattr(os, 'cpu_count', lambda: None)() or 4))
+
+if xxhash is not None and hasattr(xxhash, 'xxh3_64'):
+    FAST_DIGESTTYPE = 'xxh3_64'
+elif xxhash is not None:
+    FAST_DIGESTTYPE = 'xxh64'
+elif blake3 is not None:
+    FAST_DIGESTTYPE = 'blake3'
+else:
+    FAST_DIGESTTYPE = 'blake2b'
+
+
+def resolveDigesttype(digesttype):
+    """ Returns the actual digest type for digesttype (i.e. resolves 'fast'). """
+    return FAST_DIGESTTYPE if digesttype == 'fast' else digesttype
+
+
+def newHasher(digesttype):
+    """ Returns a new hasher object (with update and hexdigest methods) for digesttype. """
+    digesttype = resolveDigesttype(digesttype)
+    if digesttype.startswith('xxh'):
+        if xxhash is None:
+            raise ValueError("Digest type %s requires the xxhash package." % digesttype)
+        return getattr(xxhash, digesttype)()
+    if digesttype == 'blake3':
+        if blake3 is None:
+            raise ValueError("Digest type blake3 requires the blake3 package.")
+        return blake3.blake3()
+    return hashlib.new(digesttype)
+
+
+def hashFile(filepath, digesttypes=('md5', ), buffersize=BUFFERSIZE, usemmap=False, offset=0, length=None):
+    """
+    Returns {digesttype: hexdigest} for all digesttypes, reading filepath only once.
+    If usemmap is True, the file is memory mapped instead of read into a buffer
+    (avoids copying, but the file's pages stay in the page cache).
+    offset and length can be used to hash only a part of the file.
+    """
+    hashers = [(resolveDigesttype(digesttype), newHasher(digesttype)) for digesttype in digesttypes]
+    with open(filepath, 'rb') as fd:
+        size = os.fstat(fd.fileno()).st_size
+        end = size if length is None else min(size, offset + length)
+        if usemmap and end > offset:
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                view = memoryview(mm)
+                for start in range(offset, end, buffersize):
+                    chunk = view[start:min(start + buffersize, end)]
+                    for _, hasher in hashers:
+                        hasher.update(chunk)
+                    chunk.release()
+                view.release()
+            finally:
+                mm.close()
+        else:
+            fd.seek(offset)
+            buf = bytearray(min(buffersize, max(end - offset, 1)))
+            view = memoryview(buf)
+            remaining = end - offset
+            while remaining > 0:
+                n = fd.readinto(view[:min(len(buf), remaining)])
+                if not n:
+                    break
+                for _, hasher in hashers:
+                    hasher.update(view[:n])
+                remaining -= n
+    return {digesttype: hasher.hexdigest() for digesttype, hasher in hashers}
+
+
+def hashFiles(filepaths, digesttypes=('md5', ), workers=4, **kwargs):
+    """
+    Hashes filepaths in parallel threads (up to <workers>), see hashFile.
+    Returns {filepath: {digesttype: hexdigest}}; files that cannot be read are logged and omitted.
+    """
+    filepaths = list(filepaths)
+    def hashOne(filepath):
+        """ Hash a single file, returning None if it cannot be read. """
+        try:
+            return hashFile(filepath, digesttypes, **kwargs)
+        except (IOError, OSError) as e:
+            logger.warning("Could not hash %s: %s", filepath, e)
+            return None
+    if ThreadPoolExecutor is not None and workers > 1 and len(filepaths) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(filepaths))) as executor:
+            digests = list(executor.map(hashOne, filepaths))
+    else:
+        digests = [hashOne(filepath) for filepath in filepaths]
+    return {filepath: digest for filepath, digest in zip(filepaths, digests) if digest is not None}
+
+
+def hashChunk(args):
+    """
+    Returns the hex digest of <length> bytes of filepath, starting at offset.
+    args is a (filepath, digesttype, offset, length) tuple (a single argument, so it can be used with executor.map).
+    Uses os.pread, so threads do not share a file position; falls back to seek/read where pread is not available.
+    Must be a module-level function, so it can be used with a process pool.
+    """
+    filepath, digesttype, offset, length = args
+    hasher = newHasher(digesttype)
+    fd = os.open(filepath, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        end = offset + length
+        pos = offset
+        while pos < end:
+            if hasattr(os, 'pread'):
+                data = os.pread(fd, min(BUFFERSIZE, end - pos), pos)
+            else:
+                os.lseek(fd, pos, os.SEEK_SET)
+                data = os.read(fd, min(BUFFERSIZE, end - pos))
+            if not data:
+                break
+            hasher.update(data)
+            pos += len(data)
+    finally:
+        os.close(fd)
+    return hasher.hexdigest()
+
+
+def treeHashFile(filepath, digesttype='sha256', chunksize=TREEHASH_CHUNKSIZE, workers=TREEHASH_WORKERS, useprocesses=False):
+    """
+    Tree-hashes filepath, see module docstring.
+    Chunks are hashed concurrently by up to <workers> threads (or processes if useprocesses is True,
+    for digests that do not release the GIL).
+    Returns a dict with keys
+        digesttype      e.g. 'tree-sha256'
+        root            root hex digest
+        chunks          list of chunk hex digests
+        chunksize       chunk size in bytes
+        size            file size in bytes
+    """
+    digesttype = resolveDigesttype(digesttype)
+    size = os.path.getsize(filepath)
+    chunkargs = [(filepath, digesttype, offset, min(chunksize, size - offset)) for offset in range(0, size, chunksize)]
+    if ProcessPoolExecutor is not None and workers > 1 and len(chunkargs) > 1:
+        executorclass = ProcessPoolExecutor if useprocesses else ThreadPoolExecutor
+        with executorclass(max_workers=min(workers, len(chunkargs))) as executor:
+            chunks = list(executor.map(hashChunk, chunkargs))
+    else:
+        chunks = [hashChunk(args) for args in chunkargs]
+    roothasher = newHasher(digesttype)
+    for chunk in chunks:
+        roothasher.update(binascii.unhexlify(chunk))
+    return dict(digesttype='tree-' + digesttype, root=roothasher.hexdigest(), chunks=chunks, chunksize=chunksize, size=size)
+
+
+def digestEntry(filepath, digesttypes=('md5', )):
+    """
+    Returns {digesttype: hexdigest} for digesttypes, which can include tree digest types ('tree-<digesttype>').
+    Plain digests are computed in a single pass (hashFile); the file is not read that way if only
+    tree digests are requested. For each tree digest type, the entry also has the chunk digests
+    ('tree-<digesttype>-chunks') and the chunk size ('tree-chunksize').
+    """
+    treetypes = [digesttype for digesttype in digesttypes if digesttype.startswith('tree-')]
+    plaintypes = [digesttype for digesttype in digesttypes if digesttype not in treetypes]
+    digestentry = hashFile(filepath, plaintypes) if plaintypes else {}
+    for treetype in treetypes:
+        treehash = treeHashFile(filepath, treetype[len('tree-'):])
+        digestentry[treehash['digesttype']] = treehash['root']
+        digestentry[treehash['digesttype'] + '-chunks'] = treehash['chunks']
+        digestentry['tree-chunksize'] = treehash['chunksize']
+    return digestentry
+
+
+def diffTreeHashes(treehash1, treehash2):
+    """
+    Returns a list of the indices of the chunks that differ between two tree hashes of the same chunk size
+    (chunks only present in the longer file are included). Raises ValueError if the chunk sizes differ.
+    """
+    if treehash1['chunksize'] != treehash2['chunksize'] or treehash1['digesttype'] != treehash2['digesttype']:
+        raise ValueError("Tree hashes with different chunk sizes or digest types cannot be compared.")
+    chunks1, chunks2 = treehash1['chunks'], treehash2['chunks']
+    return [idx for idx in range(max(len(chunks1), len(chunks2)))
+            if idx >= len(chunks1) or idx >= len(chunks2) or chunks1[idx] != chunks2[idx]]
+
+
+def filesMatch(filepath1, filepath2, digesttype='md5', treehash_minsize=TREEHASH_MIN_SIZE):
+    """
+    Returns True if the two files have the same size and content digest.
+    Files of at least treehash_minsize bytes are compared with treeHashFile (and differing chunks are logged).
+    """
+    size = os.path.getsize(filepath1)
+    if size != os.path.getsize(filepath2):
+        return False
+    if size >= treehash_minsize:
+        treehash1, treehash2 = treeHashFile(filepath1, digesttype), treeHashFile(filepath2, digesttype)
+        if treehash1['root'] != treehash2['root']:
+            logger.info("%s and %s differ in chunks %s (of %s bytes).", filepath1, filepath2,
+                        diffTreeHashes(treehash1, treehash2), treehash1['chunksize'])
+            return False
+        return True
+    digesttype = resolveDigesttype(digesttype)
+    return hashFile(filepath1, (digesttype, ))[digesttype] == hashFile(filepath2, (digesttype, ))[digesttype]
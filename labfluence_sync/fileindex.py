@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Cached index of the files in a local experiment folder, used by Filemanager.
+
+Filemanager.getLocalFilelist and listLocalFiles are called repeatedly by the GUI and the
+attachment functions, and used to os.walk the experiment folder every time.
+The LocalFileIndex caches the listing of each directory, together with the directory's mtime:
+    dirpath -> (mtime, [subdirnames], [filenames])
+A directory's mtime changes when entries are added, removed or renamed in it, so a cached
+listing is valid as long as the mtime is unchanged; only changed directories are listed again.
+Directories are listed with os.scandir, which gets the file/directory type from the directory
+listing itself instead of stat'ing each entry.
+Like os.walk, symlinks to directories are listed in dirnames, but walk() does not descend into
+them (so a symlink cycle does not make the walk recurse forever).
+
+    index = LocalFileIndex(localdirpath)
+    for dirpath, dirnames, filenames in index.walk():   # like os.walk(localdirpath)
+        ...
+    for dirpath, filename in index.iterFiles(subdir):   # streaming, for very large folders
+        ...
+
+Generation is incremented whenever a directory is (re-)listed, so callers can cache results
+derived from the index and reuse them while index.checkUnchanged(topdir) is True.
+
+"""
+from __future__ import print_function
+import os
+import logging
+logger = logging.getLogger(__name__)
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir     # python 2 backport
+    except ImportError:
+        scandir = None
+
+
+def getMtime(path):
+    """ Returns the modification time of path, or None if path does not exist. """
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def listDir(dirpath):
+    """
+    Returns ([subdirnames], [filenames], [linkdirnames]) for dirpath, using scandir if available.
+    linkdirnames are the subdirnames that are symlinks (which should not be descended into).
+    """
+    dirnames, filenames, linkdirnames = [], [], []
+    if scandir is not None:
+        for entry in scandir(dirpath):
+            try:
+                isdir = entry.is_dir()
+                if isdir and entry.is_symlink():
+                    linkdirnames.append(entry.name)
+            except OSError:
+                isdir = False
+            (dirnames if isdir else filenames).append(entry.name)
+    else:
+        for name in os.listdir(dirpath):
+            path = os.path.join(dirpath, name)
+            isdir = os.path.isdir(path)
+            if isdir and os.path.islink(path):
+                linkdirnames.append(name)
+            (dirnames if isdir else filenames).append(name)
+    return dirnames, filenames, linkdirnames
+
+
+class LocalFileIndex(object):
+    """
+    Cached, mtime-invalidated listing of a directory tree, see module docstring.
+
+    Args:
+        :rootdir:   The experiment folder.
+    """
+
+    def __init__(self, rootdir):
+        self.Rootdir = rootdir
+        self.Generation = 0
+        self._dirs = {}     # dirpath -> (mtime, dirnames, filenames, linkdirnames)
+
+    def __repr__(self):
+        return "LocalFileIndex('%s', %s dirs cached)" % (self.Rootdir, len(self._dirs))
+
+    def getListing(self, dirpath):
+        """
+        Returns (dirnames, filenames) for dirpath, from the cache if dirpath's mtime is unchanged.
+        Returns ([], []) if dirpath does not exist (or cannot be listed).
+        """
+        return self._getListing(dirpath)[:2]
+
+    def _getListing(self, dirpath):
+        """ Returns (dirnames, filenames, linkdirnames) for dirpath, see getListing and listDir. """
+        mtime = getMtime(dirpath)
+        cached = self._dirs.get(dirpath)
+        if cached is not None and cached[0] == mtime:
+            return cached[1:]
+        if mtime is None:
+            self.invalidate(dirpath)
+            return [], [], []
+        try:
+            dirnames, filenames, linkdirnames = listDir(dirpath)
+        except OSError as e:
+            logger.info("Could not list %s: %s", dirpath, e)
+            return [], [], []
+        if cached is not None:
+            # Drop cached listings of subdirectories that were removed or renamed:
+            for dirname in set(cached[1]) - set(dirnames):
+                self.invalidate(os.path.join(dirpath, dirname))
+        self._dirs[dirpath] = (mtime, dirnames, filenames, linkdirnames)
+        self.Generation += 1
+        return dirnames, filenames, linkdirnames
+
+    def invalidate(self, dirpath=None):
+        """ Drops the cached listings of dirpath and all directories below it (everything if dirpath is None). """
+        if dirpath is None:
+            self._dirs.clear()
+        else:
+            for path in [path for path in self._dirs if path == dirpath or path.startswith(dirpath + os.sep)]:
+                del self._dirs[path]
+        self.Generation += 1
+
+    def walk(self, topdir=None):
+        """
+        Generator like os.walk(topdir) (default: Rootdir), but using the cached listings.
+        Like os.walk (top-down), dirnames can be modified in-place to prune the walk, and
+        symlinks to directories are included in dirnames but not walked into (followlinks=False).
+        """
+        stack = [topdir or self.Rootdir]
+        while stack:
+            dirpath = stack.pop()
+            dirnames, filenames, linkdirnames = self._getListing(dirpath)
+            dirnames = list(dirnames)   # Copies, so pruning by the caller does not change the cache.
+            yield dirpath, dirnames, list(filenames)
+            stack.extend(os.path.join(dirpath, dirname) for dirname in reversed(dirnames)
+                         if dirname not in linkdirnames)
+
+    def iterFiles(self, topdir=None):
+        """ Generator of (dirpath, filename) for all files below topdir (default: Rootdir). """
+        for dirpath, _, filenames in self.walk(topdir):
+            for filename in filenames:
+                yield dirpath, filename
+
+    def checkUnchanged(self, topdir=None):
+        """
+        Returns True if no cached directory below topdir (default: all cached directories) has changed
+        since it was last listed (one stat per cached directory; nothing is listed).
+        Returns False if topdir is given but has not been listed.
+        """
+        if topdir is not None and topdir not in self._dirs:
+            return False
+        return all(getMtime(dirpath) == mtime for dirpath, (mtime, _, _, _) in self._dirs.items()
+                   if topdir is None or dirpath == topdir or dirpath.startswith(topdir + os.sep))
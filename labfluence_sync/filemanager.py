@@ -34,11 +34,21 @@ from __future__ import print_function
 import os
 from datetime import datetime
 import yaml
+import sqlite3
 import fnmatch
 import re
 import logging
 logger = logging.getLogger(__name__)
-from utils import filehexdigest, attachmentTupFromFilepath
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # python 2 without the 'futures' backport; attachments are synced one at a time.
+    ThreadPoolExecutor = None
+from utils import attachmentTupFromFilepath
+import filehashing
+from fileshistory import FileshistoryStore
+from fileindex import LocalFileIndex
+from attachmenttransport import StreamingAttachmentTransport
 
 
 class Filemanager(object):
@@ -57,6 +67,10 @@ class Filemanager(object):
         # Other params: localdir=None, wikipage, pageid, ?
         self.Experiment = experiment
         self._fileshistory = None
+        self._prefetchedattachments = None # Set by ExperimentManager.hydrateWikiData (batch fetch).
+        self._attachmenttransport = None
+        self._fileindex = None
+        self._filelistcache = dict() # getLocalFilelist arguments -> (FileIndex.Generation, result)
 
     @property
     def Localdirpath(self):
@@ -78,6 +92,20 @@ class Filemanager(object):
         """ Attachments. Currently obtained from Experiment."""
         return self.Experiment.Attachments
 
+    @property
+    def FileIndex(self):
+        """
+        Cached index of the files in the experiment folder (see the fileindex module),
+        or None if the experiment has no local folder. Re-created if the experiment folder changes.
+        """
+        localdirpath = self.Localdirpath
+        if not localdirpath:
+            return None
+        if self._fileindex is None or self._fileindex.Rootdir != localdirpath:
+            self._fileindex = LocalFileIndex(localdirpath)
+            self._filelistcache.clear()
+        return self._fileindex
+
     @property
     def Fileshistory(self):
         """
@@ -85,8 +113,10 @@ class Filemanager(object):
         ###I plan to allow for saving file histories, having a dict
         ###Fileshistory['RS123d subentry_titledesc/RS123d_c1-grid1_somedate.jpg'] -> list of {datetime:<datetime>, md5:<md5digest>} dicts.
         ###This will make it easy to detect simple file moves/renames and allow for new digest algorithms.
+        The files history is a FileshistoryStore (see the fileshistory module), which can be read like the
+        dict above; add entries with addDigestentry(). Use findByDigest() to find files by digest.
         """
-        if not self._fileshistory:
+        if self._fileshistory is None:
             ok = self.loadFileshistory() # Make sure self.loadFileshistory does NOT refer to self.Fileshistory (cyclic reference)
             if not ok:
                 logger.error("Critical error encountered while trying to load fileshistory; returning fake empty dict() to prevent complete failover.")
@@ -112,6 +142,18 @@ class Filemanager(object):
         """
         return self.Experiment.WikiPage
 
+    @property
+    def AttachmentTransport(self):
+        """
+        StreamingAttachmentTransport used to upload/download attachments in chunks (see attachmenttransport module),
+        if enabled with config entry 'wiki_streaming_attachments' (chunk size 'wiki_attachment_chunksize').
+        Returns None if not enabled or no server is available, in which case attachments are transferred with XML-RPC.
+        """
+        if self._attachmenttransport is None and self.Confighandler.get('wiki_streaming_attachments'):
+            self._attachmenttransport = StreamingAttachmentTransport.fromServer(
+                self.Experiment.Server, chunksize=self.Confighandler.get('wiki_attachment_chunksize', 2**20))
+        return self._attachmenttransport
+
 
     #####
     ##### General methods:
@@ -127,62 +169,132 @@ class Filemanager(object):
         """
         return self.Experiment.getPathFor(relative)
 
+    def addDigestentry(self, filepath, digestentry):
+        """ Adds digestentry ({datetime: <datetime>, <digesttype>: digest}) for filepath to the fileshistory. """
+        relpath = os.path.relpath(filepath, self.Localdirpath)
+        fileshistory = self.Fileshistory
+        if isinstance(fileshistory, FileshistoryStore):
+            fileshistory.append(relpath, digestentry)
+        else:
+            fileshistory.setdefault(relpath, []).append(digestentry)
+
+    def _attachmentHistoryKey(self, attachment):
+        """
+        Returns the fileshistory key for the digests of (the current version of) an attachment struct:
+        ('attachment:<id>', <version>). The version is the struct's 'version' (number), or, for XML-RPC
+        attachment structs, which do not have a version, the 'created' date of the attachment version.
+        """
+        version = attachment.get('version')
+        if isinstance(version, dict):
+            version = version.get('number')
+        if version is None:
+            version = attachment.get('created')
+        return 'attachment:%s' % attachment['id'], str(version) if version is not None else None
+
+    def addRemoteDigest(self, attachment, digesttype, digest):
+        """
+        Records the digest of the uploaded attachment (struct) in the fileshistory, keyed by attachment id
+        and version. Used when the digest cannot be stored in the attachment comment (XML-RPC upload).
+        """
+        key, version = self._attachmentHistoryKey(attachment)
+        digestentry = {filehashing.resolveDigesttype(digesttype): digest, 'attachmentversion': version, 'datetime': datetime.now()}
+        fileshistory = self.Fileshistory
+        if isinstance(fileshistory, FileshistoryStore):
+            fileshistory.append(key, digestentry)
+        else:
+            fileshistory.setdefault(key, []).append(digestentry)
+
+    def getRemoteDigest(self, attachment, digesttype='md5'):
+        """
+        Returns the <digesttype> digest recorded by addRemoteDigest for this version of attachment, or None.
+        """
+        key, version = self._attachmentHistoryKey(attachment)
+        digesttype = filehashing.resolveDigesttype(digesttype)
+        for digestentry in reversed(self.Fileshistory.get(key, [])):
+            if digesttype in digestentry and digestentry.get('attachmentversion') == version:
+                return digestentry[digesttype]
+        return None
+
     def hashFile(self, filepath, digesttypes=('md5', )):
         """
         Default is currently md5, although e.g. sha1 is not that much slower.
         The sha256 and sha512 are approx 2x slower than md5, and I dont think that is requried.
+        All digests are computed in a single pass over the file (see the filehashing module);
+        use digesttype 'fast' for a fast non-cryptographic digest for change detection.
+        Digest types 'tree-<digesttype>' (e.g. 'tree-sha256') compute a parallel, chunked tree hash instead,
+        and the entry then also has the chunk digests ('tree-sha256-chunks') and chunk size ('tree-chunksize'),
+        which can be compared chunk by chunk with filehashing.diffTreeHashes.
 
         Returns digestentry dict {datetime:datetime.now(), <digesttype>:digest }
+        Digests are keyed by the actual digest type, i.e. 'fast' is resolved (filehashing.resolveDigesttype).
         """
         logger.info("Experiment.hashFile() :: Not tested yet - take care ;)")
         if not os.path.isabs(filepath):
             filepath = os.path.normpath(os.path.join(self.Localdirpath, filepath))
+        digestentry = filehashing.digestEntry(filepath, digesttypes)
+        digestentry['datetime'] = datetime.now()
+        # if hexdigest is present, then no need to add it...? Well, now that you have hashed it, just add it anyways.
+        self.addDigestentry(filepath, digestentry)
+        return digestentry
+
+    def getCachedDigest(self, filepath, digesttype='md5'):
+        """
+        Returns the most recent <digesttype> digest for filepath from the fileshistory,
+        if it was recorded after the file was last modified; otherwise None.
+        """
+        digesttype = filehashing.resolveDigesttype(digesttype)
         relpath = os.path.relpath(filepath, self.Localdirpath)
+        try:
+            mtime = datetime.fromtimestamp(os.path.getmtime(filepath))
+        except OSError:
+            return None
+        for digestentry in reversed(self.Fileshistory.get(relpath, [])):
+            if digesttype in digestentry and digestentry.get('datetime') and digestentry['datetime'] >= mtime:
+                return digestentry[digesttype]
+        return None
+
+    def findByDigest(self, digest, digesttype=None):
+        """
+        Returns a list of relpaths of files that have had the given digest, according to the fileshistory.
+        Attachment digests (addRemoteDigest) are not included.
+        """
         fileshistory = self.Fileshistory
-        digestentry = {digesttype: filehexdigest(filepath, digesttype) for digesttype in digesttypes}
-        digestentry['datetime'] = datetime.now()
-        if relpath in fileshistory:
-            # if hexdigest is present, then no need to add it...? Well, now that you have hashed it, just add it anyways.
-            #if hexdigest not in [entry[digesttype] for entry in fileshistory[relpath] if digesttype in entry]:
-            fileshistory[relpath].append(digestentry)
+        if isinstance(fileshistory, FileshistoryStore):
+            relpaths = fileshistory.findByDigest(digest, digesttype)
         else:
-            fileshistory[relpath] = [digestentry]
-        return digestentry
+            relpaths = [relpath for relpath, entries in fileshistory.items()
+                        if any(entry.get(digesttype) == digest if digesttype else digest in entry.values() for entry in entries)]
+        return [relpath for relpath in relpaths if not relpath.startswith('attachment:')]
 
     def saveFileshistory(self):
         """
         Persists fileshistory to file.
+        Entries are appended to the fileshistory store as they are added, so this just commits them.
         """
-        fileshistory = self.Fileshistory # This is ok; if _fileshistory is empty, it will try to reload to make sure not to override.
-        if not fileshistory:
-            logger.info("No fileshistory ('%s')for experiment '%s', aborting saveFileshistory.", fileshistory, self)
+        if self._fileshistory is None:
+            logger.info("No fileshistory loaded for experiment '%s', aborting saveFileshistory.", self)
             return
-        savetofolder = os.path.join(self.Localdirpath, '.labfluence')
-        if not os.path.isdir(savetofolder):
-            try:
-                os.mkdir(savetofolder)
-            except OSError as e:
-                logger.warning(e)
-                return
-        fn = os.path.join(savetofolder, 'files_history.yml')
-        yaml.dump(fileshistory, open(fn, 'wb'), default_flow_style=False)
+        self._fileshistory.commit()
 
     def loadFileshistory(self):
         """
-        Loads the fileshistory from file.
+        Loads the fileshistory from file (.labfluence/files_history.sqlite).
+        On first load, an existing .labfluence/files_history.yml is imported.
         """
         if not self.Localdirpath:
             logger.warning("loadFileshistory was invoked, but experiment has no localfiledirpath. (%s)", self)
             return
         savetofolder = os.path.join(self.Localdirpath, '.labfluence')
-        fn = os.path.join(savetofolder, 'files_history.yml')
         try:
-            if self._fileshistory is None:
-                self._fileshistory = dict()
-            self._fileshistory.update(yaml.load(open(fn)))
-            return True
-        except (OSError, IOError, yaml.YAMLError) as e:
+            if not os.path.isdir(savetofolder):
+                os.mkdir(savetofolder)
+            store = FileshistoryStore(os.path.join(savetofolder, 'files_history.sqlite'))
+            store.importYaml(os.path.join(savetofolder, 'files_history.yml'))
+        except (OSError, IOError, sqlite3.Error, yaml.YAMLError) as e:
             logger.info("loadFileshistory error: %s", e)
+            return
+        self._fileshistory = store
+        return True
 
 
     #####
@@ -201,8 +313,32 @@ class Filemanager(object):
             logger.info("No localdirpath? Is: %s", self.Localdirpath)
             return list()
         relstart = self.getPathFor(relative)
-        return [os.path.relpath(os.path.join(dirpath, filename), relstart)
-                for dirpath, _, filenames in os.walk(self.Localdirpath) for filename in filenames]
+        return [os.path.join(reldir, filename)
+                for dirpath, _, filenames in self.FileIndex.walk() if filenames
+                for reldir in (os.path.relpath(dirpath, relstart), ) for filename in filenames]
+
+    def iterLocalFiles(self, subentry_idx=None, relative=None):
+        """
+        Generator of (relpath, path) tuples for the files in the experiment folder
+        (or only in the folder of subentry <subentry_idx>), yielded as each directory is listed,
+        so that folders with very many files can be processed without building a full list.
+        relpath is relative to :relative: (see getPathFor).
+        """
+        fileindex = self.FileIndex
+        if fileindex is None:
+            return
+        topdir = self.Localdirpath
+        if subentry_idx is not None:
+            foldername = self.Subentries.get(subentry_idx, {}).get('foldername')
+            if not foldername:
+                logger.info("iterLocalFiles: Subentry %s has no local folder.", subentry_idx)
+                return
+            topdir = os.path.join(topdir, foldername)
+        relstart = self.getPathFor(relative)
+        for dirpath, _, filenames in fileindex.walk(topdir):
+            reldir = os.path.relpath(dirpath, relstart)
+            for filename in filenames:
+                yield os.path.join(reldir, filename), os.path.join(dirpath, filename)
 
     def getLocalFilelist(self, fn_pattern=None, fn_is_regex=False, relative=None, subentries_only=True, subentry_idxs=None):
         """
@@ -220,10 +356,27 @@ class Filemanager(object):
         # oneliner for listing files with os.walk:
         print("\n".join(u"{}:\n{}".format(dirpath, "\n".join(os.path.join(dirpath, filename) for filename in filenames))
                         for dirpath, dirnames, filenames in os.walk('.')))
+
+        Directory listings are cached by self.FileIndex, and the returned list is cached until
+        a directory in the experiment folder changes. Use iterLocalFiles for very large folders.
         """
-        ret = list()
         if not self.Localdirpath:
-            return ret
+            return list()
+        fileindex = self.FileIndex
+        subentryfolders = tuple((idx, subentry.get('foldername')) for idx, subentry in (self.Subentries or {}).items())
+        key = (fn_pattern, fn_is_regex, relative, subentries_only, tuple(subentry_idxs or ()), subentryfolders,
+               self.Confighandler.get('local_exp_ignore_pattern'))
+        cached = self._filelistcache.get(key)
+        if cached is not None and cached[0] == fileindex.Generation and fileindex.checkUnchanged():
+            return list(cached[1])
+        ret = self._getLocalFilelist(fn_pattern, fn_is_regex, relative, subentries_only, subentry_idxs)
+        self._filelistcache[key] = (fileindex.Generation, ret)
+        return list(ret)
+
+    def _getLocalFilelist(self, fn_pattern=None, fn_is_regex=False, relative=None, subentries_only=True, subentry_idxs=None):
+        """ Uncached implementation of getLocalFilelist, using self.FileIndex for directory listings. """
+        ret = list()
+        fileindex = self.FileIndex
         if subentry_idxs is None:
             subentry_idxs = list()
         relstart = self.getPathFor(relative)
@@ -237,9 +390,12 @@ class Filemanager(object):
             def file_repr(dirpath, filename, relstart):
                 path = os.path.join(dirpath, filename)
                 return os.path.join(os.path.relpath(path, relstart))
+            reldirs = dict() # dirpath -> dirpath relative to relstart; relpath is only computed once per directory.
             def make_tuple(dirpath, filename):
                 path = os.path.join(dirpath, filename)
-                return (os.path.join(os.path.relpath(path, relstart)), path, dict(fileName=filename, filepath=path))
+                if dirpath not in reldirs:
+                    reldirs[dirpath] = os.path.relpath(dirpath, relstart)
+                return (os.path.join(reldirs[dirpath], filename), path, dict(fileName=filename, filepath=path))
         if fn_pattern:
             if not fn_is_regex:
                 # fnmatch translates into equivalent regex, offers the methods fnmatch, fnmatchcase, filter, re and translate
@@ -262,7 +418,7 @@ class Filemanager(object):
             for idx, subentry in self.Subentries.items():
                 if (subentries_only or idx in subentry_idxs) and 'foldername' in subentry:
                     # perhaps in a try-except clause...
-                    for dirpath, dirnames, filenames in os.walk(os.path.join(self.Localdirpath, subentry['foldername'])):
+                    for dirpath, dirnames, filenames in fileindex.walk(os.path.join(self.Localdirpath, subentry['foldername'])):
                         for filename in filenames:
                             appendfile(dirpath, filename)
             return ret
@@ -270,7 +426,7 @@ class Filemanager(object):
         if ignore_pat:
             logger.debug("returning filelist by ignore pattern '%s'", ignore_pat)
             ignore_prog = re.compile(ignore_pat)
-            for dirpath, dirnames, filenames in os.walk(self.Localdirpath):
+            for dirpath, dirnames, filenames in fileindex.walk():
                 # http://stackoverflow.com/questions/18418/elegant-way-to-remove-items-from-sequence-in-python
                 # remember to modify dirnames list in-place:
                 #dirnames = filter(lambda d: ignore_prog.search(d) is None, dirnames) # does not work
@@ -288,7 +444,7 @@ class Filemanager(object):
         else:
             logger.debug("Experiment.getLocalFilelist() - no ignore_pat, filtering from complete filelist...")
             #return [(path, os.path.relpath(path) for dirpath,dirnames,filenames in os.walk(self.Localdirpath) for filename in filenames for path in (appendfile(dirpath, filename), ) if path]
-            for dirpath, dirnames, filenames in os.walk(self.Localdirpath):
+            for dirpath, dirnames, filenames in fileindex.walk():
                 for filename in filenames:
                     appendfile(dirpath, filename)
         logger.debug("Experiment.getLocalFilelist() :: Returning list: %s", ret)
@@ -301,26 +457,40 @@ class Filemanager(object):
     ### Wiki-page related methods
     ###
 
-    def downloadAttachment(self, filename, version=0, subentry=None):
+    def downloadAttachment(self, filename, version=0, subentry=None, progress=None):
         """
         Download attachment
         # NOTE: CONF-31169 and CONF-30024.
         # - attachment title ignored when adding attachment
         # - RemoteAttachment.java does not have a comment setter.
+        If the streaming AttachmentTransport is enabled, the (current version of the) attachment is
+        downloaded in chunks, progress(bytes downloaded, total bytes) is called after each chunk,
+        and the md5 digest computed during download is added to the fileshistory.
+        Returns the attachment struct (streaming) or attachment data (XML-RPC), or None if failed.
         """
+        filedir = self.Localdirpath
+        filepath = os.path.join(filedir, filename)
+        transport = self.AttachmentTransport
+        if transport is not None and not version:
+            attachment = next((struct for struct in self.Attachments if struct['fileName'] == filename), None)
+            if attachment is None:
+                logger.warning("Attachment %s not found on wiki page, cannot download.", filename)
+                return None
+            _, hexdigest = transport.download(attachment, filepath, progress=progress)
+            if hexdigest:
+                self.addDigestentry(filepath, {transport.Digesttype: hexdigest, 'datetime': datetime.now()})
+            return attachment
         wikipage = self.WikiPage
         if wikipage is None:
             logger.error("Could not get wikipage, returning fake None to avoid failover; error was: %s")
             return None
         attdata = wikipage.getAttachmentData(filename, version)
-        filedir = self.Localdirpath
-        filepath = os.path.join(filedir, filename)
-        with open(filepath, 'rb') as fd:
+        with open(filepath, 'wb') as fd:
             fd.write(attdata.data)
         return attdata
 
 
-    def uploadAttachment(self, filepath, att_info=None, digesttype='md5'):
+    def uploadAttachment(self, filepath, att_info=None, digesttype='md5', progress=None):
         """
         Upload attachment to wiki page.
         Returns True if succeeded, False if failed and None if no attemt was made to upload due to a local Error.
@@ -339,6 +509,9 @@ class Filemanager(object):
             creator     String  creator of the attachment
             url         String  url to download the attachment online
             comment     String  comment for the attachment (Required)
+        If the streaming AttachmentTransport is enabled, the file is uploaded in chunks instead of being read
+        into memory, progress(bytes uploaded, total bytes) is called after each chunk, and the digest computed
+        during upload is added to the fileshistory (digesttype is then the transport's digest type).
         """
         logger.warning("This method id not tested yet - take care ;)")
         wikipage = self.WikiPage
@@ -347,6 +520,14 @@ class Filemanager(object):
             return None
         if not os.path.isabs(filepath):
             filepath = os.path.normpath(os.path.join(self.Localdirpath, filepath))
+        transport = self.AttachmentTransport
+        if transport is not None:
+            comment = (att_info or {}).get('comment')
+            attachment, hexdigest = transport.upload(wikipage.PageId, filepath, comment=comment, progress=progress,
+                                                     attachmentid=(att_info or {}).get('id'))
+            if hexdigest:
+                self.addDigestentry(filepath, {transport.Digesttype: hexdigest, 'datetime': datetime.now()})
+            return attachment
         # path relative to this experiment, e.g. 'RS123d subentry_titledesc/RS123d_c1-grid1_somedate.jpg'
         attachmentInfo, attachmentData = attachmentTupFromFilepath(filepath)
         attachment = wikipage.addAttachment(attachmentInfo, attachmentData)
@@ -387,7 +568,12 @@ class Filemanager(object):
         - pageId (string)
         - title (string)
         - url (string)
+        If the attachments list was prefetched (setPrefetchedAttachments), that list is returned
+        (once) instead of querying the server.
         """
+        if self._prefetchedattachments is not None:
+            attachment_structs, self._prefetchedattachments = self._prefetchedattachments, None
+            return attachment_structs
         wikipage = self.WikiPage
         if wikipage is None:
             logger.error("Could not get wikipage, returning fake new list() to avoid failover.")
@@ -400,6 +586,121 @@ class Filemanager(object):
         return attachment_structs
 
 
+    def setPrefetchedAttachments(self, attachment_structs):
+        """
+        Sets an attachments list fetched in a batch for many experiments (see wikifetch module).
+        The list is returned by the next call to getAttachments(), i.e. the next time the
+        experiment's Attachments cache is refreshed.
+        """
+        self._prefetchedattachments = attachment_structs
+
+
+    def syncAttachments(self, pattern=None, fn_is_regex=False, subentries_only=True, download=False,
+                        digesttype='md5', workers=4, dryrun=False):
+        """
+        Syncs local files to the wiki page attachments.
+        Local files (getLocalFilelist) and attachments (getAttachmentList), both filtered by pattern,
+        are compared by filename, then by size, and then by digest:
+        - The local digest is taken from the fileshistory if recorded after the file was last modified,
+          otherwise the file is hashed (and the digest added to the fileshistory).
+        - The attachment digest is read from the attachment comment ('<digesttype>-hexdigest: <digest>'),
+          which is written by this method when uploading. Since the comment cannot be set with XML-RPC,
+          the digest of each uploaded attachment version is also recorded in the fileshistory
+          (addRemoteDigest), which is used if the comment has no digest.
+          Attachments without a known digest are considered unchanged if the size is the same.
+        Errors are handled the same way with and without threads: a file that fails is added to 'failed'.
+        Missing or changed files are uploaded concurrently with up to <workers> threads, if the streaming
+        AttachmentTransport is enabled (each transfer uses its own HTTP request). Otherwise attachments are
+        transferred one at a time, since the XML-RPC server proxy cannot be used by several threads at once.
+        If download is True, attachments that do not exist locally are downloaded to the experiment folder.
+        If dryrun is True, nothing is transferred, but the returned dict shows what would be done.
+        Returns a dict with lists of filepaths (or attachment filenames) for keys
+            'uploaded', 'downloaded', 'unchanged', 'failed'.
+        """
+        result = dict(uploaded=[], downloaded=[], unchanged=[], failed=[])
+        digesttype = filehashing.resolveDigesttype(digesttype)   # digests are keyed by the actual type.
+        localfiles = {}
+        for _, filepath, _ in self.getLocalFilelist(pattern, fn_is_regex, subentries_only=subentries_only):
+            filename = os.path.basename(filepath)
+            if filename in localfiles:
+                # Attachments on a page are identified by filename; only the first local file is synced.
+                logger.warning("syncAttachments: Skipping %s, a file named %s was already found in %s",
+                               filepath, filename, localfiles[filename])
+                continue
+            localfiles[filename] = filepath
+        attachments = {filename: struct for filename, _, struct in self.getAttachmentList(pattern, fn_is_regex)}
+        digest_prog = re.compile(r"%s-hexdigest:\s*([0-9a-fA-F]+)" % digesttype)
+        uploads = []
+        for filename, filepath in localfiles.items():
+            struct = attachments.get(filename)
+            if struct is None:
+                uploads.append(filepath)
+                continue
+            if str(struct.get('fileSize')) != str(os.path.getsize(filepath)):
+                uploads.append(filepath)
+                continue
+            match = digest_prog.search(struct.get('comment') or '')
+            remotedigest = match.group(1) if match else self.getRemoteDigest(struct, digesttype)
+            if remotedigest:
+                localdigest = self.getCachedDigest(filepath, digesttype) or self.hashFile(filepath, (digesttype, ))[digesttype]
+                if localdigest.lower() != remotedigest.lower():
+                    uploads.append(filepath)
+                    continue
+            result['unchanged'].append(filepath)
+        downloads = [filename for filename in attachments if filename not in localfiles] if download else []
+        logger.info("syncAttachments: %s files to upload, %s to download, %s unchanged.",
+                    len(uploads), len(downloads), len(result['unchanged']))
+        if dryrun:
+            result['uploaded'], result['downloaded'] = uploads, downloads
+            return result
+
+        if workers > 1 and self.AttachmentTransport is None:
+            logger.debug("syncAttachments: No streaming attachment transport, transferring one file at a time.")
+            workers = 1
+        uploadeddigests = {}
+        def upload(filepath):
+            """ Upload a single file, with its digest in the attachment comment (if supported). """
+            digest = self.getCachedDigest(filepath, digesttype) or self.hashFile(filepath, (digesttype, ))[digesttype]
+            att_info = {'comment': "%s-hexdigest: %s" % (digesttype, digest)}
+            existing = attachments.get(os.path.basename(filepath))
+            if existing is not None:
+                att_info['id'] = existing['id']
+            ret = self.uploadAttachment(filepath, att_info=att_info, digesttype=digesttype)
+            if ret:
+                uploadeddigests[os.path.basename(filepath)] = digest
+            return ret
+        def download_(filename):
+            """ Download a single attachment. """
+            return self.downloadAttachment(filename)
+        for key, fun, items in (('uploaded', upload, uploads), ('downloaded', download_, downloads)):
+            if ThreadPoolExecutor is not None and workers > 1 and len(items) > 1:
+                with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+                    futures = [executor.submit(fun, item) for item in items]
+                    outcomes = [(item, future.exception() or future.result()) for item, future in zip(items, futures)]
+            else:
+                outcomes = []
+                for item in items:
+                    try:
+                        outcomes.append((item, fun(item)))
+                    except Exception as e:     # pylint: disable=W0703
+                        # Same as the threaded branch, where future.exception() is any exception.
+                        outcomes.append((item, e))
+            for item, outcome in outcomes:
+                if outcome is None or outcome is False or isinstance(outcome, Exception):
+                    logger.warning("syncAttachments: %s failed for %s: %s", key, item, outcome)
+                    result['failed'].append(item)
+                else:
+                    result[key].append(item)
+        if result['uploaded'] or result['downloaded']:
+            # Record the uploaded digests for the new attachment versions (ids and versions are taken from
+            # the updated list, so they match the structs compared above in the next sync):
+            for struct in self.Experiment.getUpdatedAttachmentsList() or []:
+                if struct.get('fileName') in uploadeddigests:
+                    self.addRemoteDigest(struct, digesttype, uploadeddigests[struct['fileName']])
+        self.saveFileshistory()
+        return result
+
+
     def getAttachmentList(self, fn_pattern=None, fn_is_regex=False, **filterdict):
         """
         The wiki-attachments equivalent to getLocalFileslist(),
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+SQLite store for an experiment's files history (Filemanager.Fileshistory).
+
+The files history used to be a single yaml file, .labfluence/files_history.yml, with
+    relpath -> list of {datetime: <datetime>, <digesttype>: <digest>, ...} entries,
+which was parsed in full on load and rewritten in full on every save.
+With tens of thousands of digest entries, both are slow.
+
+The FileshistoryStore keeps the history in .labfluence/files_history.sqlite, as rows of
+    (relpath, datetime, digesttype, digest, entryid)
+where the rows of one digest entry share an entryid (entries can have the same datetime, or none), and
+with indexes on relpath and digest, so appending an entry is a single insert, and looking up
+the history of a file, or the files with a given digest (e.g. to detect moved/renamed files),
+does not require loading the whole history.
+
+The store is also a read-only Mapping of relpath -> list of digest entries (as in the yaml file),
+so existing code that reads the files history works unchanged; use append() to add entries.
+Appended entries are committed by commit() (Filemanager.saveFileshistory).
+
+On first load, an existing files_history.yml is imported into the store. The yaml file is
+left in place, but is not read again.
+
+"""
+from __future__ import print_function
+import os
+import json
+import sqlite3
+import threading
+import yaml
+from datetime import datetime
+import logging
+logger = logging.getLogger(__name__)
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping  # python 2
+try:
+    string_types = (basestring, )   # pylint: disable=E0602
+except NameError:
+    string_types = (str, )
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (relpath TEXT NOT NULL, datetime TEXT, digesttype TEXT NOT NULL,
+                                    digest TEXT, isjson INTEGER DEFAULT 0, entryid INTEGER);
+CREATE INDEX IF NOT EXISTS digests_relpath ON digests (relpath);
+CREATE INDEX IF NOT EXISTS digests_digest ON digests (digest);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# Stores made before entries had an entryid get the column (their rows are grouped by datetime, as before):
+MIGRATIONS = (
+    ('entryid', "ALTER TABLE digests ADD COLUMN entryid INTEGER"),
+)
+POST_MIGRATION_SCHEMA = """
+CREATE INDEX IF NOT EXISTS digests_entryid ON digests (entryid);
+"""
+
+
+def _formatDatetime(dt):
+    """ datetime -> string (isoformat, which sorts chronologically). """
+    return dt.isoformat() if isinstance(dt, datetime) else dt
+
+def _parseDatetime(dtstr):
+    """ isoformat string -> datetime (python 2 has no datetime.fromisoformat). """
+    if not dtstr:
+        return None
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(dtstr, fmt)
+        except ValueError:
+            pass
+    return dtstr
+
+
+class FileshistoryStore(Mapping):
+    """
+    SQLite files history store, see module docstring.
+
+    Args:
+        :dbpath:    Path of the sqlite database file.
+    """
+
+    def __init__(self, dbpath):
+        self.Dbpath = dbpath
+        # The connection is shared by threads (e.g. Filemanager.syncAttachments), guarded by self._lock:
+        self._conn = sqlite3.connect(dbpath, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(digests)")]
+            for column, statement in MIGRATIONS:
+                if column not in columns:
+                    self._conn.execute(statement)
+            self._conn.executescript(POST_MIGRATION_SCHEMA)
+            self._conn.commit()
+
+    def __repr__(self):
+        return "FileshistoryStore('%s')" % self.Dbpath
+
+    ## Mapping interface: relpath -> list of digest entries
+
+    def __getitem__(self, relpath):
+        entries = self.getEntries(relpath)
+        if not entries:
+            raise KeyError(relpath)
+        return entries
+
+    def __iter__(self):
+        with self._lock:
+            relpaths = [row[0] for row in self._conn.execute("SELECT DISTINCT relpath FROM digests")]
+        return iter(relpaths)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(DISTINCT relpath) FROM digests").fetchone()[0]
+
+    def __contains__(self, relpath):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM digests WHERE relpath = ? LIMIT 1", (relpath, )).fetchone() is not None
+
+    ## Store methods
+
+    def append(self, relpath, digestentry):
+        """
+        Appends a digest entry ({datetime: <datetime>, <digesttype>: <digest>, ...}) for relpath.
+        Each digest type is a row; non-string values (e.g. tree hash chunk lists) are stored as json.
+        The rows get a new entryid, which getEntries uses to put the entry back together.
+        """
+        dtstr = _formatDatetime(digestentry.get('datetime'))
+        with self._lock:
+            entryid = self._conn.execute("SELECT COALESCE(MAX(entryid), 0) + 1 FROM digests").fetchone()[0]
+            rows = [(relpath, dtstr, digesttype,
+                     digest if isinstance(digest, string_types) else json.dumps(digest),
+                     0 if isinstance(digest, string_types) else 1, entryid)
+                    for digesttype, digest in digestentry.items() if digesttype != 'datetime']
+            if not rows:
+                # An entry with only a datetime still counts as an entry:
+                rows = [(relpath, dtstr, 'datetime', None, 0, entryid)]
+            self._conn.executemany("INSERT INTO digests (relpath, datetime, digesttype, digest, isjson, entryid) "
+                                   "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def getEntries(self, relpath):
+        """ Returns the digest entries for relpath (oldest first), like the lists in the yaml files history. """
+        with self._lock:
+            rows = self._conn.execute("SELECT datetime, digesttype, digest, isjson, entryid FROM digests "
+                                      "WHERE relpath = ? ORDER BY rowid", (relpath, )).fetchall()
+        entries = []
+        for dtstr, digesttype, digest, isjson, entryid in rows:
+            # Rows appended together (same entryid) make up one entry; rows from before entryids were
+            # added are grouped by datetime:
+            key = entryid if entryid is not None else ('datetime', dtstr)
+            if not entries or entries[-1][0] != key:
+                entries.append((key, {'datetime': _parseDatetime(dtstr)}))
+            if digesttype != 'datetime':
+                entries[-1][1][digesttype] = json.loads(digest) if isjson else digest
+        return [entry for _, entry in entries]
+
+    def findByDigest(self, digest, digesttype=None):
+        """ Returns a list of the relpaths that have had the given digest (optionally only for digesttype). """
+        with self._lock:
+            if digesttype is None:
+                rows = self._conn.execute("SELECT DISTINCT relpath FROM digests WHERE digest = ?", (digest, ))
+            else:
+                rows = self._conn.execute("SELECT DISTINCT relpath FROM digests WHERE digest = ? AND digesttype = ?",
+                                          (digest, digesttype))
+            return [row[0] for row in rows]
+
+    def commit(self):
+        """ Commits appended entries to disk. """
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        """ Commits and closes the database. """
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def importYaml(self, ymlpath):
+        """
+        Imports a yaml files history (relpath -> list of digest entries) into the store, once.
+        Returns the number of imported entries (0 if the file does not exist or was already imported).
+        """
+        with self._lock:
+            if self._conn.execute("SELECT value FROM meta WHERE key = 'imported_yaml'").fetchone():
+                return 0
+        if not os.path.isfile(ymlpath):
+            return 0
+        try:
+            with open(ymlpath) as fd:
+                history = yaml.safe_load(fd) or {}
+        except yaml.YAMLError:
+            # Older files history files may have python-specific tags.
+            with open(ymlpath) as fd:
+                history = yaml.load(fd, Loader=getattr(yaml, 'UnsafeLoader', yaml.Loader)) or {}
+        count = 0
+        with self._lock:
+            for relpath, digestentries in history.items():
+                for digestentry in digestentries or []:
+                    self.append(relpath, digestentry)
+                    count += 1
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_yaml', ?)", (ymlpath, ))
+            self._conn.commit()
+        logger.info("Imported %s files history entries from %s", count, ymlpath)
+        return count
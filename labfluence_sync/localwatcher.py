@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Module for keeping an ExperimentManager up to date with the local experiment tree
+in long-running processes (e.g. the GUI), without re-scanning the whole tree.
+
+The LocalExperimentsWatcher watches the folders that ExperimentManager.mergeLocalExperiments handles:
+    local_exp_subDir            experiment folders added/removed/renamed (-> ExperimentsById merged),
+    experiment folders          subentry folders added/removed/renamed (-> exp.Subentries re-parsed)
+and .labfluence.yml files in these folders (-> HierarchicalConfigHandler config reloaded).
+Other folders below local_exp_rootDir (e.g. the year folders of previous years) are not merged,
+so they are not watched either.
+
+On Linux, changes are picked up with inotify (requires the inotify_simple package).
+If inotify is not available, if the inotify event queue overflows, or if the watch limit is reached,
+the watcher falls back to a periodic incremental rescan with ExperimentManager.mergeLocalExperiments,
+which only does work for directories whose mtime has changed.
+
+Usage, either call poll() regularly from the main thread (e.g. using Tk's after()), which is safest
+if 'ExperimentsById' or 'Subentries' callbacks update widgets:
+    watcher = LocalExperimentsWatcher(experimentmanager)
+    watcher.poll()
+or run the watcher in a background thread:
+    watcher.start()
+    ...
+    watcher.stop()
+In the background thread, changes are applied with the ExperimentManager's Lock held
+(mergeLocalExperiments takes the same lock), but callbacks are invoked on the watcher thread.
+
+"""
+from __future__ import print_function
+import os
+import time
+import threading
+import logging
+logger = logging.getLogger(__name__)
+try:
+    import inotify_simple
+    from inotify_simple import flags
+except ImportError:
+    inotify_simple = None     # Not linux, or inotify_simple not installed; use periodic rescan only.
+
+from experiment import ExperimentProxy
+
+
+class LocalExperimentsWatcher(object):
+    """
+    Watches the local experiment tree and updates the ExperimentManager, see module docstring.
+
+    Args:
+        :experimentmanager:     The ExperimentManager to keep updated.
+        :rescaninterval:        Seconds between periodic (incremental) rescans. With inotify, the rescan is
+                                just a safety net, so this can be long.
+        :useinotify:            Set to False to only use periodic rescans.
+    """
+
+    def __init__(self, experimentmanager, rescaninterval=300, useinotify=True):
+        self.Experimentmanager = experimentmanager
+        self.Confighandler = experimentmanager.Confighandler
+        self.RescanInterval = rescaninterval
+        self.ConfigFn = '.labfluence.yml'
+        self.LastRescan = time.time()
+        self._inotify = None
+        self._watches = {}      # wd -> (level, path), level is 'expsdir' or 'experiment'.
+        self._wdsbypath = {}    # path -> wd
+        self._thread = None
+        self._stop = threading.Event()
+        if useinotify and inotify_simple is not None:
+            try:
+                self._inotify = inotify_simple.INotify()
+            except OSError as e:
+                logger.warning("Could not initialize inotify, using periodic rescan only: %s", e)
+        if self._inotify is not None:
+            self._dirmask = flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO | flags.CLOSE_WRITE | flags.DELETE_SELF
+            self.addWatches()
+        else:
+            logger.info("inotify is not available, local experiment tree will be rescanned every %s s.", rescaninterval)
+
+    def __repr__(self):
+        return "LocalExperimentsWatcher(%s watches, inotify=%s)" % (len(self._watches), self._inotify is not None)
+
+    @property
+    def UsingInotify(self):
+        """ True if changes are picked up using inotify (rather than only by periodic rescans). """
+        return self._inotify is not None
+
+
+    ## Watches:
+
+    def _addWatch(self, level, path):
+        """ Adds an inotify watch for directory path. Returns False if the watch could not be added. """
+        if path in self._wdsbypath:
+            return True
+        try:
+            wd = self._inotify.add_watch(path, self._dirmask)
+        except OSError as e:
+            # ENOSPC: fs.inotify.max_user_watches reached. The periodic rescan will still pick up changes.
+            logger.warning("Could not watch %s (%s), relying on periodic rescan.", path, e)
+            return False
+        self._watches[wd] = (level, path)
+        self._wdsbypath[path] = wd
+        return True
+
+    def _removeWatch(self, path):
+        """ Removes the watch for path (and for any directories below path). """
+        for watchedpath in [watchedpath for watchedpath in self._wdsbypath
+                            if watchedpath == path or watchedpath.startswith(path + os.sep)]:
+            wd = self._wdsbypath.pop(watchedpath)
+            self._watches.pop(wd, None)
+            try:
+                self._inotify.rm_watch(wd)
+            except OSError:
+                pass    # The watch is removed automatically when the directory is deleted.
+
+    def addWatches(self):
+        """ Adds watches for the experiment directory (local_exp_subDir) and the local experiment folders. """
+        expsdir = self.Experimentmanager.getLocalExpSubDir()
+        if not expsdir or not os.path.isdir(expsdir):
+            logger.warning("Local experiment directory '%s' not found, cannot add watches.", expsdir)
+            return
+        self._addWatch('expsdir', expsdir)
+        self._addExperimentWatches()
+        logger.info("Watching %s local experiment tree folders.", len(self._watches))
+
+    def _addExperimentWatches(self):
+        """ Adds watches for local experiment folders that are not watched yet. """
+        with self.Experimentmanager.Lock:
+            paths = [exp.Localdirpath for exp in self.Experimentmanager.ExperimentsById.values()]
+        for path in paths:
+            if path and path not in self._wdsbypath and os.path.isdir(path):
+                self._addWatch('experiment', path)
+
+
+    ## Event processing:
+
+    def poll(self, timeout=0):
+        """
+        Processes pending changes and returns the number of inotify events processed.
+        Waits up to <timeout> seconds for events. Also does the periodic rescan, if due.
+        """
+        nevents = 0
+        if self._inotify is not None:
+            events = self._inotify.read(timeout=int(timeout*1000))
+            nevents = len(events)
+            if events:
+                self.processEvents(events)
+        elif timeout:
+            self._stop.wait(timeout)
+        if time.time() - self.LastRescan > self.RescanInterval:
+            self.rescan()
+        return nevents
+
+    def processEvents(self, events):
+        """
+        Handles a batch of inotify events.
+        Events are combined, so each experiment is only refreshed once per batch, and
+        ExperimentsById is only merged once per batch. The ExperimentManager's Lock is held
+        while experiments and configs are updated.
+        """
+        mergeneeded = False
+        changedexps = set()
+        changedconfigs = set()
+        for event in events:
+            if event.mask & flags.Q_OVERFLOW:
+                logger.warning("inotify event queue overflow, doing a full rescan.")
+                self.rescan()
+                return
+            level, dirpath = self._watches.get(event.wd, (None, None))
+            if level is None:
+                continue
+            path = os.path.join(dirpath, event.name) if event.name else dirpath
+            isdir = bool(event.mask & flags.ISDIR)
+            if event.name == self.ConfigFn:
+                changedconfigs.add(dirpath)
+            elif event.mask & flags.DELETE_SELF:
+                self._removeWatch(dirpath)
+            elif level == 'expsdir' and isdir:
+                if event.mask & (flags.DELETE | flags.MOVED_FROM):
+                    self._removeWatch(path)
+                mergeneeded = True
+            elif level == 'experiment' and isdir:
+                changedexps.add(dirpath)
+        if mergeneeded:
+            self.mergeExperiments()
+        with self.Experimentmanager.Lock:
+            for path in changedconfigs:
+                self.reloadConfig(path)
+            for path in changedexps:
+                self.refreshExperiment(path)
+
+    def mergeExperiments(self):
+        """ Merges added/removed/renamed experiment folders and adds watches for new experiment folders. """
+        self.Experimentmanager.mergeLocalExperiments()
+        if self._inotify is not None:
+            self._addExperimentWatches()
+
+    def refreshExperiment(self, path):
+        """
+        Updates the experiment with local folder path after subentry folders were changed.
+        Loaded experiments re-parse their subentries; for experiment proxies, the cached catalog entry
+        is dropped (the subentries are parsed when the experiment is loaded).
+        Called with the ExperimentManager's Lock held (see processEvents).
+        """
+        exp = next((exp for exp in self.Experimentmanager.ExperimentsById.values() if exp.Localdirpath == path), None)
+        if exp is None:
+            return
+        if isinstance(exp, ExperimentProxy) and not exp.isLoaded:
+            exp.invalidateCache()
+        else:
+            logger.debug("Subentry folders changed in %s, re-parsing subentries.", path)
+            exp.parseLocaldirSubentries()
+
+    def reloadConfig(self, dirpath):
+        """ Reloads the .labfluence.yml config in dirpath into the HierarchicalConfigHandler (file overrides memory). """
+        hch = getattr(self.Confighandler, 'HierarchicalConfigHandler', None)
+        if hch is None or not os.path.isfile(os.path.join(dirpath, self.ConfigFn)):
+            return
+        logger.debug("Config file changed in %s, reloading.", dirpath)
+        try:
+            self.Confighandler.loadExpConfig(dirpath, doloadparent='never', update='memory')
+        except (IOError, OSError, ValueError) as e:
+            logger.warning("Could not reload config in %s: %s", dirpath, e)
+
+    def rescan(self):
+        """ Periodic fallback: incremental merge (only does work for changed directories). """
+        self.LastRescan = time.time()
+        self.mergeExperiments()
+
+
+    ## Background thread:
+
+    def start(self, interval=1.0):
+        """ Starts processing changes in a background thread, waiting up to <interval> seconds for events. """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        def run():
+            """ Poll until stopped. """
+            while not self._stop.is_set():
+                try:
+                    self.poll(timeout=interval)
+                except Exception as e:     # pylint: disable=W0703
+                    logger.error("Error while processing local experiment tree changes: %s", e)
+                    self._stop.wait(interval)
+        self._thread = threading.Thread(target=run, name='LocalExperimentsWatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the background thread (if started) and closes the inotify instance. """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Module for keeping track of memory usage during a sync.
+
+Scanning large satellite locations produces large maps, e.g.
+    foldersbyexpidsubidx[expid][subentry_idx] = folderpath
+and on small machines (e.g. a 4 GB sync VM) this can run out of memory.
+
+This module provides:
+    MemoryReporter  Takes a tracemalloc snapshot at the end of each sync phase and reports
+                    the top allocation sites for each phase (--memory-report).
+                    Has the same phase() interface as profiling.PhaseProfiler.
+    MemoryBudget    Keeps track of the process' resident memory (RSS) relative to a budget (--memory-budget).
+    SpillDict       A dict-like mapping that moves its content to a shelve file on disk
+                    when the memory budget is close to being exceeded.
+
+"""
+from __future__ import print_function
+import os
+import sys
+import shutil
+import shelve
+import tempfile
+from contextlib import contextmanager
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping  # python 2
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None      # python 2
+import logging
+logger = logging.getLogger(__name__)
+
+
+def getRSS():
+    """
+    Returns the current resident set size of this process in bytes.
+    Uses psutil if available, otherwise /proc/self/statm (linux),
+    otherwise falls back to the *peak* RSS from the resource module.
+    """
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on linux, but in bytes on OS X:
+    return maxrss if sys.platform == 'darwin' else maxrss*1024
+
+
+class MemoryBudget(object):
+    """
+    Memory budget for a sync run.
+
+    Args:
+        :maxbytes:  The budget, i.e. the max resident memory for the process, in bytes.
+        :threshold: Fraction of the budget at which data structures should start spilling to disk.
+        :checkevery: Only check the RSS every <checkevery> calls to nearLimit (reading RSS is not free).
+    """
+
+    def __init__(self, maxbytes, threshold=0.8, checkevery=1000):
+        self.MaxBytes = maxbytes
+        self.Threshold = threshold
+        self.CheckEvery = checkevery
+        self.PeakRSS = 0
+        self._calls = 0
+        self._near = False
+
+    def __repr__(self):
+        return "MemoryBudget(maxbytes=%s, threshold=%s, peak=%s)" % (self.MaxBytes, self.Threshold, self.PeakRSS)
+
+    def check(self):
+        """ Reads the current RSS and returns True if it is above the threshold. """
+        rss = getRSS()
+        self.PeakRSS = max(self.PeakRSS, rss)
+        self._near = rss > self.MaxBytes*self.Threshold
+        if self._near:
+            logger.info("Memory usage %s bytes is above %.0f%% of memory budget %s bytes", rss, self.Threshold*100, self.MaxBytes)
+        return self._near
+
+    def nearLimit(self):
+        """ Returns True if memory usage is near the budget; only re-reads RSS every CheckEvery calls. """
+        self._calls += 1
+        if self._calls % self.CheckEvery == 1 or self.CheckEvery <= 1:
+            return self.check()
+        return self._near
+
+
+class SpillDict(MutableMapping):
+    """
+    Dict-like mapping that keeps its items in memory until the memory budget is nearly exceeded,
+    after which all items are moved to a shelve file in a temporary directory, and new items are
+    written directly to disk. Keys are always kept in memory (they are usually short expids),
+    so key lookups, iteration and len() do not touch the disk.
+
+    Note: As for shelve, values are copied when read from disk, so mutate-in-place does not work:
+    Instead of d.setdefault(expid, {})[subidx] = path, do
+        entry = d.get(expid, {}); entry[subidx] = path; d[expid] = entry
+
+    Args:
+        :budget:    A MemoryBudget. If None, this is just a dict.
+        :name:      Name used for the spill file (for debugging).
+    """
+
+    def __init__(self, budget=None, name='spill'):
+        self.Budget = budget
+        self.Name = name
+        self._mem = {}
+        self._keys = {}         # key -> shelf key (str), for spilled items.
+        self._shelf = None
+        self._tmpdir = None
+
+    def __repr__(self):
+        return "SpillDict('%s', %s items, spilled=%s)" % (self.Name, len(self), self.Spilled)
+
+    @property
+    def Spilled(self):
+        """ True if the items have been moved to disk. """
+        return self._shelf is not None
+
+    def spill(self):
+        """ Move all in-memory items to disk. """
+        if self._shelf is None:
+            self._tmpdir = tempfile.mkdtemp(prefix='labfluence-%s-' % self.Name)
+            self._shelf = shelve.open(os.path.join(self._tmpdir, self.Name), protocol=2)
+            logger.info("Spilling %s items of '%s' to disk (%s)", len(self._mem), self.Name, self._tmpdir)
+        for key, value in self._mem.items():
+            self._keys[key] = skey = repr(key)
+            self._shelf[skey] = value
+        self._mem.clear()
+
+    def __setitem__(self, key, value):
+        if self._shelf is None and self.Budget is not None and self.Budget.nearLimit():
+            self.spill()
+        if self._shelf is not None:
+            self._keys[key] = skey = repr(key)
+            self._shelf[skey] = value
+        else:
+            self._mem[key] = value
+
+    def __getitem__(self, key):
+        if key in self._mem:
+            return self._mem[key]
+        return self._shelf[self._keys[key]] if key in self._keys else self._mem[key]
+
+    def __delitem__(self, key):
+        if key in self._mem:
+            del self._mem[key]
+        else:
+            del self._shelf[self._keys.pop(key)]
+
+    def __contains__(self, key):
+        return key in self._mem or key in self._keys
+
+    def __iter__(self):
+        for key in list(self._mem):
+            yield key
+        for key in list(self._keys):
+            yield key
+
+    def __len__(self):
+        return len(self._mem) + len(self._keys)
+
+    def close(self):
+        """ Removes the spill file (if any). The mapping is empty after this. """
+        if self._shelf is not None:
+            self._shelf.close()
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._shelf = self._tmpdir = None
+        self._keys.clear()
+        self._mem.clear()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:   # pylint: disable=W0703
+            pass
+
+
+class MemoryReporter(object):
+    """
+    Takes a tracemalloc snapshot at the end of each sync phase, and reports the top
+    allocation sites (source lines) for each phase, compared to the previous snapshot.
+    Implements the same phase() interface as profiling.PhaseProfiler, so it can be used
+    with SyncManager's profiler. A phase that is entered again while it is already open
+    (e.g. a nested 'copy' phase) does not take a snapshot of its own; it is included
+    in the outermost phase with that name.
+
+    Args:
+        :topn:      Number of allocation sites to report per phase.
+        :nframes:   Number of frames to store per allocation (more frames = more overhead).
+    """
+
+    def __init__(self, topn=10, nframes=1):
+        if tracemalloc is None:
+            raise RuntimeError("tracemalloc is not available (requires python 3.4+), cannot make memory report.")
+        self.TopN = topn
+        self.Phasestats = []    # list of (phasename, current, peak, top-stats) tuples.
+        self._open = {}         # phasename -> number of open phase() contexts with that name.
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(nframes)
+        self._snapshot = tracemalloc.take_snapshot()
+
+    @contextmanager
+    def phase(self, name):
+        """ Takes a snapshot when the phase exits and records the difference from the previous snapshot. """
+        self._open[name] = self._open.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            self._open[name] -= 1
+            if not self._open[name]:
+                del self._open[name]
+                self.snapshot(name)
+
+    def snapshot(self, name):
+        """ Take a snapshot and record the top allocation sites since the last snapshot as phase <name>. """
+        snapshot = tracemalloc.take_snapshot()
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                           tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+        stats = snapshot.compare_to(self._snapshot, 'lineno')[:self.TopN]
+        current, peak = tracemalloc.get_traced_memory()
+        self.Phasestats.append((name, current, peak, stats))
+        self._snapshot = snapshot
+
+    def report(self):
+        """ Returns the memory report as a string. """
+        out = ["Memory report (tracemalloc), RSS at end: %.1f MB\n" % (getRSS()/1024.0**2)]
+        for name, current, peak, stats in self.Phasestats:
+            out.append("\n%s\nAfter phase '%s': %.1f MB traced, %.1f MB peak\n%s\n" %
+                       ("="*80, name, current/1024.0**2, peak/1024.0**2, "="*80))
+            out.extend("  %s\n" % stat for stat in stats)
+        return "".join(out)
+
+    def finish(self):
+        """ Prints the report. """
+        print(self.report())
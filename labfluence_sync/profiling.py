@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Module for profiling the separate phases of a sync (labsync --profile DIR).
+
+A sync consists of a number of phases:
+    config-load, local-parse, remote-scan:<remote>, planning, copy
+and "why is the sync slow" usually means "which of these phases is slow, and why".
+The PhaseProfiler profiles each phase separately. Usage:
+
+    profiler = PhaseProfiler('/tmp/syncprofile', mode='cprofile')
+    with profiler.phase('local-parse'):
+        exps = em.findLocalExpsPathGdTupByExpid()
+    ...
+    profiler.finish()   # Writes <phase>.pstats files and summary.txt to the output directory.
+
+Phases that are entered several times (e.g. 'copy' for each remote) are accumulated.
+If a phase is entered while another phase is active, the outer phase is paused until the inner phase exits.
+(The outer phase's wall time does include the time spent in the inner phase.)
+
+Modes:
+    cprofile    Deterministic profiling with cProfile. Writes a .pstats file per phase
+                (can be inspected with e.g. snakeviz or python -m pstats) and a top-N summary.
+                Has a noticeable overhead for code with many small function calls.
+    sample      Statistical profiling: A background thread samples the main thread's stack
+                every <interval> seconds. Overhead is low and independent of the code being profiled,
+                so this can be used for production runs. Writes a top-N summary and a <phase>.collapsed
+                file per phase with stacks in "collapsed" format (for flamegraph.pl or speedscope).
+
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+import logging
+logger = logging.getLogger(__name__)
+
+
+class NullProfiler(object):
+    """ Profiler that does nothing; used when profiling is not enabled. """
+
+    @contextmanager
+    def phase(self, name):  # pylint: disable=W0613
+        """ Does nothing. """
+        yield
+
+    def finish(self):
+        """ Does nothing. """
+        pass
+
+
+class ProfilerGroup(object):
+    """
+    Combines several profilers (e.g. a PhaseProfiler and a memorymonitor.MemoryReporter),
+    so they can be used where a single profiler is expected.
+    """
+
+    def __init__(self, *profilers):
+        self.Profilers = profilers
+
+    @contextmanager
+    def phase(self, name, _profilers=None):
+        """ Enters phase <name> for all profilers (nested in the given order). """
+        profilers = self.Profilers if _profilers is None else _profilers
+        if not profilers:
+            yield
+            return
+        with profilers[0].phase(name):
+            with self.phase(name, _profilers=profilers[1:]):
+                yield
+
+    def finish(self):
+        """ Finishes all profilers. """
+        return [profiler.finish() for profiler in self.Profilers]
+
+
+class PhaseProfiler(object):
+    """
+    Profiles each phase of a sync separately, see module docstring.
+
+    Args:
+        :outdir:    Directory to write profile output to (created if it does not exist).
+        :mode:      'cprofile' or 'sample'.
+        :topn:      Number of functions to include for each phase in summary.txt.
+        :interval:  Sampling interval in seconds (only for mode='sample').
+    """
+
+    def __init__(self, outdir, mode='cprofile', topn=25, interval=0.005):
+        if mode not in ('cprofile', 'sample'):
+            raise ValueError("Profiling mode '%s' not recognized, use 'cprofile' or 'sample'." % mode)
+        self.Outdir = os.path.expanduser(outdir)
+        self.Mode = mode
+        self.TopN = topn
+        self.Interval = interval
+        self.Phasetimes = {}        # Wall time per phase, in seconds.
+        self._phasestack = []
+        self._profiles = {}         # cprofile mode: cProfile.Profile per phase.
+        self._samples = {}          # sample mode: Counter of stack tuples per phase.
+        self._sampler = None
+        self._stopsampling = threading.Event()
+        self._mainthreadid = None
+
+    def __repr__(self):
+        return "PhaseProfiler('%s', mode='%s')" % (self.Outdir, self.Mode)
+
+    @property
+    def CurrentPhase(self):
+        """ The currently active phase (or None). """
+        return self._phasestack[-1] if self._phasestack else None
+
+    def _pause(self, name):
+        if self.Mode == 'cprofile':
+            self._profiles[name].disable()
+
+    def _resume(self, name):
+        if self.Mode == 'cprofile':
+            if name not in self._profiles:
+                import cProfile
+                self._profiles[name] = cProfile.Profile()
+            self._profiles[name].enable()
+        elif self._sampler is None:
+            self._startSampler()
+
+    @contextmanager
+    def phase(self, name):
+        """ Context manager; profiles the code inside the with block as phase <name>. """
+        outer = self.CurrentPhase
+        if outer is not None:
+            self._pause(outer)
+        self._phasestack.append(name)
+        starttime = time.time()
+        self._resume(name)
+        try:
+            yield
+        finally:
+            self._pause(name)
+            self._phasestack.pop()
+            self.Phasetimes[name] = self.Phasetimes.get(name, 0.0) + time.time() - starttime
+            if outer is not None:
+                self._resume(outer)
+
+
+    ## Sampling:
+
+    def _startSampler(self):
+        """ Starts the background sampling thread, sampling the thread that calls this method. """
+        self._mainthreadid = threading.current_thread().ident
+        self._sampler = threading.Thread(target=self._sampleLoop, name='PhaseProfiler-sampler')
+        self._sampler.daemon = True
+        self._sampler.start()
+
+    def _sampleLoop(self):
+        """ Sample the main thread's stack every self.Interval seconds until stopped. """
+        while not self._stopsampling.wait(self.Interval):
+            phase = self.CurrentPhase
+            if phase is None:
+                continue
+            frame = sys._current_frames().get(self._mainthreadid)   # pylint: disable=W0212
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self._samples.setdefault(phase, Counter())[tuple(reversed(stack))] += 1
+
+
+    ## Output:
+
+    def finish(self):
+        """ Stops profiling and writes profile data and summary.txt to self.Outdir. """
+        if self._sampler is not None:
+            self._stopsampling.set()
+            self._sampler.join()
+            self._sampler = None
+        if not os.path.isdir(self.Outdir):
+            os.makedirs(self.Outdir)
+        if self.Mode == 'cprofile':
+            summary = self.writeProfiles()
+        else:
+            summary = self.writeSamples()
+        summaryfile = os.path.join(self.Outdir, 'summary.txt')
+        with open(summaryfile, 'w') as fd:
+            fd.write(summary)
+        logger.info("Profile data written to %s", self.Outdir)
+        return summaryfile
+
+    def _phaseHeader(self, name):
+        return "\n%s\nPhase '%s': %.3f s wall time\n%s\n" % ("="*80, name, self.Phasetimes.get(name, 0), "="*80)
+
+    def _filename(self, name, ext):
+        """ Phase names can contain e.g. remote names; make them safe for use as filenames. """
+        return os.path.join(self.Outdir, "".join(c if c.isalnum() or c in '-_.' else '_' for c in name) + ext)
+
+    def writeProfiles(self):
+        """ Writes a .pstats file per phase and returns the top-N summary as a string. """
+        import pstats
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+        out = ["Sync profile (cprofile), phase wall times:\n"]
+        out += ["  %-30s %8.3f s\n" % (name, t) for name, t in sorted(self.Phasetimes.items(), key=lambda x: -x[1])]
+        for name, profile in sorted(self._profiles.items()):
+            profile.dump_stats(self._filename(name, '.pstats'))
+            stream = StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(self.TopN)
+            out.append(self._phaseHeader(name))
+            out.append(stream.getvalue())
+        return "".join(out)
+
+    def writeSamples(self):
+        """ Writes a .collapsed stack file per phase and returns the top-N summary as a string. """
+        out = ["Sync profile (sampling every %s s), phase wall times:\n" % self.Interval]
+        out += ["  %-30s %8.3f s\n" % (name, t) for name, t in sorted(self.Phasetimes.items(), key=lambda x: -x[1])]
+        for name, stacks in sorted(self._samples.items()):
+            nsamples = sum(stacks.values())
+            with open(self._filename(name, '.collapsed'), 'w') as fd:
+                for stack, count in stacks.most_common():
+                    fd.write("%s %s\n" % (";".join("%s (%s:%s)" % (func, os.path.basename(fn), line)
+                                                   for fn, line, func in stack), count))
+            own, cumulative = Counter(), Counter()
+            for stack, count in stacks.items():
+                own[stack[-1]] += count
+                for func in set(stack):
+                    cumulative[func] += count
+            out.append(self._phaseHeader(name))
+            out.append("%s samples\n\n  %7s %7s  function\n" % (nsamples, 'own%', 'cum%'))
+            for func, count in cumulative.most_common(self.TopN):
+                out.append("  %6.1f%% %6.1f%%  %s (%s:%s)\n" % (100.0*own[func]/nsamples, 100.0*count/nsamples,
+                                                           func[2], func[0], func[1]))
+        return "".join(out)
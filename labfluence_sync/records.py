@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Compact record types for bulk experiment and subentry results.
+
+Parsing a directory tree or the wiki experiment pages gives one regex groupdict per folder/page.
+Keeping a full dict for each of tens of thousands of subentry folders uses a lot of memory,
+and most of the keys are the same for all of them. The records below use __slots__ instead of
+a per-instance dict, and expids and subentry indices are interned, so the many records for the
+same experiment share a single expid string.
+
+    ExpRecord       An experiment folder or wiki page: Expid, Path, Titledesc, Date, PageId
+    SubentryRecord  A subentry folder: Expid, Subidx, Path, Titledesc, Date
+
+Records are used for bulk operations (e.g. by SyncManager); use Experiment objects
+(ExperimentManager.ExperimentsById) when you need to work with a single experiment.
+
+"""
+try:
+    from sys import intern
+except ImportError:
+    pass    # python 2: intern is a builtin
+
+
+def _intern(value):
+    """ Interns value if it is a string (intern only accepts str). """
+    return intern(value) if type(value) is str else value     # pylint: disable=C0123
+
+
+def _date(groupdict):
+    """ Returns the first non-empty date group in groupdict ('date', 'date1' or 'date2'). """
+    return groupdict.get('date') or groupdict.get('date1') or groupdict.get('date2')
+
+
+class ExpRecord(object):
+    """
+    Compact record for an experiment folder (Path) or wiki page (PageId).
+    """
+    __slots__ = ('Expid', 'Path', 'Titledesc', 'Date', 'PageId')
+
+    def __init__(self, expid, path=None, titledesc=None, date=None, pageid=None):
+        self.Expid = _intern(expid)
+        self.Path = path
+        self.Titledesc = titledesc
+        self.Date = date
+        self.PageId = pageid
+
+    @classmethod
+    def fromGroupdict(cls, groupdict, path=None, pageid=None):
+        """ Make a record from a folder name or page title regex groupdict. """
+        return cls(groupdict.get('expid'), path, groupdict.get('exp_titledesc'), _date(groupdict), pageid)
+
+    @property
+    def Groupdict(self):
+        """ A groupdict for this record, like the ones returned by getLocalExpsDirGroupdictTuples. """
+        return dict(expid=self.Expid, exp_titledesc=self.Titledesc, date=self.Date)
+
+    def __getstate__(self):
+        # Slotted objects have no __dict__; this makes records picklable with all protocols (SpillDict, multiprocessing).
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+    def __setstate__(self, state):
+        for attr, value in zip(self.__slots__, state):
+            setattr(self, attr, value)
+        self.Expid = _intern(self.Expid)
+
+    def __eq__(self, other):
+        return isinstance(other, ExpRecord) and self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "ExpRecord(%r, %r)" % (self.Expid, self.Path if self.Path is not None else self.PageId)
+
+
+class SubentryRecord(object):
+    """
+    Compact record for a subentry folder.
+    """
+    __slots__ = ('Expid', 'Subidx', 'Path', 'Titledesc', 'Date')
+
+    def __init__(self, expid, subidx, path=None, titledesc=None, date=None):
+        self.Expid = _intern(expid)
+        self.Subidx = _intern(subidx)
+        self.Path = path
+        self.Titledesc = titledesc
+        self.Date = date
+
+    @classmethod
+    def fromGroupdict(cls, groupdict, path=None):
+        """ Make a record from a subentry folder name regex groupdict. Raises KeyError if expid or subentry_idx is missing. """
+        return cls(groupdict['expid'], groupdict['subentry_idx'], path,
+                   groupdict.get('subentry_titledesc'), _date(groupdict))
+
+    def __getstate__(self):
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+    def __setstate__(self, state):
+        for attr, value in zip(self.__slots__, state):
+            setattr(self, attr, value)
+        self.Expid, self.Subidx = _intern(self.Expid), _intern(self.Subidx)
+
+    def __eq__(self, other):
+        return isinstance(other, SubentryRecord) and self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "SubentryRecord(%r, %r, %r)" % (self.Expid, self.Subidx, self.Path)
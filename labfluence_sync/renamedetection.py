@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Module for detecting files that have been renamed locally (--detect-local-renames).
+
+If a user renames a file in the local experiment folder, e.g.
+    "RS123a_gel01.tif" -> "RS123a_gel01 agarose 1pct.tif"
+then the next sync sees the remote "RS123a_gel01.tif" as a new file and copies it again.
+For multi-GB files (e.g. microscopy or AFM data) this is both slow and wastes disk space.
+
+Instead, for each "new" remote file we check whether a local file with the same size
+and (approximately) the same modification time exists under another name in the experiment folder:
+ 1) A size -> files index is made for the experiment's local folder (once per experiment, on first use).
+ 2) Candidates with the same size and mtime are narrowed by a digest of the first and last 64 kB.
+ 3) The remaining candidates are confirmed by a digest of the full file content, also when only
+    one candidate remains: a file edited in the middle keeps its size, and often its mtime, and the
+    match is used to rename the remote file. (Files up to 2 x 64 kB are fully digested in step 2.)
+If a match is found, the user can rename the remote file to match the local name instead of copying it.
+
+"""
+from __future__ import print_function
+import os
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+
+from filehashing import hashFile, resolveDigesttype
+
+
+PARTIAL_DIGEST_BYTES = 64*1024
+
+
+def partialDigest(filepath, nbytes=PARTIAL_DIGEST_BYTES, digesttype='md5'):
+    """
+    Returns a hex digest of the first and last <nbytes> of the file (and the file size).
+    For files smaller than 2*nbytes this is just a digest of the whole file.
+    """
+    hasher = hashlib.new(digesttype)
+    size = os.path.getsize(filepath)
+    hasher.update(str(size).encode('ascii'))
+    with open(filepath, 'rb') as fd:
+        hasher.update(fd.read(nbytes))
+        if size > 2*nbytes:
+            fd.seek(-nbytes, os.SEEK_END)
+        hasher.update(fd.read(nbytes))
+    return hasher.hexdigest()
+
+
+def fullDigest(filepath, digesttype='md5', blocksize=4*1024*1024):
+    """ Returns a hex digest of the full file content, read in blocks of <blocksize> bytes. """
+    return hashFile(filepath, (digesttype, ), buffersize=blocksize)[resolveDigesttype(digesttype)]
+
+
+class LocalRenameIndex(object):
+    """
+    Index of the files in a local experiment folder, used to find local files
+    that match a "new" remote file by size, mtime and content.
+    The index is created on first use, so experiments without new remote files are never walked.
+
+    Args:
+        :localdirpath:      The local experiment folder.
+        :mtime_tolerance:   Allowed difference (in seconds) between remote and local modification times.
+                            Uses the same 10 seconds as the sync's "is newer" check.
+        :ignoredirs:        Folder names that are not indexed, e.g. ('.labfluence',).
+    """
+
+    def __init__(self, localdirpath, mtime_tolerance=10, ignoredirs=('.labfluence',)):
+        self.Localdirpath = localdirpath
+        self.MtimeTolerance = mtime_tolerance
+        self.IgnoreDirs = set(ignoredirs or ())
+        self._filesbysize = None
+        self._partialdigests = {}
+        self._fulldigests = {}
+
+    def __repr__(self):
+        return "LocalRenameIndex('%s')" % self.Localdirpath
+
+    @property
+    def FilesBySize(self):
+        """ dict: filesbysize[size] = [(filepath, mtime), ...], created on first access. """
+        if self._filesbysize is None:
+            self._filesbysize = self.makeIndex()
+        return self._filesbysize
+
+    def makeIndex(self):
+        """ Walks the local folder and returns a dict with filesbysize[size] = [(filepath, mtime), ...] """
+        filesbysize = {}
+        for dirpath, dirnames, filenames in os.walk(self.Localdirpath):
+            dirnames[:] = [dirname for dirname in dirnames if dirname not in self.IgnoreDirs]
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(filepath)
+                except OSError as e:
+                    logger.debug("Could not stat local file %s: %s", filepath, e)
+                    continue
+                filesbysize.setdefault(stat.st_size, []).append((filepath, stat.st_mtime))
+        logger.debug("Indexed %s file sizes in %s", len(filesbysize), self.Localdirpath)
+        return filesbysize
+
+    def addFile(self, filepath):
+        """ Add a new local file to the index (if the index has been created). """
+        if self._filesbysize is not None:
+            stat = os.stat(filepath)
+            self._filesbysize.setdefault(stat.st_size, []).append((filepath, stat.st_mtime))
+
+    def _cachedDigest(self, cache, digestfun, filepath):
+        """ Local digests are cached, since the same local file may be compared against several remote files. """
+        if filepath not in cache:
+            cache[filepath] = digestfun(filepath)
+        return cache[filepath]
+
+    def findRenamed(self, srcfilepath, localdir=None):
+        """
+        Returns the path of a local file that is identical to srcfilepath but has a different name,
+        or None if no such file is found.
+        If localdir is given, only local files in that folder are considered (i.e. the folder
+        that srcfilepath would be copied into), since renaming the remote file only prevents
+        future copies if the local file is in the corresponding folder.
+        Local files whose name also exists next to srcfilepath (on the remote) are not considered,
+        since those are not renamed, just identical files.
+        """
+        srcstat = os.stat(srcfilepath)
+        candidates = [filepath for filepath, mtime in self.FilesBySize.get(srcstat.st_size, ())
+                      if abs(mtime - srcstat.st_mtime) <= self.MtimeTolerance
+                      and (localdir is None or os.path.dirname(filepath) == os.path.normpath(localdir))]
+        if not candidates:
+            return None
+        srcnames = set(os.listdir(os.path.dirname(srcfilepath)))
+        candidates = [filepath for filepath in candidates if os.path.basename(filepath) not in srcnames]
+        if not candidates:
+            return None
+        srcdigest = partialDigest(srcfilepath)
+        candidates = [filepath for filepath in candidates
+                      if self._cachedDigest(self._partialdigests, partialDigest, filepath) == srcdigest]
+        if candidates and srcstat.st_size > 2*PARTIAL_DIGEST_BYTES:
+            # Confirm with the full content digest, since a match leads to a remote rename.
+            # (Small files are already fully digested.)
+            logger.debug("%s candidates after partial digest, computing full digest for %s", len(candidates), srcfilepath)
+            srcdigest = fullDigest(srcfilepath)
+            candidates = [filepath for filepath in candidates
+                          if self._cachedDigest(self._fulldigests, fullDigest, filepath) == srcdigest]
+        if candidates:
+            logger.info("Remote file '%s' matches local file '%s'", srcfilepath, candidates[0])
+            return candidates[0]
+        return None
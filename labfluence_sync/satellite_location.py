@@ -144,7 +144,12 @@ import logging
 logger = logging.getLogger(__name__)
 
 # from labfluencebase import LabfluenceBase
-from dirtreeparsing import genPathmatchTupsByPathscheme, getFoldersWithSameProperty
+from dirtreeparsing import genPathmatchTupsByPathscheme, getFoldersWithSameProperty, makeFolderIndex
+from syncbudget import getTreeSize
+from filehashing import filesMatch
+from tracing import traced, span
+from memorymonitor import SpillDict
+from records import SubentryRecord
 
 try:
     from .decorators.cache_decorator import cached_property
@@ -241,6 +246,7 @@ class SatelliteLocation(object):
         self._expidsubidxbyfolder = None
         self._cache = dict()
         self.path = os.path # Default
+        self.VerifyFailures = []    # (srcpath, destpath) tuples for copies that failed verification.
 
     def __repr__(self):
         return "sl> {}".format(self.Name or self.Description or self.URI)
@@ -475,7 +481,8 @@ class SatelliteLocation(object):
 
     ### DIR TREE PARSING ###
 
-    def genPathmatchTupsByPathscheme(self, filterfun=None, matchcombiner=None, matchinit=None, rightmost=None):
+    def genPathmatchTupsByPathscheme(self, filterfun=None, matchcombiner=None, matchinit=None, rightmost=None,
+                                     matchfilter=None):
         """
         Specifying regexs, basedir and folderscheme have been deprechated.
         These are taken from self.Regexs, self.Rootdir, and self.Folderscheme.
@@ -489,6 +496,8 @@ class SatelliteLocation(object):
                             (path, matchcombiner(basematch, schemekey, match))
                             The default is to return a dict with schemekeys: match-object, i.e.:
                                 matchcombiner = lambda basematch, schemekey, match: dict(basematch, **{schemekey: match})
+            :matchfilter:   A function (schemekey, match) -> bool used to prune the traversal,
+                            e.g. a dirtreeparsing.ExpFilter to skip old year and experiment folders.
 
         If you want to exclude folders based simply on their names (not path), add the foldername to self.IgnoreDirs.
 
@@ -501,7 +510,8 @@ class SatelliteLocation(object):
 
         foldermatchtups = genPathmatchTupsByPathscheme(basepath=basepath, folderscheme=folderscheme, regexs=regexs,
                                                        filterfun=filterfun, matchcombiner=matchcombiner,
-                                                       matchinit=matchinit, rightmost=rightmost, fs=self)
+                                                       matchinit=matchinit, rightmost=rightmost, fs=self,
+                                                       matchfilter=matchfilter)
         return foldermatchtups
 
     def genPathMatchlistTupByPathscheme(self, filterfun=None, rightmost=None):
@@ -525,7 +535,7 @@ class SatelliteLocation(object):
         return self.genPathmatchTupsByPathscheme(filterfun=filterfun, matchcombiner=matchcombiner, rightmost=rightmost)
 
 
-    def genPathGroupdictTupByPathscheme(self, filterfun=None, rightmost=None):
+    def genPathGroupdictTupByPathscheme(self, filterfun=None, rightmost=None, matchfilter=None):
         """
         Example to demonstrate how to use the matchcombiner argument in self.genPathmatchTupsByPathscheme.
         This also sets a starting basematch using matchinit argument (rather than handling the case in matchcombiner).
@@ -545,7 +555,7 @@ class SatelliteLocation(object):
             """ Creates a copy of basematch and updates it with the match's groupdict. """
             return dict(basematch, **match.groupdict())
         return self.genPathmatchTupsByPathscheme(filterfun=filterfun, matchcombiner=matchcombiner,
-                                                 matchinit={}, rightmost=rightmost)
+                                                 matchinit={}, rightmost=rightmost, matchfilter=matchfilter)
 
     def make_dirparse_kwargs(self, basepath=None, folderscheme=None, regexs=None, fs=None, filterfun=None):
         """ Generate ubiqutous keyword arguments for dirtree parsing. """
@@ -556,7 +566,7 @@ class SatelliteLocation(object):
                     fs=fs or self,
                     filterfun=filterfun or default_filter)
 
-    def getExpfoldersByExpid(self):
+    def getExpfoldersByExpid(self, matchfilter=None, memorybudget=None):
         """
         Return datastructure:
             [expid][subentry_idx] = <filepath relative to basedir/rootdir>
@@ -569,9 +579,15 @@ class SatelliteLocation(object):
          c) The regexs must specify the named group 'expid'.
 
         Almost identical to experimentmanager.ExperimentManager.findLocalExpsPathGdTupByExpid method.
+        If memorybudget (a memorymonitor.MemoryBudget) is given, the result is a SpillDict
+        which is moved to disk if memory usage approaches the budget.
         """
-        foldermatchtuples = self.genPathGroupdictTupByPathscheme(rightmost='experiment')
-        foldersbyexpid = {gd.get('expid'): path for path, gd in foldermatchtuples}
+        foldermatchtuples = self.genPathGroupdictTupByPathscheme(rightmost='experiment', matchfilter=matchfilter)
+        if memorybudget is None:
+            return {gd.get('expid'): path for path, gd in foldermatchtuples}
+        foldersbyexpid = SpillDict(memorybudget, name='remote-experiments')
+        for path, gd in foldermatchtuples:
+            foldersbyexpid[gd.get('expid')] = path
         return foldersbyexpid
 
     def getFoldersWithSameProperty(self, group, rightmost=None, countlim=1):
@@ -587,6 +603,13 @@ class SatelliteLocation(object):
         return getFoldersWithSameProperty(group=group, rightmost=rightmost, countlim=countlim,
                                           **self.make_dirparse_kwargs())
 
+    def getFolderIndex(self, group, rightmost=None):
+        """
+        Returns a compact folder index for this location, see dirtreeparsing.makeFolderIndex.
+        Used by SyncManager.check_duplicates to crosscheck local and remote folders.
+        """
+        return makeFolderIndex(group=group, rightmost=rightmost, **self.make_dirparse_kwargs())
+
     def getDuplicates(self, subentries=False):
         if subentries:
             return self.getDuplicateSubentries()
@@ -609,7 +632,9 @@ class SatelliteLocation(object):
         " Return a ... "
         return self.getFoldersWithSameProperty(group=('expid', 'subentry_idx'), rightmost='subentry', countlim=2)
 
-    def getSubentryfoldersByExpidSubidx(self, regexs=None, basedir=None, folderscheme=None):
+    @traced('SatelliteLocation.getSubentryfoldersByExpidSubidx')
+    def getSubentryfoldersByExpidSubidx(self, regexs=None, basedir=None, folderscheme=None, matchfilter=None,
+                                        memorybudget=None):
         """
         Return datastructure:
             [expid][subentry_idx] = <filepath relative to basedir/rootdir>
@@ -621,14 +646,18 @@ class SatelliteLocation(object):
          a) Folderscheme and corresponding regexs must be configured (optionally also the rootdir).
          b) Folderscheme must specify 'subentry', e.g. './year/experiment/subentry' or just 'subentry'
          c) The regexs must specify the named groups 'expid' and 'subentry_idx'
+        matchfilter can be used to prune the traversal, e.g. only parse experiments after RS340,
+        see dirtreeparsing.ExpFilter.
+        If memorybudget (a memorymonitor.MemoryBudget) is given, the result is a SpillDict
+        which is moved to disk if memory usage approaches the budget.
         Changelog:
             Deprechated the use of self.Matchpriorities and just using genPathmatchdictTupByPathscheme to
             get a combined match group dict for each path.
         """
         logger.debug("getSubentryfoldersByExpidSubidx(regexs=%s, basedir='%s', folderscheme='%s')",
                      regexs, basedir, folderscheme)
-        foldermatchtuples = self.genPathGroupdictTupByPathscheme(rightmost='subentry')
-        foldersbyexpidsubidx = {}
+        foldermatchtuples = self.genPathGroupdictTupByPathscheme(rightmost='subentry', matchfilter=matchfilter)
+        foldersbyexpidsubidx = {} if memorybudget is None else SpillDict(memorybudget, name='remote-subentries')
         # This runs the generator. You may want to grab as much as possible now that you have it.
         for folderpath, matchdict in foldermatchtuples:
             try:
@@ -637,12 +666,55 @@ class SatelliteLocation(object):
                 logger.warning("Matchdict %s for folderpath %s does not contain keys 'expid' and 'subentry_idx' !!",
                                matchdict, folderpath)
                 continue
-            foldersbyexpidsubidx.setdefault(expid, {})[subentry_idx] = folderpath
+            # Not using setdefault(...)[subentry_idx] = ..., since that does not work for spilled SpillDicts:
+            subentryfolders = foldersbyexpidsubidx.get(expid, {})
+            subentryfolders[subentry_idx] = folderpath
+            foldersbyexpidsubidx[expid] = subentryfolders
         logger.debug("expsubfolders expids: %s", foldersbyexpidsubidx.keys())
         return foldersbyexpidsubidx
 
 
 
+    def genSubentryRecords(self, matchfilter=None):
+        """
+        Returns a generator of records.SubentryRecord for all subentry folders in this location
+        (folders whose combined match groupdict does not have expid and subentry_idx are skipped).
+        """
+        for folderpath, matchdict in self.genPathGroupdictTupByPathscheme(rightmost='subentry', matchfilter=matchfilter):
+            try:
+                yield SubentryRecord.fromGroupdict(matchdict, path=folderpath)
+            except KeyError:
+                logger.warning("Matchdict %s for folderpath %s does not contain keys 'expid' and 'subentry_idx' !!",
+                               matchdict, folderpath)
+
+    @traced('SatelliteLocation.getSubentryRecordsByExpid')
+    def getSubentryRecordsByExpid(self, matchfilter=None, memorybudget=None):
+        """
+        Like getSubentryfoldersByExpidSubidx, but returns compact records:
+            [expid] = [SubentryRecord, ...]     (sorted by subentry index)
+        Used by SyncManager.sync_subentries. See getSubentryfoldersByExpidSubidx for the arguments.
+        As with getSubentryfoldersByExpidSubidx, there is only one record per (expid, subentry index):
+        if several folders have the same expid and subentry index, the last one found is used
+        (and a warning is logged; use checkduplicates to find and fix these).
+        """
+        recordsbyexpid = {} if memorybudget is None else SpillDict(memorybudget, name='remote-subentries')
+        for record in self.genSubentryRecords(matchfilter=matchfilter):
+            # Not using setdefault(...).append, since that does not work for spilled SpillDicts:
+            records = recordsbyexpid.get(record.Expid, [])
+            duplicate = next((idx for idx, other in enumerate(records) if other.Subidx == record.Subidx), None)
+            if duplicate is not None:
+                logger.warning("Duplicate subentry folders for %s%s: %s and %s; only syncing the latter.",
+                               record.Expid, record.Subidx, records[duplicate].Path, record.Path)
+                records[duplicate] = record
+            else:
+                records.append(record)
+            recordsbyexpid[record.Expid] = records
+        for expid in list(recordsbyexpid.keys()):
+            recordsbyexpid[expid] = sorted(recordsbyexpid[expid], key=lambda record: record.Subidx)
+        return recordsbyexpid
+
+
+
     def getFilepathsByExpIdSubIdx(self, regexs=None, basedir=None, pathscheme=None):
         """
         Equivalent to getSubentryfolderssByExpIdSubIdx, but for files rather than
@@ -873,12 +945,19 @@ class SatelliteFileLocation(SatelliteLocation):
         os.rename(path, newname)
 
 
-    def syncToLocalDir(self, satellitepath, localpath, verbosity=0, dryrun=False):
+    @traced('syncToLocalDir', argnames=('satellitepath', 'localpath'))
+    def syncToLocalDir(self, satellitepath, localpath, verbosity=0, dryrun=False, budget=None, renameindex=None,
+                       verify=False):
         """
         Consider making a call to rsync and see if that is available, and only use the rest as a fallback...
         # Note, if satellitepath ends with a '/', the basename will be ''.
         # This will thus cause the contents of satellitepath to be copied into localpath, rather than localpath/foldername
         # I guess this is also the behaviour of e.g. rsync, so should be ok. Just be aware of it.
+        If a syncbudget.SyncBudget is given as budget, copies are only started if allowed by the budget;
+        otherwise the copy is recorded as deferred in the budget.
+        If a renamedetection.LocalRenameIndex is given as renameindex, new remote files that
+        seem to have been renamed locally can be renamed on the remote instead of being copied.
+        If verify is True, copied files are verified by comparing source and destination digests.
         """
         if not os.path.isdir(localpath):
             logger.warning("localpath NOT A DIRECTORY, skipping...\n--'%s'", localpath)
@@ -887,7 +966,8 @@ class SatelliteFileLocation(SatelliteLocation):
         # If it is just a file:
         if os.path.isfile(realpath):
             #print("verbosity:", verbosity, "; dryrun:", dryrun)
-            return self.syncFileToLocalDir(satellitepath, localpath, verbosity=verbosity, dryrun=dryrun)
+            return self.syncFileToLocalDir(satellitepath, localpath, verbosity=verbosity, dryrun=dryrun, budget=budget,
+                                           renameindex=renameindex, verify=verify)
         elif not os.path.isdir(realpath):
             logger.warning("satellitepath is not a file or directory, skipping...\n--'%s'", realpath)
             return
@@ -896,20 +976,105 @@ class SatelliteFileLocation(SatelliteLocation):
         # If the folder does not exists in localpath destination, just use copytree:
         if not os.path.exists(os.path.join(localpath, foldername)):
             logger.info(u"Remote folder not present in source, invoking shutil.copytree('%s', os.path.join('%s', '%s'))", realpath, localpath, foldername)
-            if verbosity > 0:
-                print("%s\t%s\t %s \t %s" % ('N', 'copytree', realpath, os.path.join(localpath, foldername)))
-            if not dryrun:
-                shutil.copytree(realpath, os.path.join(localpath, foldername))    # Does copytree return anything? Or does it just raise errors?
+            self._copyWithBudget(shutil.copytree, realpath, os.path.join(localpath, foldername), 'copytree',
+                                 satellitepath, localpath, verbosity=verbosity, dryrun=dryrun, budget=budget,
+                                 verify=verify)
             return
         # foldername already exists in local directory, just recurse for each item...
         for item in os.listdir(realpath):
-            self.syncToLocalDir(os.path.join(satellitepath, item), os.path.join(localpath, foldername), verbosity=verbosity, dryrun=dryrun)
+            self.syncToLocalDir(os.path.join(satellitepath, item), os.path.join(localpath, foldername),
+                                verbosity=verbosity, dryrun=dryrun, budget=budget, renameindex=renameindex,
+                                verify=verify)
 
 
-    def syncFileToLocalDir(self, satellitepath, localpath, verbosity=0, dryrun=False):
+    def _copyWithBudget(self, copyfun, srcpath, destpath, opname, satellitepath, localpath,
+                        symbol='N', verbosity=0, dryrun=False, budget=None, verify=False):
+        """
+        Invokes copyfun(srcpath, destpath) unless dryrun is set or the budget does not allow the copy.
+        Returns True if the copy was performed (or would have been, for dryrun), False if deferred.
+        If verify is True, the copy is checked with _verifyCopy.
+        """
+        if budget is not None:
+            nbytes = getTreeSize(srcpath)
+            if not budget.allow(nbytes):
+                budget.defer(satellitepath, localpath, nbytes)
+                if verbosity > 0:
+                    # Symbols: N=New, O=Overwrite, S=Skipping, D=Deferred
+                    print("%s\t%s\t %s \t %s" % ('D', 'deferred', srcpath, destpath))
+                return False
+        if verbosity > 0:
+            # Symbols: N=New, O=Overwrite, S=Skipping
+            print("%s\t%s\t %s \t %s" % (symbol, opname.ljust(8), srcpath, destpath))
+        if not dryrun:
+            starttime = time.time()
+            with span(opname, cat='copy', src=srcpath, dest=destpath):
+                copyfun(srcpath, destpath)    # Does copytree return anything? Or does it just raise errors?
+            if budget is not None:
+                budget.record(nbytes, time.time() - starttime)
+            if verify:
+                self._verifyCopy(srcpath, destpath, verbosity=verbosity)
+        elif budget is not None:
+            budget.record(nbytes, 0)
+        return True
+
+
+    def _offerRename(self, srcfilepath, localpath, renameindex, verbosity=0, dryrun=False):
+        """
+        Checks if srcfilepath (a new remote file) matches a local file in localpath with a different name,
+        and if so asks the user whether to rename the remote file to match the local file.
+        Returns True if the remote file was renamed (or would have been, for dryrun), i.e. no copy is needed.
+        """
+        localmatch = renameindex.findRenamed(srcfilepath, localdir=localpath)
+        if not localmatch:
+            return False
+        newsrcpath = os.path.join(os.path.dirname(srcfilepath), os.path.basename(localmatch))
+        if verbosity > 0 or dryrun:
+            # Symbols: N=New, O=Overwrite, S=Skipping, R=Renamed
+            print("%s\t%s\t %s \t %s" % ('R', 'rename  ', srcfilepath, localmatch))
+        if dryrun:
+            return True
+        try:
+            answer = input("Remote file seems to have been renamed locally:\n- %s\n- %s\n"
+                           "Rename remote file to match local (Y) or copy it (N)? " % (srcfilepath, localmatch))
+        except (KeyboardInterrupt, EOFError):
+            logger.info("Rename prompt interrupted, copying file instead.")
+            return False
+        if answer and answer[0].lower() == 'y':
+            logger.info("Renaming remote file %s to %s", srcfilepath, newsrcpath)
+            self.rename(srcfilepath, newsrcpath)
+            return True
+        return False
+
+
+    def _verifyCopy(self, srcpath, destpath, verbosity=0):
+        """
+        Verifies a copied file (or folder tree) by comparing source and destination sizes and digests.
+        Very large files are compared with a parallel tree hash (see filehashing.filesMatch).
+        Failures are logged and recorded in self.VerifyFailures. Returns True if all files match.
+        """
+        if os.path.isdir(srcpath):
+            filepairs = ((os.path.join(dirpath, filename), os.path.join(destpath, os.path.relpath(dirpath, srcpath), filename))
+                         for dirpath, _, filenames in os.walk(srcpath) for filename in filenames)
+        else:
+            filepairs = [(srcpath, destpath)]
+        allok = True
+        for srcfile, destfile in filepairs:
+            if os.path.isfile(destfile) and filesMatch(srcfile, destfile):
+                continue
+            logger.error("Verification of copy FAILED: '%s' -> '%s'", srcfile, destfile)
+            if verbosity > 0:
+                print("%s\t%s\t %s \t %s" % ('V!', 'verify  ', srcfile, destfile))
+            self.VerifyFailures.append((srcfile, destfile))
+            allok = False
+        return allok
+
+
+    def syncFileToLocalDir(self, satellitepath, localpath, verbosity=0, dryrun=False, budget=None, renameindex=None,
+                           verify=False):
         """
         Syncs A FILE to local dir.
         True = File was copied, False = Sync failed, None = File not copied.
+        If renameindex is given, new files are first checked against the local files, see _offerRename.
         """
         if not os.path.isdir(localpath):
             logger.warning("Destination localpath '%s' is not a directory, skipping...", localpath)
@@ -931,12 +1096,13 @@ class SatelliteFileLocation(SatelliteLocation):
                 return
         destfilepath = os.path.join(localpath, filename)
         if not os.path.exists(destfilepath):
+            if renameindex is not None and self._offerRename(srcfilepath, localpath, renameindex, verbosity=verbosity, dryrun=dryrun):
+                return
             logger.info("Destfilepath does not exists. Invoking shutil.copy2(\n'%s',\n'%s')", srcfilepath, destfilepath)
-            if verbosity > 0:
-                # Symbols: N=New, O=Overwrite, S=Skipping
-                print("%s\t%s\t %s \t %s" % ('N', 'copy2   ', srcfilepath, destfilepath))
-            if not dryrun:
-                shutil.copy2(srcfilepath, destfilepath)
+            copied = self._copyWithBudget(shutil.copy2, srcfilepath, destfilepath, 'copy2', satellitepath, localpath,
+                                          verbosity=verbosity, dryrun=dryrun, budget=budget, verify=verify)
+            if copied and renameindex is not None and not dryrun:
+                renameindex.addFile(destfilepath)
             return
         lastmodst = "\n".join("-- {} last modified: {}".format(f, modtime)
                               for f, modtime in (('srcfile ', time.ctime(os.path.getmtime(srcfilepath))),
@@ -958,11 +1124,8 @@ class SatelliteFileLocation(SatelliteLocation):
             logger.info("srcfile NEWER than destfile, OVERWRITING destfile... ('%s')", filename)
             logger.debug("\n--srcfile: '%s'\n--dstfile: '%s'\n--Invoking shutil.copy2(%s, %s)",
                          srcfilepath, destfilepath, srcfilepath, destfilepath)
-            if verbosity > 0:
-                # Symbols: N=New, O=Overwrite, S=Skipping
-                print("%s\t%s\t %s \t %s" % ('O', 'copy2   ', srcfilepath, destfilepath))
-            if not dryrun:
-                shutil.copy2(srcfilepath, destfilepath)
+            self._copyWithBudget(shutil.copy2, srcfilepath, destfilepath, 'copy2', satellitepath, localpath,
+                                 symbol='O', verbosity=verbosity, dryrun=dryrun, budget=budget, verify=verify)
             return
         else:
             logger.info("srcfile NOT newer than destfile, SKIPPING... verbosity=%s, ('%s')", verbosity, filename)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Module for running a sync within a fixed time (and/or byte) budget.
+
+A SyncBudget object is passed from SyncManager.sync_remotes down to
+SatelliteLocation.syncToLocalDir. Before starting a new copy, the satellite location
+asks the budget whether the copy is allowed. The budget estimates how long the copy
+will take from the throughput observed so far in this run, and refuses the copy if
+it would exceed the remaining time (or the max_bytes budget).
+Refused copies are recorded as "deferred" and written to a remainder file,
+which is picked up by the next budgeted run, so that deferred experiments are synced first.
+
+Usage:
+    budget = SyncBudget(time_budget=parse_duration('45m'), max_bytes=parse_bytesize('50G'),
+                        remainderfile='~/.labfluence/sync_remainder.json')
+    syncmgr.sync_remotes(remotes, budget=budget)
+
+"""
+from __future__ import print_function
+import os
+import re
+import json
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+from dirtreeparsing import expidIndex
+
+
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# Unit names accepted in durations, e.g. '45 min' or '2 hours', and the unit they stand for:
+DURATION_UNIT_NAMES = dict([(name, 's') for name in ('s', 'sec', 'secs', 'second', 'seconds')] +
+                           [(name, 'm') for name in ('m', 'min', 'mins', 'minute', 'minutes')] +
+                           [(name, 'h') for name in ('h', 'hr', 'hrs', 'hour', 'hours')] +
+                           [(name, 'd') for name in ('d', 'day', 'days')])
+_DURATION_NUMBER = r"[0-9]+(?:\.[0-9]+)?"
+_DURATION_UNIT = "|".join(sorted(DURATION_UNIT_NAMES, key=len, reverse=True))   # longest names first.
+_DURATION_TOKEN = r"(%s)\s*(%s)" % (_DURATION_NUMBER, _DURATION_UNIT)
+# The whole string must be either a plain number (seconds), or one or more <number><unit> tokens:
+_DURATION_RE = re.compile(r"\s*(?:%s\s*|(?:%s\s*(?:%s)\s*)+)\Z" % (_DURATION_NUMBER, _DURATION_NUMBER, _DURATION_UNIT))
+BYTESIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3, 't': 1024**4}
+
+
+def parse_duration(duration):
+    """
+    Parse a duration string like '45m', '45 min', '2h', '1h30m' or '90' (seconds) and return seconds (float).
+    Returns None if duration is None or empty; raises ValueError if it cannot be parsed.
+    """
+    if duration is None or duration == '':
+        return None
+    if isinstance(duration, (int, float)):
+        return float(duration)
+    duration_lower = duration.lower()
+    if not _DURATION_RE.match(duration_lower):
+        raise ValueError("Could not parse duration '%s', use e.g. '45m', '2h' or '1h30m'." % duration)
+    parts = re.findall(_DURATION_TOKEN, duration_lower)
+    if not parts:
+        return float(duration_lower)    # A plain number of seconds.
+    return sum(float(value)*DURATION_UNITS[DURATION_UNIT_NAMES[unit]] for value, unit in parts)
+
+
+def parse_bytesize(size):
+    """
+    Parse a byte size string like '500M', '2G', '2GB', '2GiB', '1.5T' or '1024' and return number of bytes (int).
+    Returns None if size is None or empty; raises ValueError if it cannot be parsed.
+    """
+    if size is None or size == '':
+        return None
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.match(r"\s*([0-9]+(?:\.[0-9]+)?)\s*(b|[kmgt](?:i?b)?|)\s*\Z", size.lower())
+    if not match:
+        raise ValueError("Could not parse byte size '%s', use e.g. '500M' or '2G'." % size)
+    value, unit = match.groups()
+    return int(float(value)*BYTESIZE_UNITS[unit[:1]])
+
+
+def getTreeSize(path):
+    """ Returns the combined size of all files below path (or the size of path if it is a file). """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError as e:
+                logger.debug("Could not get size of file %s: %s", filename, e)
+    return total
+
+
+class SyncBudget(object):
+    """
+    Keeps track of time and bytes spent during a sync run, decides whether new copies
+    can be started, and records the work that was deferred because of the budget.
+
+    Args:
+        :time_budget:   Time budget in seconds (None = no time limit).
+        :max_bytes:     Max number of bytes to copy during the run (None = no limit).
+        :remainderfile: Path to file where deferred work is written after the run,
+                        and from where deferred work from a previous run is read.
+        :safety:        Factor applied to the estimated copy time before comparing with the
+                        remaining time. A value above 1 makes the cutoff more conservative.
+    """
+
+    def __init__(self, time_budget=None, max_bytes=None, remainderfile=None, safety=1.1):
+        self.TimeBudget = time_budget
+        self.MaxBytes = max_bytes
+        self.Remainderfile = os.path.expanduser(remainderfile) if remainderfile else None
+        self.Safety = safety
+        self.Starttime = time.time()
+        self.BytesCopied = 0
+        self.CopyTime = 0.0     # Seconds spent actually copying; used to estimate throughput.
+        self.Deferred = []      # list of dicts describing deferred work.
+        self.Current = {}       # Context for the current work item (remote, expid), set by SyncManager.
+        self._resumekeys = set()
+        if self.Remainderfile:
+            self.loadRemainder()
+
+    def __repr__(self):
+        return "SyncBudget(time_budget=%s, max_bytes=%s, elapsed=%.0f, copied=%s, deferred=%s)" % \
+            (self.TimeBudget, self.MaxBytes, self.elapsed(), self.BytesCopied, len(self.Deferred))
+
+    def elapsed(self):
+        """ Seconds elapsed since the budget was started. """
+        return time.time() - self.Starttime
+
+    def remaining(self):
+        """ Seconds remaining of the time budget (None if there is no time budget). """
+        if self.TimeBudget is None:
+            return None
+        return self.TimeBudget - self.elapsed()
+
+    def throughput(self):
+        """ Observed throughput in bytes/second, or None if nothing has been copied yet. """
+        if self.CopyTime > 0 and self.BytesCopied > 0:
+            return self.BytesCopied / self.CopyTime
+        return None
+
+    def estimate(self, nbytes):
+        """ Estimated number of seconds to copy nbytes, or None if throughput is not yet known. """
+        rate = self.throughput()
+        if rate is None:
+            return None
+        return nbytes / rate
+
+    def exhausted(self):
+        """ Returns True if no more copies can be started at all. """
+        if self.MaxBytes is not None and self.BytesCopied >= self.MaxBytes:
+            return True
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def allow(self, nbytes):
+        """
+        Returns True if a copy of nbytes can be started within the budget.
+        Before any throughput has been measured, copies are allowed as long as there is time left.
+        """
+        if self.exhausted():
+            return False
+        if self.MaxBytes is not None and self.BytesCopied + nbytes > self.MaxBytes:
+            return False
+        remaining = self.remaining()
+        if remaining is not None:
+            eta = self.estimate(nbytes)
+            if eta is not None and eta*self.Safety > remaining:
+                return False
+        return True
+
+    def record(self, nbytes, seconds):
+        """ Record a completed copy of nbytes that took <seconds> seconds. """
+        self.BytesCopied += nbytes
+        self.CopyTime += max(seconds, 0)
+
+    def defer(self, satellitepath, localpath, nbytes=None, reason=None):
+        """ Record that the copy of satellitepath into localpath was deferred. """
+        item = dict(self.Current, satellitepath=satellitepath, localpath=localpath,
+                    bytes=nbytes, reason=reason or self.reason(nbytes or 0))
+        logger.info("Deferring sync of '%s' -> '%s' (%s)", satellitepath, localpath, item['reason'])
+        self.Deferred.append(item)
+
+    def reason(self, nbytes):
+        """ Human readable reason for why a copy of nbytes is not allowed. """
+        if self.MaxBytes is not None and self.BytesCopied + nbytes > self.MaxBytes:
+            return 'max_bytes'
+        return 'time_budget'
+
+
+    ## Work ordering and resume:
+
+    def isResumed(self, remote, expid):
+        """ Returns True if (remote, expid) was deferred in the previous budgeted run. """
+        return (remote, expid) in self._resumekeys
+
+    def prioritize(self, remote, expids):
+        """
+        Returns expids sorted by sync priority:
+        Experiments deferred in the previous run come first, then the most recent experiments
+        (highest expid index) before older ones.
+        """
+        return sorted(expids, key=lambda expid: (not self.isResumed(remote, expid), -expidIndex(expid), expid))
+
+    def loadRemainder(self, remainderfile=None):
+        """ Load deferred work from a previous run. """
+        remainderfile = remainderfile or self.Remainderfile
+        if not remainderfile or not os.path.isfile(remainderfile):
+            return []
+        try:
+            with open(remainderfile) as fd:
+                deferred = json.load(fd).get('deferred', [])
+        except (IOError, OSError, ValueError) as e:
+            logger.warning("Could not load sync remainder file %s: %s", remainderfile, e)
+            return []
+        self._resumekeys = {(item.get('remote'), item.get('expid')) for item in deferred}
+        logger.info("Loaded %s deferred items from previous sync run (%s)", len(deferred), remainderfile)
+        return deferred
+
+    def writeRemainder(self, remainderfile=None):
+        """
+        Write deferred work to remainderfile, so the next run can resume.
+        If nothing was deferred, any existing remainder file is removed.
+        """
+        remainderfile = remainderfile or self.Remainderfile
+        if not remainderfile:
+            return
+        if not self.Deferred:
+            if os.path.isfile(remainderfile):
+                logger.info("Nothing deferred, removing old remainder file %s", remainderfile)
+                os.remove(remainderfile)
+            return
+        dirname = os.path.dirname(remainderfile)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(remainderfile, 'w') as fd:
+            json.dump(dict(created=time.strftime("%Y-%m-%d %H:%M:%S"), summary=self.summary(),
+                           deferred=self.Deferred), fd, indent=1)
+        logger.info("Wrote %s deferred items to remainder file %s", len(self.Deferred), remainderfile)
+        return remainderfile
+
+    def summary(self):
+        """ Returns a dict summarizing the run. """
+        return dict(elapsed=round(self.elapsed(), 1), bytes_copied=self.BytesCopied,
+                    throughput=self.throughput(), deferred=len(self.Deferred),
+                    deferred_bytes=sum(item.get('bytes') or 0 for item in self.Deferred))
@@ -47,7 +47,27 @@ Notes:
 from __future__ import print_function
 import os
 import logging
+from collections import OrderedDict
 logger = logging.getLogger(__name__) # http://victorlin.me/posts/2012/08/good-logging-practice-in-python/
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # python 2 without the 'futures' backport; remotes are indexed one at a time.
+    ThreadPoolExecutor = None
+
+try:
+    from .dirtreeparsing import findMismatchingGroups, expidIndex, parseDate
+    from .syncbudget import parse_duration, parse_bytesize
+    from .renamedetection import LocalRenameIndex
+    from .profiling import NullProfiler
+    from .tracing import traced, isTracing, addEvents
+except (ImportError, SystemError, ValueError):
+    # If the module is run from the labfluence_sync directory (as main() does), we cannot do relative imports.
+    from dirtreeparsing import findMismatchingGroups, expidIndex, parseDate
+    from syncbudget import parse_duration, parse_bytesize
+    from renamedetection import LocalRenameIndex
+    from profiling import NullProfiler
+    from tracing import traced, isTracing, addEvents
 
 
 class SyncManager(object):
@@ -55,15 +75,35 @@ class SyncManager(object):
     Handles synchronization between satellite locations and the local experiment data tree.
     """
 
-    def __init__(self, experimentmgr, satellitemgr):
+    def __init__(self, experimentmgr, satellitemgr, profiler=None, memorybudget=None):
         self.Experimentmanager = experimentmgr
         self.Satellitemanager = satellitemgr
+        # A profiling.PhaseProfiler can be used to profile the phases of the sync separately:
+        self.Profiler = profiler or NullProfiler()
+        # With a memorymonitor.MemoryBudget, large scan results are spilled to disk near the budget:
+        self.MemoryBudget = memorybudget
 
 
-    def sync_remotes(self, remotes=None, onlyexpids=None, verbosity=None, dryrun=None):
+    def sync_remotes(self, remotes=None, onlyexpids=None, verbosity=None, dryrun=None, budget=None, expfilter=None,
+                     detect_renames=False, workers=1, verify=False):
         """
         Syncs all satellite locations with sync_remote.
+        If expfilter (a dirtreeparsing.ExpFilter) is given, only experiments passing the filter are
+        synced, and both the local and the remote directory trees are pruned while being parsed.
+        If detect_renames is True, new remote files that match a local file with a different name
+        (same size, mtime and content) can be renamed on the remote instead of copied.
+        If budget (a syncbudget.SyncBudget) is given, experiments are synced in order of priority,
+        new copies are only started while the budget allows it, and the deferred
+        remainder is written to the budget's remainder file when done.
+        If verify is True, copied files are verified by comparing digests of source and destination.
+        With workers > 1, each remote is synced by a pool of worker processes, sharded by experiment,
+        see the syncworkers module. This is mostly useful with verify, where the sync is CPU bound.
+        Budgets and rename detection require a single sequential sync, so these disable workers.
         """
+        if workers > 1 and (budget is not None or detect_renames):
+            logger.warning("Sync budget and rename detection are not supported with worker processes, "
+                           "syncing sequentially.")
+            workers = 1
         if remotes:
             satlocs = {remote: self.Satellitemanager.get(remote) for remote in remotes}
         else:
@@ -77,11 +117,30 @@ class SyncManager(object):
                 if verbosity > 1:
                     print("Skipping satellite location '%s' (DoNotSync=%s)" % (key, satloc.DoNotSync))
                 continue
-            self.sync_remote(key, onlyexpids=onlyexpids, verbosity=verbosity, dryrun=dryrun)
+            self.sync_remote(key, onlyexpids=onlyexpids, verbosity=verbosity, dryrun=dryrun, budget=budget,
+                             expfilter=expfilter, detect_renames=detect_renames, workers=workers, verify=verify)
         if verbosity > 1:
             print("Sync from '%s' complete!" % list(satlocs.keys()))
-
-    def sync_remote(self, remote, onlyexpids=None, verbosity=None, dryrun=None):
+        if budget is not None:
+            logger.info("Sync budget summary: %s", budget.summary())
+            remainderfile = budget.writeRemainder()
+            if verbosity > 0:
+                print("Sync budget: %(elapsed)s s elapsed, %(bytes_copied)s bytes copied, "
+                      "%(deferred)s items (%(deferred_bytes)s bytes) deferred." % budget.summary())
+                if remainderfile:
+                    print("Deferred items written to %s" % remainderfile)
+        if verify:
+            failures = [failure for satloc in satlocs.values() for failure in satloc.VerifyFailures]
+            if failures:
+                logger.error("%s copied files failed verification.", len(failures))
+                print("\nWARNING: %s copied files failed verification:\n%s" %
+                      (len(failures), "\n".join("- %s -> %s" % failure for failure in failures)))
+            elif verbosity > 0:
+                print("All copied files verified OK.")
+
+    @traced('SyncManager.sync_remote', argnames=('remote',))
+    def sync_remote(self, remote, onlyexpids=None, verbosity=None, dryrun=None, budget=None, expfilter=None,
+                    detect_renames=False, workers=1, verify=False):
         """
         Determines the best method to sync remote based on the remote's folderscheme.
         This must currently be either by subentry or experiment.
@@ -93,37 +152,61 @@ class SyncManager(object):
         schemekeys = [key for key in satloc.Folderscheme.split('/') if key and key != '.']
         if 'subentry' in schemekeys:
             logger.info("Syncing remote '%s' using sync_subentries()...", remote)
-            self.sync_subentries(remote, onlyexpids=onlyexpids, verbosity=verbosity, dryrun=dryrun)
+            self.sync_subentries(remote, onlyexpids=onlyexpids, verbosity=verbosity, dryrun=dryrun, budget=budget,
+                                 expfilter=expfilter, detect_renames=detect_renames, workers=workers, verify=verify)
         elif 'experiment' in schemekeys:
             logger.info("Syncing remote '%s' using sync_experimentfolders()...", remote)
-            self.sync_experimentfolders(remote, onlyexpids=onlyexpids, verbosity=verbosity, dryrun=dryrun)
+            self.sync_experimentfolders(remote, onlyexpids=onlyexpids, verbosity=verbosity, dryrun=dryrun, budget=budget,
+                                        expfilter=expfilter, detect_renames=detect_renames, workers=workers,
+                                        verify=verify)
         else:
             raise NotImplementedError("Remote is '%s', but folderscheme ('%s') does not include 'subentry' or 'experiment'.\
                                       These must currently be present in folderscheme for sync to work." % (remote, satloc.Folderscheme))
 
 
-    def sync_experimentfolders(self, remote, onlyexpids=None, verbosity=None, dryrun=None):
+    def sync_experimentfolders(self, remote, onlyexpids=None, verbosity=None, dryrun=None, budget=None, expfilter=None,
+                               detect_renames=False, workers=1, verify=False):
         """
         Initializes a one-way sync from remote into the local experiment data tree.
         """
-        exps = self.Experimentmanager.findLocalExpsPathGdTupByExpid()
-        # exps[expid] = (path, match-group-dict)
+        with self.Profiler.phase('local-parse'):
+            exps = self.Experimentmanager.findLocalExpRecordsByExpid(expfilter=expfilter,
+                                                                     memorybudget=self.MemoryBudget)
+        # exps[expid] = ExpRecord(expid, path, ...)
         satloc = self.Satellitemanager.get(remote)
-        loc_ds = satloc.getExpfoldersByExpid()
+        with self.Profiler.phase('remote-scan:%s' % remote):
+            loc_ds = satloc.getExpfoldersByExpid(matchfilter=expfilter, memorybudget=self.MemoryBudget)
         # loc_ds[expid][subentry_idx] = subentry_folder
         logger.debug("Local experiments: %s", list(exps.keys()))
         logger.debug("Satellite experiments: %s", loc_ds.keys())
 
-        # Python 3 dict views support '&', '|' and other set-like operators:
-        try:
-            common_expids = exps.keys() & loc_ds.keys()
-        except TypeError:
-            common_expids = exps.viewkeys() & loc_ds.viewkeys() # python 2.7:
-        if onlyexpids:
-            common_expids = common_expids & set(onlyexpids)
+        with self.Profiler.phase('planning'):
+            # Python 3 dict views support '&', '|' and other set-like operators:
+            try:
+                common_expids = exps.keys() & loc_ds.keys()
+            except TypeError:
+                common_expids = exps.viewkeys() & loc_ds.viewkeys() # python 2.7:
+            if onlyexpids:
+                common_expids = common_expids & set(onlyexpids)
+            if budget is not None:
+                common_expids = budget.prioritize(remote, common_expids)
         logger.info("Syncing experiments: %s", common_expids)
         if verbosity > 0:
             print("Syncing experiments: %s" % common_expids)
+        if workers > 1:
+            items = [(expid, loc_ds[expid] + '/', exps[expid].Path) for expid in sorted(common_expids)]
+            with self.Profiler.phase('copy'):
+                self.sync_items_parallel(satloc, items, workers, verbosity=verbosity, dryrun=dryrun, verify=verify)
+            return
+        # A single 'copy' phase for all experiments (a memory report takes a snapshot every time a phase exits):
+        with self.Profiler.phase('copy'):
+            self._sync_experimentfolders(remote, satloc, exps, loc_ds, common_expids, verbosity=verbosity,
+                                         dryrun=dryrun, budget=budget, detect_renames=detect_renames, verify=verify)
+        logger.info("'%s' sync complete.", remote)
+
+    def _sync_experimentfolders(self, remote, satloc, exps, loc_ds, common_expids, verbosity=None, dryrun=None,
+                                budget=None, detect_renames=False, verify=False):
+        """ Syncs the experiment folders for common_expids in-process (the serial part of sync_experimentfolders). """
         for expid in common_expids:
             #exp = exps[expid]
             """
@@ -134,53 +217,121 @@ class SyncManager(object):
             /path/to/remote/ with a trailing slash, this should sync the content
             *inside* the remote folder into localdirpath.
             """
-            localdirpath, _ = exps[expid]
+            localdirpath = exps[expid].Path
             #logger.info("Syncing for exp '%s' (%s)", expid, localdirpath)
             remotefolder = loc_ds[expid] + '/'
             logger.info("Syncing for expriment %s : (%s -> %s)", expid, remotefolder, localdirpath)
-            satloc.syncToLocalDir(remotefolder, localdirpath, verbosity=verbosity, dryrun=dryrun)
-        logger.info("'%s' sync complete.", remote)
-
-
-    def sync_subentries(self, remote, onlyexpids=None, verbosity=None, dryrun=None):
+            if budget is not None:
+                budget.Current = dict(remote=remote, expid=expid)
+                if budget.exhausted():
+                    budget.defer(remotefolder, localdirpath)
+                    continue
+            renameindex = LocalRenameIndex(localdirpath) if detect_renames else None
+            satloc.syncToLocalDir(remotefolder, localdirpath, verbosity=verbosity, dryrun=dryrun, budget=budget,
+                                  renameindex=renameindex, verify=verify)
+
+
+    def sync_subentries(self, remote, onlyexpids=None, verbosity=None, dryrun=None, budget=None, expfilter=None,
+                        detect_renames=False, workers=1, verify=False):
         """
         Initializes a one-way sync from remote into the local experiment data tree.
         """
-        exps = self.Experimentmanager.findLocalExpsPathGdTupByExpid()
-        # exps[expid] = (path, match-group-dict)
+        with self.Profiler.phase('local-parse'):
+            exps = self.Experimentmanager.findLocalExpRecordsByExpid(expfilter=expfilter,
+                                                                     memorybudget=self.MemoryBudget)
+        # exps[expid] = ExpRecord(expid, path, ...)
         satloc = self.Satellitemanager.get(remote)
-        loc_ds = satloc.getSubentryfoldersByExpidSubidx()  # satloc.SubentryfoldersByExpidSubidx    # Use the cached version?
-        # loc_ds[expid][subentry_idx] = subentry_folder
+        with self.Profiler.phase('remote-scan:%s' % remote):
+            loc_ds = satloc.getSubentryRecordsByExpid(matchfilter=expfilter, memorybudget=self.MemoryBudget)
+            # (Not using the cached satloc.SubentryfoldersByExpidSubidx, so large remotes can be spilled to disk.)
+        # loc_ds[expid] = [SubentryRecord(expid, subentry_idx, subentry_folder), ...]
         logger.debug("Local experiments: %s", list(exps.keys()))
         logger.debug("Satellite experiments: %s", loc_ds.keys())
 
-        # Python 3 dict views support '&', '|' and other set-like operators:
-        try:
-            common_expids = exps.keys() & loc_ds.keys()
-        except TypeError:
-            common_expids = exps.viewkeys() & loc_ds.viewkeys() # python 2:
-        if onlyexpids:
-            common_expids = common_expids & set(onlyexpids)
+        with self.Profiler.phase('planning'):
+            # Python 3 dict views support '&', '|' and other set-like operators:
+            try:
+                common_expids = exps.keys() & loc_ds.keys()
+            except TypeError:
+                common_expids = exps.viewkeys() & loc_ds.viewkeys() # python 2:
+            if onlyexpids:
+                common_expids = common_expids & set(onlyexpids)
+            if budget is not None:
+                common_expids = budget.prioritize(remote, common_expids)
         logger.info("Syncing for experiments: %s", common_expids)
         if verbosity > 0:
             print("Syncing experiments: %s" % common_expids)
+        if workers > 1:
+            items = [(expid, record.Path, exps[expid].Path) for expid in sorted(common_expids)
+                     for record in loc_ds[expid]]
+            with self.Profiler.phase('copy'):
+                self.sync_items_parallel(satloc, items, workers, verbosity=verbosity, dryrun=dryrun, verify=verify)
+            return
+        with self.Profiler.phase('copy'):
+            self._sync_subentries(remote, satloc, exps, loc_ds, common_expids, verbosity=verbosity,
+                                  dryrun=dryrun, budget=budget, detect_renames=detect_renames, verify=verify)
+        logger.info("'%s' sync complete.", remote)
+
+    def _sync_subentries(self, remote, satloc, exps, loc_ds, common_expids, verbosity=None, dryrun=None,
+                         budget=None, detect_renames=False, verify=False):
+        """ Syncs the subentry folders for common_expids in-process (the serial part of sync_subentries). """
         for expid in common_expids:
             #exp = exps[expid]
             #localdirpath = exp if isinstance(exp, string_types) else exp.Localdirpath
-            localdirpath, _ = exps[expid]
+            localdirpath = exps[expid].Path
             logger.info("Syncing for exp '%s' (%s)", expid, localdirpath)
-            for subidx, subfolder in loc_ds[expid].items():
-                logger.info("Syncing for subentry %s%s: ('%s' -> '%s')", expid, subidx, subfolder, localdirpath)
-                satloc.syncToLocalDir(subfolder, localdirpath, verbosity=verbosity, dryrun=dryrun)
-        logger.info("'%s' sync complete.", remote)
+            if budget is not None:
+                budget.Current = dict(remote=remote, expid=expid)
+            # One index per experiment, shared by all subentries (the index is only created when needed):
+            renameindex = LocalRenameIndex(localdirpath) if detect_renames else None
+            for record in loc_ds[expid]:
+                subfolder = record.Path
+                logger.info("Syncing for subentry %s%s: ('%s' -> '%s')", expid, record.Subidx, subfolder, localdirpath)
+                if budget is not None and budget.exhausted():
+                    budget.defer(subfolder, localdirpath)
+                    continue
+                satloc.syncToLocalDir(subfolder, localdirpath, verbosity=verbosity, dryrun=dryrun, budget=budget,
+                                      renameindex=renameindex, verify=verify)
+
+
+    def sync_items_parallel(self, satloc, items, workers, verbosity=None, dryrun=None, verify=False):
+        """
+        Syncs items, a list of (expid, satellitepath, localpath) tuples, using a pool of worker processes.
+        Work is sharded by experiment; each worker creates its own satellite location from satloc's locationparams.
+        The merged results are returned, and verification failures are added to satloc.VerifyFailures.
+        """
+        try:
+            from .syncworkers import runShards
+        except (ImportError, SystemError, ValueError):
+            from syncworkers import runShards
+        results = runShards(satloc.LocationParams, items, workers, verbosity=verbosity, dryrun=dryrun, verify=verify,
+                            trace=isTracing())
+        satloc.VerifyFailures.extend(results['verifyfailures'])
+        addEvents(results['traceevents'])
+        logger.info("Parallel sync of '%s' complete: %s shards, %s items, %s bytes copied, %.1f s worker time, %.1f s wall time",
+                    satloc, results['shards'], results['items'], results['bytes_copied'], results['elapsed'], results['walltime'])
+        for expid, satellitepath, localpath, error in results['errors']:
+            print("E\terror   \t %s \t %s \t(%s: %s)" % (satellitepath, localpath, expid, error))
+        if verbosity > 0:
+            print("Synced %(items)s folders from %(shards)s experiments: %(bytes_copied)s bytes copied, "
+                  "%(elapsed).1f s worker time, %(walltime).1f s wall time, %(errors_count)s errors." %
+                  dict(results, errors_count=len(results['errors'])))
+        return results
 
 
-    def check_duplicates(self, local=True, remotes=None, subentries=False, crosscheck=False, rename=False):
+    def check_duplicates(self, local=True, remotes=None, subentries=False, crosscheck=False, rename=False,
+                         workers=8):
         """
         Implementation:
             Just get a list of duplicates, let the user resolve it.
             This is done separately, in ExperimentManager and SatelliteLocation.
             This should be done both for experiments and for subentries.
+        Crosscheck:
+            Each location (local and each remote) is parsed into a compact folder index,
+            index[(expid, subentry_idx)] = ((parentdir, basename), ...), see dirtreeparsing.makeFolderIndex.
+            The remotes are indexed in parallel using up to <workers> threads (directory listing is IO bound).
+            The indexes are then hash-joined with dirtreeparsing.findMismatchingGroups,
+            and only groups where the basenames differ are turned into lists of paths.
         """
         #em = self.ExperimentManager
         #sm = self.SatelliteManager
@@ -206,21 +357,33 @@ class SyncManager(object):
         if crosscheck:
             rightmost = 'subentry' if subentries else 'experiment'
             group = ('expid', 'subentry_idx') if subentries else 'expid'
-            foldersbygroup = self.Experimentmanager.getFoldersWithSameProperty(group=group, rightmost=rightmost)
             if not remotes:
                 remotes = self.Satellitemanager.getLocationsSorted()
-            for remote in remotes.values():
-                for group, folders in remote.getFoldersWithSameProperty(group=group, rightmost=rightmost).items():
-                    # group should be present in local in most cases, so try...except should be optimal:
-                    try:
-                        foldersbygroup[group] += folders
-                    except KeyError:
-                        foldersbygroup[group] = folders
-            # Only for groups with > 2 folders and where the folder's basenames differ:
-            foldersbygroup = {group: folderlist for group, folderlist in foldersbygroup.items()
-                              if len(folderlist) > 1 and len(set(os.path.basename(folder) for folder in folderlist)) > 1}
+            elif not hasattr(remotes, 'values'):
+                # List of remote names, e.g. from the command line:
+                remotes = OrderedDict((name, self.Satellitemanager.get(name)) for name in remotes)
+            remotelocs = list(remotes.values())
+            indexfun = lambda loc: loc.getFolderIndex(group=group, rightmost=rightmost)
+            if ThreadPoolExecutor is not None and workers and len(remotelocs) > 1:
+                with ThreadPoolExecutor(max_workers=min(workers, len(remotelocs))) as executor:
+                    # Index remotes in the background while parsing local; map preserves the order of remotes.
+                    remoteindexes = executor.map(indexfun, remotelocs)
+                    with self.Profiler.phase('local-parse'):
+                        indexes = [self.Experimentmanager.getFolderIndex(group=group, rightmost=rightmost)]
+                    with self.Profiler.phase('remote-scan'):
+                        indexes.extend(remoteindexes)
+            else:
+                with self.Profiler.phase('local-parse'):
+                    indexes = [self.Experimentmanager.getFolderIndex(group=group, rightmost=rightmost)]
+                for loc in remotelocs:
+                    with self.Profiler.phase('remote-scan:%s' % loc.Name):
+                        indexes.append(indexfun(loc))
+            logger.debug("Folder index sizes (local first): %s", [len(index) for index in indexes])
+            # Only groups where the folder's basenames differ:
+            with self.Profiler.phase('planning'):
+                foldersbygroup = findMismatchingGroups(indexes)
             print("\n\n", "-"*80, "\nFolders where local and remote %s differ (or there are duplicates):\n" % ('subentries' if subentries else 'experiments',))
-            for group, paths in sorted(foldersbygroup.items()):
+            for group, paths in foldersbygroup:
                 print("\n{}:\n- {}".format(group, "\n- ".join(paths)))
                 if rename:
                     # This only works for filesystems that works with the standard os module:
@@ -279,9 +442,36 @@ def init_logging(argns):
     #logging.getLogger('__main__').setLevel(logging.INFO)
 
 
-def parseargs():
+def parseargs(argv=None):
+    """ Parse command line arguments (argv, default: sys.argv[1:]). """
     import argparse
 
+    def since_expid_type(value):
+        """ argparse type for --since-expid: must contain an expid number. """
+        if expidIndex(value) < 0:
+            raise argparse.ArgumentTypeError("invalid expid '%s' (expected e.g. 'RS340')" % value)
+        return value
+
+    def since_date_type(value):
+        """ argparse type for --since-date: must be a parsable date. """
+        if parseDate(value) is None:
+            raise argparse.ArgumentTypeError("invalid date '%s' (expected e.g. '20140301' or '2014-03-01')" % value)
+        return value
+
+    def duration_type(value):
+        """ argparse type for --time-budget: a duration, returned in seconds. """
+        try:
+            return parse_duration(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
+    def bytesize_type(value):
+        """ argparse type for --max-bytes and --memory-budget: a byte size, returned in bytes. """
+        try:
+            return parse_bytesize(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
     parser = argparse.ArgumentParser("syncmanager")
 
     # Creating sub-parsers for each command:
@@ -294,6 +484,19 @@ def parseargs():
     parser.add_argument('--dryrun', '-n', action='store_true', help="Print output but do not actually perform sync.")
     parser.add_argument('--loglevel', default='ERROR', help="Default LOG LEVEL to report.", choices=('debug', 'info', 'warning', 'error'))
     parser.add_argument('--logformat', default='time', help="Logging format to use.", choices=('code', 'time'))
+    parser.add_argument('--trace', metavar='FILE', help="Record spans for the main operations (config load, parsing,\
+                        each sync and copy) and write them to FILE as Chrome trace-event JSON (open in chrome://tracing).")
+    parser.add_argument('--profile', metavar='DIR', help="Profile each phase of the run (config load, local parse,\
+                        remote scan, planning, copy) and write profile data and a summary.txt to DIR.")
+    parser.add_argument('--profile-mode', default='cprofile', choices=('cprofile', 'sample'),
+                        help="'cprofile' writes a .pstats file per phase; 'sample' is a low-overhead sampling profiler\
+                        suitable for production runs. (Default: %(default)s)")
+    parser.add_argument('--profile-top', metavar='N', type=int, default=25, help="Number of functions per phase in summary.txt.")
+    parser.add_argument('--memory-report', action='store_true', help="Take tracemalloc snapshots between the phases of the run\
+                        and report the top allocation sites for each phase.")
+    parser.add_argument('--memory-report-top', metavar='N', type=int, default=10, help="Number of allocation sites per phase in the memory report.")
+    parser.add_argument('--memory-budget', metavar='SIZE', type=bytesize_type, help="Memory budget, e.g. '2G'. When the resident memory approaches\
+                        the budget, large intermediate maps (local and remote experiment/subentry folders) are spilled to disk.")
 
 
     # sync command:
@@ -302,6 +505,22 @@ def parseargs():
     subparser.add_argument('remotes', nargs='*', metavar='REMOTE', help="The remotes to synchronize (by keys, as defined in your config).\
                         If omitted, sync all remotes except those where donotsync is set to True.")
     subparser.add_argument('--expids', '-e', nargs='*', help="Sync only for experiments with these Experiment IDs.")
+    subparser.add_argument('--time-budget', metavar='DURATION', type=duration_type, help="Time budget for the sync, e.g. '45m' or '1h30m'.\
+                        Experiments are synced by priority, and no new copies are started if they are estimated to exceed the budget.")
+    subparser.add_argument('--max-bytes', metavar='SIZE', type=bytesize_type, help="Max number of bytes to copy during the sync, e.g. '50G'.")
+    subparser.add_argument('--remainder-file', default=os.path.join('~', '.labfluence', 'sync_remainder.json'),
+                           help="File to write deferred sync items to when using --time-budget or --max-bytes.\
+                        Deferred items from the previous run are synced first. (Default: %(default)s)")
+    subparser.add_argument('--since-expid', metavar='EXPID', type=since_expid_type, help="Only sync experiments with expid at or after EXPID, e.g. 'RS340'.\
+                        Expids are compared by their numeric index, so RS1000 comes after RS340.")
+    subparser.add_argument('--since-date', metavar='DATE', type=since_date_type, help="Only sync year and experiment folders dated at or after DATE,\
+                        e.g. '20140301' or '2014-03-01'. Folders without a date in the name are included.")
+    subparser.add_argument('--last-n-years', metavar='N', type=int, help="Only sync year and experiment folders from the last N years.")
+    subparser.add_argument('--workers', '-j', type=int, default=1, help="Number of worker processes to sync with.\
+                        Work is sharded by experiment. Mostly useful together with --verify, which is CPU bound.")
+    subparser.add_argument('--verify', action='store_true', help="Verify copied files by comparing source and destination digests.")
+    subparser.add_argument('--detect-local-renames', action='store_true', help="Detect new remote files that have been renamed locally\
+                        (same size, modification time and content), and offer to rename the remote file instead of copying it.")
     #subparser.add_argument('--subentries', '-s', action='store_true', help="Sync subentries (rather than experiments).")
     # Edit: subentry vs experiment is determined by the remote satellite_location's pathscheme.
 
@@ -317,7 +536,7 @@ def parseargs():
     subparser.add_argument('--crosscheck', action='store_true', help="Crosscheck local and remote.")
     subparser.add_argument('--rename', action='store_true', help="Rename remotes that does not match local foldername.")
 
-    argns = parser.parse_args()
+    argns = parser.parse_args(argv)
     return argns
 
 
@@ -336,12 +555,13 @@ def main(argns=None):
     ## TODO: Add 'shallow' sync, where you just look at the folder's modification time on remote
         (instead of doing it on a per-file basis)
 
-    ## TODO: Add option to sync experiments with ID larger than a certain value.
-        (Can be done on a simple expid > "RS340" basis because of how python compares strings)
+    ## DONE: Add option to sync experiments with ID larger than a certain value.
+        Use --since-expid RS340 (compared by numeric index, not as strings, since "RS1000" < "RS340").
+        --since-date and --last-n-years can be used to filter by folder dates.
 
     ## TODO: Make 'sync buffer time' (allowable difference between network and local) to be controlled.
 
-    ## TODO: Implement --detect-local-renames
+    ## DONE: Implement --detect-local-renames (see renamedetection module)
         For files:
         1)  Check size (and possibly date stamp) for all files detected as "new",
             and match against existing local files.
@@ -365,33 +585,68 @@ def main(argns=None):
     from confighandler import ExpConfigHandler
     from experimentmanager import ExperimentManager
     from satellite_manager import SatelliteManager
-
-    ch = ExpConfigHandler()
-    em = ExperimentManager(ch)
-    sm = SatelliteManager(ch)
-    syncmgr = SyncManager(em, sm)
+    from syncbudget import SyncBudget
+    from dirtreeparsing import ExpFilter
+    from profiling import PhaseProfiler, ProfilerGroup
+    from memorymonitor import MemoryBudget, MemoryReporter
+    import tracing
 
     #print("argns.verbose:",argns.verbose)
     argns = parseargs()
     init_logging(argns)
-
-
-    #print(argns.__dict__)
-
-
-    if argns.subcommand == 'sync':
-        if argns.verbose:
-            print("%s : Sync started... %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
-                                               "[DRYRUN]" if argns.dryrun else ""))
-        logger.info("Syncing remote '%s' to local data tree...", argns.remotes)
-        syncmgr.sync_remotes(argns.remotes, onlyexpids=argns.expids, verbosity=argns.verbose, dryrun=argns.dryrun)
-        if argns.verbose:
-            print("\n%s : Sync completed!" %  time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
-        logger.info("Sync from '%s' complete!", argns.remotes)
-
-    elif argns.subcommand == 'checkduplicates':
-        syncmgr.check_duplicates(local=argns.local, remotes=argns.remotes, subentries=argns.subentries,
-                                 crosscheck=argns.crosscheck, rename=argns.rename)
+    if argns.trace:
+        tracing.enableTracing()
+
+    phaseprofiler = PhaseProfiler(argns.profile, mode=argns.profile_mode, topn=argns.profile_top) \
+                    if argns.profile else None
+    memoryreporter = MemoryReporter(topn=argns.memory_report_top) if argns.memory_report else None
+    profiler = ProfilerGroup(*[p for p in (phaseprofiler, memoryreporter) if p is not None])
+    memorybudget = MemoryBudget(argns.memory_budget) if argns.memory_budget else None
+    try:
+        with profiler.phase('config-load'):
+            ch = ExpConfigHandler()
+            em = ExperimentManager(ch)
+            sm = SatelliteManager(ch)
+        syncmgr = SyncManager(em, sm, profiler=profiler, memorybudget=memorybudget)
+
+        #print(argns.__dict__)
+
+        if argns.subcommand == 'sync':
+            if argns.verbose:
+                print("%s : Sync started... %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+                                                   "[DRYRUN]" if argns.dryrun else ""))
+            logger.info("Syncing remote '%s' to local data tree...", argns.remotes)
+            budget = None
+            if argns.time_budget or argns.max_bytes:
+                # --time-budget and --max-bytes are parsed by argparse (seconds and bytes):
+                budget = SyncBudget(time_budget=argns.time_budget, max_bytes=argns.max_bytes,
+                                    remainderfile=argns.remainder_file)
+            expfilter = ExpFilter(since_expid=argns.since_expid, since_date=argns.since_date,
+                                  last_n_years=argns.last_n_years)
+            if expfilter:
+                logger.info("Using experiment filter: %s", expfilter)
+            syncmgr.sync_remotes(argns.remotes, onlyexpids=argns.expids, verbosity=argns.verbose, dryrun=argns.dryrun,
+                                 budget=budget, expfilter=expfilter or None, detect_renames=argns.detect_local_renames,
+                                 workers=argns.workers, verify=argns.verify)
+            if argns.verbose:
+                print("\n%s : Sync completed!" %  time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
+            logger.info("Sync from '%s' complete!", argns.remotes)
+
+        elif argns.subcommand == 'checkduplicates':
+            syncmgr.check_duplicates(local=argns.local, remotes=argns.remotes, subentries=argns.subentries,
+                                     crosscheck=argns.crosscheck, rename=argns.rename)
+
+    finally:
+        # Also write the trace, profile and memory report if the run failed; that is often when they are needed.
+        if argns.trace:
+            print("Trace written to %s" % tracing.writeTrace(argns.trace))
+        if phaseprofiler:
+            summaryfile = phaseprofiler.finish()
+            print("Profile written to %s (summary: %s)" % (argns.profile, summaryfile))
+        if memoryreporter:
+            memoryreporter.finish()
+        if memorybudget:
+            print("Peak memory usage: %.1f MB (budget: %.1f MB)" % (memorybudget.PeakRSS/1024.0**2, memorybudget.MaxBytes/1024.0**2))
 
 
 
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Module for running sync work in a pool of worker processes.
+
+When copies are verified (--verify), the sync is CPU bound by hashing, and a single
+SyncManager thread only uses one core. With --workers N, SyncManager instead makes a sync plan
+with one (expid, satellitepath, localpath) item per experiment folder or subentry folder,
+and the plan is sharded by experiment, so that all subentries of an experiment are synced
+by the same worker (and no two workers write to the same local experiment folder).
+
+Each worker process creates its own SatelliteLocation from the location's locationparams dict
+(satellite location objects, with caches and a manager, are not sent between processes).
+The location is made once per worker process, by the pool initializer, and used for all the shards
+that the worker syncs, so e.g. ensureMount is not run for every experiment.
+Each shard returns a result dict with metrics, and the results are merged in the parent process
+with mergeShardResults.
+
+"""
+from __future__ import print_function
+import time
+import multiprocessing
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    from .syncbudget import SyncBudget
+    from . import tracing
+except (ImportError, SystemError, ValueError):
+    # If the module is run from the labfluence_sync directory (as syncmanager.main() does), we cannot do relative imports.
+    from syncbudget import SyncBudget
+    import tracing
+
+# The satellite location of a worker process, made once by initWorker:
+_workerlocation = None
+
+
+def makeLocation(locationparams, factory=None):
+    """ Makes a satellite location from locationparams with factory (default: satellite_location.location_factory). """
+    if factory is None:
+        try:
+            from .satellite_location import location_factory as factory
+        except (ImportError, SystemError, ValueError):
+            from satellite_location import location_factory as factory
+    return factory(locationparams)
+
+
+def initWorker(locationparams, factory=None):
+    """ Pool initializer: makes the worker process's satellite location, used by syncShard for all shards. """
+    global _workerlocation     # pylint: disable=W0603
+    _workerlocation = makeLocation(locationparams, factory)
+
+
+def shardByExperiment(items):
+    """
+    Groups sync items (expid, satellitepath, localpath) by expid.
+    Returns a list of (expid, [items]) tuples, in the order the expids first appear in items.
+    """
+    shards = []
+    shardsbyexpid = {}
+    for item in items:
+        expid = item[0]
+        if expid not in shardsbyexpid:
+            shardsbyexpid[expid] = []
+            shards.append((expid, shardsbyexpid[expid]))
+        shardsbyexpid[expid].append(item)
+    return shards
+
+
+def syncShard(shard, satloc=None):
+    """
+    Worker function. Syncs all items in a single shard (experiment) and returns a result dict.
+    shard is a tuple of (locationparams, expid, items, options), where options is a dict
+    with verbosity, dryrun, verify and trace.
+    The items are synced with satloc, or the worker's location (see initWorker); a location is only
+    made from locationparams if there is neither.
+    If trace is True, spans recorded by the worker are returned as 'traceevents'.
+    Must be a module-level function, so it can be pickled and sent to the worker processes.
+    """
+    locationparams, expid, items, options = shard
+    starttime = time.time()
+    if options.get('trace'):
+        # A worker process can handle several shards; only return events from this shard.
+        tracing.enableTracing()
+        tracing.clearEvents()
+    satloc = satloc or _workerlocation or makeLocation(locationparams)
+    nverifyfailures = len(satloc.VerifyFailures)    # The location is shared by the worker's shards.
+    # A budget without limits is just used to record bytes and copy time for the shard:
+    metrics = SyncBudget()
+    errors = []
+    for _, satellitepath, localpath in items:
+        metrics.Current = dict(remote=locationparams.get('name'), expid=expid)
+        try:
+            satloc.syncToLocalDir(satellitepath, localpath, verbosity=options.get('verbosity'),
+                                  dryrun=options.get('dryrun'), budget=metrics, verify=options.get('verify'))
+        except Exception as e:     # pylint: disable=W0703
+            # Report the error for this item and continue with the rest of the shard:
+            logger.error("Error syncing %s -> %s: %r", satellitepath, localpath, e)
+            errors.append((expid, satellitepath, localpath, "%s: %s" % (type(e).__name__, e)))
+    return dict(expids=[expid], items=len(items), bytes_copied=metrics.BytesCopied, copytime=metrics.CopyTime,
+                elapsed=time.time() - starttime, errors=errors, verifyfailures=satloc.VerifyFailures[nverifyfailures:],
+                traceevents=tracing.getEvents() if options.get('trace') else [])
+
+
+def mergeShardResults(results):
+    """ Merges a sequence of shard result dicts into a single result dict. """
+    merged = dict(expids=[], items=0, bytes_copied=0, copytime=0.0, elapsed=0.0, errors=[], verifyfailures=[],
+                  traceevents=[])
+    for result in results:
+        for key, value in result.items():
+            merged[key] += value
+    merged['expids'].sort()
+    merged['shards'] = len(merged['expids'])
+    return merged
+
+
+def runShards(locationparams, items, workers, verbosity=0, dryrun=False, verify=False, trace=False, factory=None):
+    """
+    Syncs items (expid, satellitepath, localpath) using a pool of <workers> processes
+    (or in this process, shard by shard, if workers is 1).
+    Each worker makes a single satellite location with factory(locationparams) (default: location_factory).
+    Returns merged results, see mergeShardResults. 'elapsed' is the total time spent by all workers,
+    'walltime' is the time spent in this function.
+    """
+    starttime = time.time()
+    options = dict(verbosity=verbosity, dryrun=dryrun, verify=verify, trace=trace)
+    shards = [(locationparams, expid, shard, options) for expid, shard in shardByExperiment(items)]
+    if not shards:
+        return dict(mergeShardResults([]), walltime=0.0)
+    workers = min(workers, len(shards))
+    if workers <= 1:
+        satloc = makeLocation(locationparams, factory)
+        results = [syncShard(shard, satloc) for shard in shards]
+        return dict(mergeShardResults(results), walltime=time.time() - starttime)
+    logger.info("Syncing %s items in %s shards using %s worker processes", len(items), len(shards), workers)
+    pool = multiprocessing.Pool(processes=workers, initializer=initWorker, initargs=(locationparams, factory))
+    try:
+        # Experiments differ a lot in size, so hand out one shard at a time:
+        results = list(pool.imap_unordered(syncShard, shards, chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
+    return dict(mergeShardResults(results), walltime=time.time() - starttime)
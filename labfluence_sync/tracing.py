@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301,W0603
+"""
+
+Lightweight tracing of the main operations, exported as Chrome trace-event JSON.
+
+Where the profiling module tells you which functions use the CPU, a trace shows what happens
+when: Which folders are synced, how long each copy takes, and where a run is waiting
+(e.g. for a slow network mount). Usage:
+
+    import tracing
+    tracing.enableTracing()
+    with tracing.span('sync', remote='nanodrop'):
+        ...
+    @tracing.traced('ExperimentManager.findLocalExpsPathGdTupByExpid')
+    def findLocalExpsPathGdTupByExpid(self, ...):
+        ...
+    tracing.writeTrace('sync-trace.json')
+
+Open the json file in chrome://tracing or https://ui.perfetto.dev to see the spans as a timeline
+with one row per process and thread.
+Spans are recorded as 'complete' events (ph='X') with timestamps in microseconds.
+
+Tracing is disabled by default. When disabled, span() and traced functions only check a module-level flag.
+
+"""
+from __future__ import print_function
+import os
+import json
+import time
+import threading
+import functools
+import inspect
+from contextlib import contextmanager
+import logging
+logger = logging.getLogger(__name__)
+
+
+_enabled = False
+_events = []        # list.append is atomic, so spans from several threads can be recorded without a lock.
+
+
+def enableTracing(enable=True):
+    """ Enable (or disable) recording of spans. """
+    global _enabled
+    _enabled = enable
+
+
+def isTracing():
+    """ Returns True if spans are currently being recorded. """
+    return _enabled
+
+
+def _now():
+    """ Current time in microseconds, as used by the trace-event format. """
+    return time.time()*1e6
+
+
+@contextmanager
+def span(name, cat='labfluence', **args):
+    """
+    Context manager; records the with block as a span named <name>.
+    Keyword arguments are included as the span's args (and must be json serializable).
+    """
+    if not _enabled:
+        yield
+        return
+    start = _now()
+    try:
+        yield
+    finally:
+        _events.append({'name': name, 'cat': cat, 'ph': 'X', 'ts': start, 'dur': _now() - start,
+                        'pid': os.getpid(), 'tid': threading.current_thread().ident, 'args': args})
+
+
+def traced(name=None, cat='labfluence', argnames=()):
+    """
+    Decorator; records each call to the decorated function as a span.
+    name defaults to the function's name.
+    argnames can be used to include some of the function's arguments in the span's args, e.g.
+        @traced('syncToLocalDir', argnames=('satellitepath', 'localpath'))
+    """
+    def decorator(func):
+        spanname = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            spanargs = {}
+            if argnames:
+                callargs = inspect.getcallargs(func, *args, **kwargs)
+                spanargs = {argname: callargs.get(argname) for argname in argnames}
+            with span(spanname, cat=cat, **spanargs):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def getEvents():
+    """ Returns (a copy of) the list of recorded events. """
+    return list(_events)
+
+
+def addEvents(events):
+    """ Adds events recorded elsewhere, e.g. by worker processes. """
+    _events.extend(events)
+
+
+def clearEvents():
+    """ Removes all recorded events. """
+    del _events[:]
+
+
+def writeTrace(filepath):
+    """
+    Writes the recorded events to filepath in the Chrome trace-event JSON format.
+    Thread names are added as metadata events, so the threads are labelled in the timeline.
+    """
+    events = list(_events)
+    threadnames = {thread.ident: thread.name for thread in threading.enumerate()}
+    metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                 'args': {'name': threadnames.get(tid, 'thread-%s' % tid) if pid == os.getpid() else 'worker-%s' % pid}}
+                for pid, tid in sorted(set((event['pid'], event['tid']) for event in events))]
+    filepath = os.path.expanduser(filepath)
+    dirname = os.path.dirname(filepath)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(filepath, 'w') as fd:
+        json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, fd)
+    logger.info("Wrote %s trace events to %s", len(events), filepath)
+    return filepath
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+Batched, concurrent fetching of wiki pages and attachment lists.
+
+Merging wiki experiments, parsing wiki subentries and listing attachments each call the server
+one page at a time, so with many active experiments most of the time is spent waiting for round trips.
+The WikiFetchPool fetches page structs and attachment lists for many page ids concurrently:
+
+    pool = WikiFetchPool(server, maxconnections=4)
+    results = pool.fetch(pageids)       # {pageid: {'page': pagestruct, 'attachments': [attachment structs]}}
+
+Connections:
+    An XML-RPC ServerProxy can only be used by one thread at a time, so the pool keeps up to
+    <maxconnections> server clients, each used by one worker thread at a time and reused for
+    the following calls. The xmlrpc Transport keeps its HTTP/1.1 connection open between calls,
+    so each pooled client is a keep-alive connection.
+    Clients are made with clientfactory(). By default this is server.clone() if the server object
+    has a clone method; otherwise, if the server has an XML-RPC endpoint (AppUrl) and a login token
+    (Logintoken), each client is an XmlRpcClient with its own ServerProxy for that endpoint and token.
+    Only if neither is available, the single server object is shared and maxconnections is 1
+    (pages are still fetched in one batch, with retries, but one at a time).
+
+Retries:
+    Connection errors and HTTP protocol errors are retried up to <retries> times, waiting
+    backoff, 2*backoff, 4*backoff, ... seconds between attempts. XML-RPC Faults (e.g. the page
+    does not exist or permission denied) are not retried; the result for that page is None.
+
+"""
+from __future__ import print_function
+import time
+import socket
+import threading
+import logging
+logger = logging.getLogger(__name__)
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None     # python 2 without the futures backport; fetch serially.
+try:
+    from xmlrpc.client import Fault, ProtocolError, ServerProxy
+except ImportError:
+    from xmlrpclib import Fault, ProtocolError, ServerProxy     # python 2
+
+# Errors that are likely to be transient, and where the call is retried:
+RETRY_ERRORS = (socket.error, socket.timeout, ProtocolError, IOError)
+
+
+class XmlRpcClient(object):
+    """
+    Minimal client for the Confluence XML-RPC API, with the getPage and getAttachments methods
+    used by the WikiFetchPool. Each client has its own ServerProxy (i.e. its own connection),
+    and uses the login token of an already logged-in server object.
+
+    Args:
+        :appurl:    URL of the XML-RPC endpoint, e.g. https://wiki.example.com/rpc/xmlrpc
+        :token:     Login token.
+        :api:       The XML-RPC API namespace ('confluence2' for Confluence 4+).
+    """
+
+    def __init__(self, appurl, token, api='confluence2'):
+        self.AppUrl = appurl
+        self.Token = token
+        self._api = getattr(ServerProxy(appurl, allow_none=True), api)
+
+    def __repr__(self):
+        return "XmlRpcClient('%s')" % self.AppUrl
+
+    def getPage(self, pageId):
+        """ Returns the pagestruct for pageId. """
+        return self._api.getPage(self.Token, str(pageId))
+
+    def getAttachments(self, pageId):
+        """ Returns a list of attachment structs for page pageId. """
+        return self._api.getAttachments(self.Token, str(pageId))
+
+
+def makeClientFactory(server):
+    """
+    Returns a callable that makes new clients for server (see the module docstring),
+    or None if server can neither be cloned nor has an XML-RPC endpoint and login token.
+    """
+    if hasattr(server, 'clone'):
+        return server.clone
+    if getattr(server, 'AppUrl', None) and getattr(server, 'Logintoken', None):
+        # The token is read when each client is made, in case the server has logged in again:
+        return lambda: XmlRpcClient(server.AppUrl, server.Logintoken)
+    return None
+
+
+class WikiFetchPool(object):
+    """
+    Pool of server clients for concurrent wiki page and attachment list fetching, see module docstring.
+
+    Args:
+        :server:            The server object (with getPage and getAttachments methods).
+        :maxconnections:    Max number of clients, i.e. max number of concurrent requests.
+        :retries:           Max number of retries for each call.
+        :backoff:           Wait before the first retry (seconds), doubled for each retry.
+        :clientfactory:     Callable returning a new server client. Default is made with makeClientFactory(server).
+    """
+
+    def __init__(self, server, maxconnections=4, retries=3, backoff=0.5, clientfactory=None):
+        self.Server = server
+        self.Retries = retries
+        self.Backoff = backoff
+        if clientfactory is None:
+            clientfactory = makeClientFactory(server)
+        if clientfactory is None:
+            logger.debug("Cannot make clients for server %s, using a single connection.", server)
+            maxconnections = 1
+        self.ClientFactory = clientfactory
+        self.MaxConnections = maxconnections
+        self._idle = [server] if clientfactory is None else []
+        self._nclients = len(self._idle)
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return "WikiFetchPool(%s clients, max %s)" % (self._nclients, self.MaxConnections)
+
+    def _acquireClient(self):
+        """ Returns an idle client, making a new one if below MaxConnections, otherwise waits for one. """
+        with self._cond:
+            while not self._idle and self._nclients >= self.MaxConnections:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._nclients += 1
+        try:
+            return self.ClientFactory()
+        except Exception:
+            with self._cond:
+                self._nclients -= 1
+                self._cond.notify()
+            raise
+
+    def _releaseClient(self, client):
+        """ Returns client to the pool. """
+        with self._cond:
+            self._idle.append(client)
+            self._cond.notify()
+
+    def call(self, methodname, *args):
+        """
+        Calls server method <methodname> with args using a pooled client, retrying transient errors.
+        Returns the result, or None if the call failed.
+        """
+        for attempt in range(self.Retries + 1):
+            client = self._acquireClient()
+            try:
+                return getattr(client, methodname)(*args)
+            except Fault as e:
+                logger.info("%s%s failed: %s", methodname, args, e)
+                return None
+            except RETRY_ERRORS as e:
+                if attempt == self.Retries:
+                    logger.warning("%s%s failed after %s attempts: %s", methodname, args, attempt + 1, e)
+                    return None
+                wait = self.Backoff * 2**attempt
+                logger.debug("%s%s failed (%s), retrying in %s s", methodname, args, e, wait)
+            finally:
+                self._releaseClient(client)
+            time.sleep(wait)
+
+    def callMany(self, calls):
+        """
+        Makes calls concurrently, using up to MaxConnections clients.
+        calls is a list of (methodname, args) tuples. Returns a list with the results (in order).
+        """
+        calls = list(calls)
+        def call(methodargs):
+            """ Make a single (methodname, args) call. """
+            return self.call(methodargs[0], *methodargs[1])
+        if ThreadPoolExecutor is None or self.MaxConnections < 2 or len(calls) < 2:
+            return [call(methodargs) for methodargs in calls]
+        with ThreadPoolExecutor(max_workers=min(self.MaxConnections, len(calls))) as executor:
+            return list(executor.map(call, calls))
+
+    def fetchPages(self, pageids):
+        """ Returns {pageid: pagestruct} for pageids (pagestruct is None if the page could not be fetched). """
+        return {pageid: result['page'] for pageid, result in self.fetch(pageids, attachments=False).items()}
+
+    def fetchAttachments(self, pageids):
+        """ Returns {pageid: list of attachment structs} for pageids (None if the list could not be fetched). """
+        return {pageid: result['attachments'] for pageid, result in self.fetch(pageids, pages=False).items()}
+
+    def fetch(self, pageids, pages=True, attachments=True):
+        """
+        Fetches page structs and/or attachment lists for pageids in one batch (all calls share the pool).
+        Returns {pageid: {'page': pagestruct, 'attachments': [attachment structs]}}.
+        """
+        pageids = list(pageids)
+        calls = ([('getPage', (pageid, )) for pageid in pageids] if pages else []) \
+                + ([('getAttachments', (pageid, )) for pageid in pageids] if attachments else [])
+        starttime = time.time()
+        values = self.callMany(calls)
+        results = {pageid: dict(page=None, attachments=None) for pageid in pageids}
+        for (methodname, args), value in zip(calls, values):
+            results[args[0]]['page' if methodname == 'getPage' else 'attachments'] = value
+        logger.info("Made %s wiki calls for %s pages in %.2f s using %s connections.",
+                    len(calls), len(pageids), time.time() - starttime, self._nclients)
+        return results
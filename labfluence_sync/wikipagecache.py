@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+# pylint: disable=C0103,C0301
+"""
+
+On-disk cache of wiki pages, keyed by page id and version.
+
+Every start of labfluence lists the children of the wiki experiment root page
+(Server.getChildren), and each experiment's WikiPage may then fetch the full page content.
+The WikiPageCache keeps full pagestructs on disk, so that a page only has to be
+fetched again if its version has changed:
+
+    cache = WikiPageCache('~/.Labfluence/wikipagecache')
+    children = cache.listChildren(server, rootpageid)   # One listing, outdated pages are dropped from the cache.
+    pagestruct = cache.getPage(pageid, version)         # Cached pagestruct, or None if not cached/outdated.
+    cache.putPage(pagestruct)                           # After fetching a page from the server.
+
+The cache directory has an index.json with the cached page versions and the last child listing
+of each parent page (used if the server is not available), and one <pageid>.json file per page.
+
+Revalidation requires page versions in the child listing, and the XML-RPC getChildren page summaries
+do not have a version. listChildren therefore lists the children with their versions using
+    server.getChildrenWithVersions(pageid), if the server object has that method, otherwise
+    the REST API, GET <BaseUrl>/rest/api/content/<pageid>/child/page?expand=version, if the server
+    object has a BaseUrl and an (authenticated) UrlOpener, otherwise
+    server.getChildren(pageid), without versions.
+A cached page is only returned for a known, matching version; pages without a version in the
+listing are fetched again. (getPage(pageid, allowstale=True) returns the cached page regardless
+of version, for use when the server is not available.)
+
+"""
+from __future__ import print_function
+import os
+import json
+import time
+import threading
+import logging
+logger = logging.getLogger(__name__)
+try:
+    from urllib.request import Request
+    from urllib.parse import urljoin
+except ImportError:
+    from urllib2 import Request     # python 2
+    from urlparse import urljoin
+
+REST_PAGE_LIMIT = 200
+
+
+def listChildrenWithVersions(server, pageid, limit=REST_PAGE_LIMIT):
+    """
+    Lists the child pages of pageid with their versions using the REST API (paginated, <limit> per request).
+    Returns a list of page summaries (dicts with id, title, parentId and version), like getChildren,
+    or None if the server object has no BaseUrl and UrlOpener (the REST API needs an authenticated opener).
+    """
+    baseurl, opener = getattr(server, 'BaseUrl', None), getattr(server, 'UrlOpener', None)
+    if not baseurl or opener is None:
+        return None
+    baseurl = baseurl.rstrip('/') + '/'
+    children = []
+    start = 0
+    while True:
+        url = urljoin(baseurl, 'rest/api/content/%s/child/page?expand=version&limit=%s&start=%s' % (pageid, limit, start))
+        response = opener.open(Request(url, headers={'Accept': 'application/json'}))
+        try:
+            result = json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+        pages = result.get('results', [])
+        children.extend(dict(id=str(page['id']), title=page.get('title'), parentId=str(pageid),
+                             version=str(page.get('version', {}).get('number')) if page.get('version') else None)
+                        for page in pages)
+        if len(pages) < limit or not result.get('_links', {}).get('next'):
+            return children
+        start += len(pages)
+
+
+class WikiPageCache(object):
+    """
+    On-disk cache of wiki pagestructs keyed by (page id, version), see module docstring.
+
+    Args:
+        :cachedir:  Directory to store the cache in (created if needed).
+    """
+
+    def __init__(self, cachedir):
+        self.Cachedir = os.path.expanduser(cachedir)
+        self.Versions = {}      # pageid -> (version, time cached)
+        self.Children = {}      # parent pageid -> list of page summaries (from last listing)
+        self._lock = threading.Lock()
+        self.loadIndex()
+
+    def __repr__(self):
+        return "WikiPageCache('%s', %s pages)" % (self.Cachedir, len(self.Versions))
+
+    def _indexpath(self):
+        return os.path.join(self.Cachedir, 'index.json')
+
+    def _pagepath(self, pageid):
+        return os.path.join(self.Cachedir, '%s.json' % "".join(c for c in str(pageid) if c.isalnum()))
+
+    def loadIndex(self):
+        """ Loads the cache index. A missing or broken index just gives an empty cache. """
+        try:
+            with open(self._indexpath()) as fd:
+                index = json.load(fd)
+        except (IOError, OSError, ValueError) as e:
+            logger.debug("Could not load wiki page cache index: %s", e)
+            return
+        with self._lock:
+            self.Versions = {pageid: tuple(versiontime) for pageid, versiontime in index.get('versions', {}).items()}
+            self.Children = index.get('children', {})
+
+    def saveIndex(self):
+        """ Saves the cache index (via a temporary file). """
+        if not os.path.isdir(self.Cachedir):
+            os.makedirs(self.Cachedir)
+        with self._lock:
+            index = dict(versions=self.Versions, children=self.Children)
+            tmppath = self._indexpath() + '.tmp'
+            with open(tmppath, 'w') as fd:
+                json.dump(index, fd, default=str)
+            if os.path.exists(self._indexpath()):
+                os.remove(self._indexpath())
+            os.rename(tmppath, self._indexpath())
+
+    def isValid(self, pageid, version):
+        """
+        True if the cached page is current, i.e. has the given version.
+        Always False if version is None (unknown), since the page may have been edited.
+        """
+        cached = self.Versions.get(str(pageid))
+        if cached is None or version is None:
+            return False
+        return str(cached[0]) == str(version)
+
+    def getPage(self, pageid, version=None, allowstale=False):
+        """
+        Returns the cached pagestruct for pageid if it has the given version (see isValid), otherwise None.
+        If allowstale is True, the cached pagestruct is returned regardless of version (e.g. when offline).
+        """
+        if not (self.isValid(pageid, version) or (allowstale and str(pageid) in self.Versions)):
+            return None
+        try:
+            with open(self._pagepath(pageid)) as fd:
+                return json.load(fd)
+        except (IOError, OSError, ValueError) as e:
+            logger.debug("Could not read cached page %s: %s", pageid, e)
+            self.invalidate(pageid)
+            return None
+
+    def putPage(self, pagestruct, saveindex=True):
+        """ Adds a full pagestruct (with 'id' and 'version') to the cache. Thread safe. """
+        pageid = str(pagestruct['id'])
+        if not os.path.isdir(self.Cachedir):
+            os.makedirs(self.Cachedir)
+        tmppath = self._pagepath(pageid) + '.%s.tmp' % threading.current_thread().ident
+        with open(tmppath, 'w') as fd:
+            json.dump(pagestruct, fd, default=str)
+        if os.path.exists(self._pagepath(pageid)):
+            os.remove(self._pagepath(pageid))
+        os.rename(tmppath, self._pagepath(pageid))
+        with self._lock:
+            self.Versions[pageid] = (pagestruct.get('version'), time.time())
+        if saveindex:
+            self.saveIndex()
+
+    def invalidate(self, pageid):
+        """ Removes a page from the cache. """
+        pageid = str(pageid)
+        with self._lock:
+            self.Versions.pop(pageid, None)
+        try:
+            os.remove(self._pagepath(pageid))
+        except OSError:
+            pass
+
+    def revalidate(self, pagesummaries):
+        """
+        Drops cached pages whose version differs from the version in pagesummaries.
+        Returns a list of the page ids that are not cached with the listed version, i.e. need to be fetched.
+        Pages without a version in pagesummaries are included, but are not dropped from the cache.
+        """
+        stale = []
+        for summary in pagesummaries:
+            pageid = str(summary['id'])
+            if not self.isValid(pageid, summary.get('version')):
+                if pageid in self.Versions and summary.get('version') is not None:
+                    logger.debug("Cached wiki page %s is outdated (version %s -> %s)",
+                                 pageid, self.Versions[pageid][0], summary.get('version'))
+                    self.invalidate(pageid)
+                stale.append(pageid)
+        return stale
+
+    def listChildren(self, server, pageid):
+        """
+        Lists the children of page <pageid> with their versions (see module docstring) and revalidates the
+        cached children. If the server is not available, the last cached listing is returned.
+        """
+        pageid = str(pageid)
+        children = None
+        if server:
+            if hasattr(server, 'getChildrenWithVersions'):
+                children = server.getChildrenWithVersions(pageid)
+            else:
+                try:
+                    children = listChildrenWithVersions(server, pageid)
+                except (IOError, OSError, ValueError) as e:
+                    logger.info("Could not list children of wiki page %s with versions using the REST API: %s", pageid, e)
+                if children is None:
+                    logger.debug("Listing children of wiki page %s without versions; cached pages will be refetched.", pageid)
+                    children = server.getChildren(pageid)
+        if not children:
+            if pageid in self.Children:
+                logger.info("Could not list children of wiki page %s, using cached listing.", pageid)
+            return self.Children.get(pageid)
+        stale = self.revalidate(children)
+        logger.debug("Listed %s children of wiki page %s, %s not cached or outdated.", len(children), pageid, len(stale))
+        with self._lock:
+            self.Children[pageid] = children
+        self.saveIndex()
+        return children
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures: the labfluence_sync modules import each other by plain module name,
+so the package directory is put on sys.path, and local stand-in servers for the wiki.
+"""
+import os
+import sys
+import threading
+import pytest
+try:
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+    from xmlrpc.client import ServerProxy
+except ImportError:
+    from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler  # python 2
+    from xmlrpclib import ServerProxy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'labfluence_sync'))
+
+
+class QuietRequestHandler(SimpleXMLRPCRequestHandler):
+    """ XML-RPC request handler that does not log requests to stderr. """
+    def log_message(self, *args):   # pylint: disable=W0221
+        pass
+
+
+class StandInWiki(object):
+    """
+    In-memory wiki with the XML-RPC methods used by labfluence (getChildren, getPage, getAttachments).
+    Pages are dicts with id, title, parentId, version and content.
+    """
+    def __init__(self, pages=None):
+        self.Pages = {str(page['id']): dict(page) for page in (pages or [])}
+        self.Attachments = {}   # pageid -> list of attachment structs
+        self.Calls = []
+
+    def getChildren(self, pageid):
+        self.Calls.append(('getChildren', pageid))
+        # PageSummary structs do not have a version:
+        return [dict(id=page['id'], title=page['title'], parentId=page['parentId'])
+                for page in self.Pages.values() if page['parentId'] == str(pageid)]
+
+    def getPage(self, pageid):
+        self.Calls.append(('getPage', pageid))
+        return self.Pages[str(pageid)]
+
+    def getAttachments(self, pageid):
+        self.Calls.append(('getAttachments', pageid))
+        return self.Attachments.get(str(pageid), [])
+
+
+class StandInServer(object):
+    """ Client for the stand-in XML-RPC server, with the method signatures of the labfluence server object. """
+    def __init__(self, url):
+        self.Url = url
+        self.Proxy = ServerProxy(url)
+
+    def getChildren(self, pageid):
+        return self.Proxy.getChildren(pageid)
+
+    def getPage(self, pageId=None, **kwargs):  # pylint: disable=W0613
+        return self.Proxy.getPage(pageId)
+
+    def getAttachments(self, pageid):
+        return self.Proxy.getAttachments(pageid)
+
+    def clone(self):
+        return StandInServer(self.Url)
+
+
+@pytest.fixture
+def xmlrpc_server():
+    """
+    Factory fixture: xmlrpc_server(instance) serves instance's methods on a local port (in a thread,
+    handling several requests concurrently) and returns the url. Servers are shut down after the test.
+    """
+    servers = []
+    def start(instance):
+        class ThreadedServer(SimpleXMLRPCServer):
+            """ Handles each request in a new thread. """
+            daemon_threads = True
+            def process_request(self, request, client_address):
+                thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+                thread.daemon = True
+                thread.start()
+            def process_request_thread(self, request, client_address):
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:   # pylint: disable=W0703
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+        server = ThreadedServer(('127.0.0.1', 0), requestHandler=QuietRequestHandler, logRequests=False, allow_none=True)
+        server.register_instance(instance)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+        return 'http://127.0.0.1:%s/' % server.server_address[1]
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
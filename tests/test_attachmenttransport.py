@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+""" Tests for attachmenttransport.StreamingAttachmentTransport, against a local stand-in HTTP server. """
+import os
+import re
+import json
+import hashlib
+import threading
+import pytest
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler  # python 2
+    from urlparse import urlparse, parse_qs
+
+from attachmenttransport import StreamingAttachmentTransport
+
+
+class StandInAttachmentHandler(BaseHTTPRequestHandler):
+    """
+    Serves the attachment REST endpoints from server.Attachments (pageid -> {filename: (attachmentid, bytes)}).
+    Uploads are recorded in server.Uploads as (path, fields) with fields parsed from the multipart body.
+    """
+    def log_message(self, *args):   # pylint: disable=W0221
+        pass
+
+    def _send(self, body, status=200, length=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body) if length is None else length))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        match = re.match(r'/download/attachments/(\w+)/(.+)$', parsed.path)
+        if match:
+            _, data = self.server.Attachments[match.group(1)][match.group(2)]
+            # Truncated responses announce the full length but send less:
+            self._send(data[:self.server.Truncate] if self.server.Truncate else data)
+            return
+        match = re.match(r'/rest/api/content/(\w+)/child/attachment$', parsed.path)
+        filename = parse_qs(parsed.query).get('filename', [None])[0]
+        atts = self.server.Attachments.get(match.group(1), {})
+        results = [dict(id=attid, title=name) for name, (attid, _) in atts.items() if name == filename]
+        self._send(json.dumps(dict(results=results)).encode('utf-8'))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        boundary = self.headers['Content-Type'].split('boundary=')[1].encode('ascii')
+        fields = {}
+        for part in body.split(b'--' + boundary)[1:-1]:
+            head, content = part[2:-2].split(b'\r\n\r\n', 1)
+            fields[re.search(br'name="(\w+)"', head).group(1).decode('ascii')] = content
+        self.server.Uploads.append((self.path, fields))
+        self._send(json.dumps(dict(results=[dict(id='att9', title='data.bin')])).encode('utf-8'))
+
+
+@pytest.fixture
+def http_server():
+    server = HTTPServer(('127.0.0.1', 0), StandInAttachmentHandler)
+    server.Attachments = {}
+    server.Uploads = []
+    server.Truncate = None
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.Url = 'http://127.0.0.1:%s' % server.server_address[1]
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_chunked_download(http_server, tmpdir):
+    data = os.urandom(10000)
+    http_server.Attachments['123'] = {'data.bin': ('att1', data)}
+    transport = StreamingAttachmentTransport(http_server.Url, chunksize=1024)
+    filepath = str(tmpdir.join('data.bin'))
+    progress = []
+    nbytes, hexdigest = transport.download(dict(url='/download/attachments/123/data.bin', fileSize=str(len(data))),
+                                           filepath, progress=lambda n, total: progress.append((n, total)))
+    assert nbytes == len(data)
+    assert hexdigest == hashlib.md5(data).hexdigest()
+    assert open(filepath, 'rb').read() == data
+    assert not os.path.exists(filepath + '.part')
+    assert len(progress) == 10 and progress[-1] == (len(data), len(data))
+
+
+def test_incomplete_download_keeps_existing_file(http_server, tmpdir):
+    http_server.Attachments['123'] = {'data.bin': ('att1', b'x' * 1000)}
+    http_server.Truncate = 500
+    filepath = tmpdir.join('data.bin')
+    filepath.write_binary(b'old content')
+    transport = StreamingAttachmentTransport(http_server.Url)
+    # The stand-in sends fewer bytes than its Content-Length, which urllib may report itself:
+    with pytest.raises(Exception):
+        transport.download(dict(url='/download/attachments/123/data.bin', fileSize='1000'), str(filepath))
+    assert filepath.read_binary() == b'old content'
+    assert not os.path.exists(str(filepath) + '.part')
+
+
+def test_upload_creates_new_attachment(http_server, tmpdir):
+    data = os.urandom(5000)
+    filepath = tmpdir.join('data.bin')
+    filepath.write_binary(data)
+    transport = StreamingAttachmentTransport(http_server.Url, chunksize=1024)
+    result, hexdigest = transport.upload('123', str(filepath), comment='md5: abc')
+    assert result['results'][0]['id'] == 'att9'
+    assert hexdigest == hashlib.md5(data).hexdigest()
+    path, fields = http_server.Uploads[0]
+    assert path == '/rest/api/content/123/child/attachment'
+    assert fields['file'] == data
+    assert fields['comment'] == b'md5: abc'
+
+
+def test_upload_updates_existing_attachment(http_server, tmpdir):
+    http_server.Attachments['123'] = {'data.bin': ('att1', b'old')}
+    filepath = tmpdir.join('data.bin')
+    filepath.write_binary(b'new content')
+    transport = StreamingAttachmentTransport(http_server.Url)
+    transport.upload('123', str(filepath))
+    transport.upload('123', str(filepath), attachmentid='att2')
+    assert [path for path, _ in http_server.Uploads] == ['/rest/api/content/123/child/attachment/att1/data',
+                                                        '/rest/api/content/123/child/attachment/att2/data']
+
+
+def test_fromServer_requires_opener():
+    class Server(object):
+        BaseUrl = 'http://wiki.example.org'
+    assert StreamingAttachmentTransport.fromServer(Server()) is None
+    Server.UrlOpener = object()
+    assert StreamingAttachmentTransport.fromServer(Server()).BaseUrl == 'http://wiki.example.org/'
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+""" Tests for the dirtreeparsing module. """
+import re
+from datetime import date, datetime
+import pytest
+
+from dirtreeparsing import findMismatchingGroups, expidIndex, parseDate, ExpFilter
+
+
+def test_findMismatchingGroups():
+    local = {('RS101', 'a'): (('/local/RS101 exp', 'RS101a one'), ),
+             ('RS102', 'a'): (('/local/RS102 exp', 'RS102a two'), )}
+    remote = {('RS101', 'a'): (('/nas/2014', 'RS101a one'), ),
+              ('RS102', 'a'): (('/nas/2014', 'RS102a renamed'), ('/nas/2015', 'RS102a two'))}
+    assert findMismatchingGroups([local, remote]) == [
+        (('RS102', 'a'), ['/local/RS102 exp/RS102a two', '/nas/2014/RS102a renamed', '/nas/2015/RS102a two'])]
+
+
+def test_findMismatchingGroups_with_None_group_values():
+    # A regex group that does not participate in the match gives None:
+    local = {('RS101', None): (('/local', 'RS101 x'), ), ('RS101', 'a'): (('/local', 'RS101a x'), )}
+    remote = {('RS101', None): (('/nas', 'RS101 y'), ), ('RS101', 'a'): (('/nas', 'RS101a y'), )}
+    keys = [key for key, _ in findMismatchingGroups([local, remote])]
+    assert keys == [('RS101', 'a'), ('RS101', None)]
+    # Single group values:
+    keys = [key for key, _ in findMismatchingGroups([{None: (('/local', 'x'), ), 'RS1': (('/local', 'y'), )},
+                                                     {None: (('/nas', 'z'), ), 'RS1': (('/nas', 'w'), )}])]
+    assert keys == ['RS1', None]
+
+
+def test_expidIndex_and_parseDate():
+    assert expidIndex('RS340') == 340 and expidIndex('RS1000') > expidIndex('RS340')
+    assert expidIndex('nonumber') == -1 and expidIndex(None) == -1
+    assert parseDate('20140301') == date(2014, 3, 1)
+    assert parseDate('2014-03-01') == date(2014, 3, 1)
+    assert parseDate(datetime(2014, 3, 1, 12, 0)) == date(2014, 3, 1)
+    assert parseDate('2014-13-01') is None and parseDate('') is None and parseDate('RS123') is None
+
+
+def test_ExpFilter_rejects_invalid_arguments():
+    with pytest.raises(ValueError):
+        ExpFilter(since_expid='RS')
+    with pytest.raises(ValueError):
+        ExpFilter(since_date='yesterday')
+    assert not ExpFilter()
+
+
+def test_ExpFilter_expid_and_date():
+    yearprog = re.compile(r"(?P<year>[0-9]{4})")
+    expprog = re.compile(r"(?P<expid>RS[0-9]+) (?P<exp_titledesc>.+?)(?: \((?P<date>[0-9]{8})\))?$")
+    expfilter = ExpFilter(since_expid='RS340', since_date='2014-03-01')
+    assert expfilter
+    assert not expfilter('year', yearprog.match('2013'))
+    assert expfilter('year', yearprog.match('2014'))
+    assert expfilter('experiment', expprog.match('RS1000 Later experiment'))
+    assert not expfilter('experiment', expprog.match('RS339 Earlier experiment'))
+    assert not expfilter('experiment', expprog.match('RS400 Old date (20140228)'))
+    assert expfilter('experiment', expprog.match('RS400 New date (20140301)'))
+
+
+def test_ExpFilter_last_n_years():
+    expfilter = ExpFilter(last_n_years=2)
+    assert expfilter.SinceDate.year == date.today().year - 2
+    # The later of since_date and the last_n_years date is used:
+    assert ExpFilter(since_date='19990101', last_n_years=2).SinceDate == expfilter.SinceDate
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+""" Tests for expcatalog.ExperimentCatalog: load/save round-trip and entry validity. """
+import os
+import json
+import time
+from datetime import datetime, date
+
+from expcatalog import ExperimentCatalog, CATALOG_VERSION
+
+
+def makeExpsdir(tmpdir):
+    """ Experiment directory with two experiment folders, one with a props file. """
+    expsdir = os.path.join(str(tmpdir), 'experiments')
+    for foldername in ('RS001 First', 'RS002 Second'):
+        os.makedirs(os.path.join(expsdir, foldername))
+    with open(os.path.join(expsdir, 'RS001 First', '.labfluence.yml'), 'w') as fd:
+        fd.write("expid: RS001\n")
+    return expsdir
+
+
+def makeCatalog(tmpdir, expsdir):
+    catalog = ExperimentCatalog(os.path.join(str(tmpdir), 'config', 'catalog.json'))
+    catalog.setExpsdir(expsdir)
+    catalog.updateEntry('RS001', os.path.join(expsdir, 'RS001 First'),
+                        {'expid': 'RS001', 'exp_titledesc': 'First', 'date': date(2014, 3, 1)},
+                        subentries={'a': {'subentry_idx': 'a', 'created': datetime(2014, 3, 1, 12, 30, 5, 250)},
+                                    'b': {'subentry_idx': 'b', 'created': datetime(2014, 3, 2, 8, 0, 0)}},
+                        wiki_pageId='1234')
+    catalog.updateEntry('RS002', os.path.join(expsdir, 'RS002 Second'), {'expid': 'RS002', 'exp_titledesc': 'Second'})
+    return catalog
+
+
+def test_save_load_roundtrip(tmpdir):
+    expsdir = makeExpsdir(tmpdir)
+    catalog = makeCatalog(tmpdir, expsdir)
+    assert catalog.Changed
+    catalog.save()
+    assert not catalog.Changed
+    assert not os.path.exists(catalog.Filepath + '.tmp')
+    loaded = ExperimentCatalog(catalog.Filepath)
+    assert loaded.load()
+    assert loaded.Entries == catalog.Entries
+    assert loaded.Expsdir == expsdir and loaded.ExpsdirMtime == catalog.ExpsdirMtime
+    entry = loaded.Entries['RS001']
+    assert entry['groupdict']['date'] == date(2014, 3, 1)
+    assert entry['exp_subentries']['a']['created'] == datetime(2014, 3, 1, 12, 30, 5, 250)
+    assert entry['exp_subentries']['b']['created'] == datetime(2014, 3, 2, 8, 0, 0)
+    assert loaded.Entries['RS002']['exp_subentries'] is None
+    assert loaded.isExpsdirValid(expsdir)
+    assert loaded.getValidEntry('RS001', entry['localdir']) is entry
+    assert sorted(loaded.getPathGroupdictTuples()) == sorted((e['localdir'], e['groupdict']) for e in catalog.Entries.values())
+    # Saving again overwrites the existing file:
+    loaded.removeMissing(['RS002'])
+    loaded.save()
+    again = ExperimentCatalog(catalog.Filepath)
+    assert again.load() and list(again.Entries) == ['RS002']
+
+
+def test_load_missing_or_other_version(tmpdir):
+    catalog = ExperimentCatalog(os.path.join(str(tmpdir), 'missing.json'))
+    assert not catalog.load()
+    with open(catalog.Filepath, 'w') as fd:
+        json.dump({'version': CATALOG_VERSION - 1, 'experiments': [{'expid': 'RS001'}]}, fd)
+    assert not catalog.load() and catalog.Entries == {}
+    with open(catalog.Filepath, 'w') as fd:
+        fd.write('{"version": ')
+    assert not catalog.load()
+
+
+def test_entry_invalid_after_props_saved(tmpdir):
+    expsdir = makeExpsdir(tmpdir)
+    catalog = makeCatalog(tmpdir, expsdir)
+    localdir = os.path.join(expsdir, 'RS001 First')
+    assert catalog.getValidEntry('RS001', localdir) is not None
+    assert catalog.getValidEntry('RS001', os.path.join(expsdir, 'RS001 Renamed')) is None
+    propsfile = os.path.join(localdir, '.labfluence.yml')
+    mtime = os.stat(propsfile).st_mtime + 10
+    os.utime(propsfile, (mtime, mtime))
+    assert catalog.getValidEntry('RS001', localdir) is None
+
+
+def test_expsdir_invalid_after_folder_added(tmpdir):
+    expsdir = makeExpsdir(tmpdir)
+    catalog = makeCatalog(tmpdir, expsdir)
+    assert catalog.isExpsdirValid(expsdir)
+    assert not catalog.isExpsdirValid(os.path.join(str(tmpdir), 'other'))
+    os.makedirs(os.path.join(expsdir, 'RS003 Third'))
+    mtime = time.time() + 10
+    os.utime(expsdir, (mtime, mtime))
+    assert not catalog.isExpsdirValid(expsdir)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+""" Tests for the ExperimentsById helpers in experimentmanager. """
+from collections import OrderedDict
+
+import pytest
+
+experimentmanager = pytest.importorskip('experimentmanager')
+experiment = pytest.importorskip('experiment')
+ExperimentsByIdDiff = experimentmanager.ExperimentsByIdDiff
+moveIntoSortedPosition = experimentmanager.moveIntoSortedPosition
+
+
+def test_diff_keeps_mapping_truthiness():
+    experimentsbyid = OrderedDict([('RS001', 'exp1'), ('RS002', 'exp2')])
+    diff = ExperimentsByIdDiff(experimentsbyid)
+    assert diff and len(diff) == 2 and diff['RS002'] == 'exp2'
+    assert not diff.isChanged
+    diff.Changed.append('RS002')
+    assert diff.isChanged
+    assert not ExperimentsByIdDiff(OrderedDict())
+    empty = ExperimentsByIdDiff(OrderedDict())
+    empty.Removed.append('RS003')
+    assert empty.isChanged and not empty
+
+
+class CountingOrderedDict(OrderedDict):
+    """ Counts the items that are (re)inserted. """
+    def __init__(self, *args, **kwargs):
+        self.Inserted = 0
+        OrderedDict.__init__(self, *args, **kwargs)
+
+    def __setitem__(self, key, value):    # pylint: disable=W0221
+        self.Inserted += 1
+        OrderedDict.__setitem__(self, key, value)
+
+
+def makeById(expids):
+    experimentsbyid = CountingOrderedDict((expid, expid.lower()) for expid in expids)
+    experimentsbyid.Inserted = 0
+    return experimentsbyid
+
+
+def test_move_new_expids_at_the_end_moves_nothing_else():
+    experimentsbyid = makeById(['RS%03d' % i for i in range(1, 101)] + ['RS101', 'RS102'])
+    moveIntoSortedPosition(experimentsbyid, ['RS101', 'RS102'])
+    assert list(experimentsbyid)[-3:] == ['RS100', 'RS101', 'RS102']
+    assert experimentsbyid.Inserted == 2
+
+
+def test_move_new_expids_into_the_middle():
+    experimentsbyid = makeById(['RS001', 'RS002', 'RS010', 'RS011', 'RS012', 'RS003', 'RS100'])
+    moveIntoSortedPosition(experimentsbyid, ['RS003', 'RS100'])
+    assert list(experimentsbyid) == ['RS001', 'RS002', 'RS003', 'RS010', 'RS011', 'RS012', 'RS100']
+    assert experimentsbyid['RS003'] == 'rs003'
+    # RS001 and RS002 are not moved:
+    assert experimentsbyid.Inserted == 5
+    moveIntoSortedPosition(experimentsbyid, [])
+    assert experimentsbyid.Inserted == 5
+
+
+class StandInConfighandler(dict):
+    """ Config entries as a dict; saveConfigs does nothing. """
+    def saveConfigs(self):
+        pass
+
+
+def makeManager(monkeypatch, config=None):
+    manager = experimentmanager.ExperimentManager(StandInConfighandler(config or {}), autoinit=False)
+    monkeypatch.setattr(manager, 'invokePropertyCallbacks', lambda *args: None, raising=False)
+    return manager
+
+
+@pytest.mark.parametrize('config, hydrate, expected', [({}, None, False),
+                                                       ({'exp_manager_hydrate_wiki_data': True}, None, True),
+                                                       ({}, True, True)])
+def test_wiki_hydration_is_opt_in(monkeypatch, config, hydrate, expected):
+    manager = makeManager(monkeypatch, config)
+    manager._localexpdirsparsed = True    # pylint: disable=W0212
+    monkeypatch.setattr(experimentmanager.ExperimentManager, 'Server', 'connected')
+    monkeypatch.setattr(manager, 'getCurrentWikiExpsPageGroupdictTuples', lambda: [])
+    hydrated = []
+    monkeypatch.setattr(manager, 'hydrateWikiData', lambda: hydrated.append(True))
+    manager.mergeCurrentWikiExperiments(hydrate=hydrate)
+    assert bool(hydrated) == expected
+
+
+class StandInExperiment(object):
+    def __init__(self, props=None, localdir=None, **kwargs):   # pylint: disable=W0613
+        self.Props = dict(props, exp_subentries={'a': {'subentry_idx': 'a'}}, wiki_pageId=props['expid'][2:])
+        self.Localdirpath = localdir
+
+    @property
+    def Expid(self):
+        return self.Props['expid']
+
+
+def test_catalog_entries_updated_from_hydration_threads(monkeypatch, tmpdir):
+    monkeypatch.setattr(experimentmanager.ExperimentManager, 'Catalog', property(lambda self: self._catalog))
+    monkeypatch.setattr(experimentmanager.ExperimentManager, 'ExperimentsById', property(lambda self: self._experimentsbyid))
+    monkeypatch.setattr(experiment, 'Experiment', StandInExperiment)
+    manager = makeManager(monkeypatch)
+    catalog = experimentmanager.ExperimentCatalog(str(tmpdir.join('catalog.json')))
+    manager._catalog = catalog      # pylint: disable=W0212
+    manager._experimentsbyid = OrderedDict()    # pylint: disable=W0212
+    for i in range(200):
+        expid, localdir = 'RS%03d' % i, str(tmpdir.join('RS%03d Exp' % i))
+        catalog.updateEntry(expid, localdir, {'expid': expid})
+        manager._experimentsbyid[expid] = experiment.ExperimentProxy(localdir, {'expid': expid}, manager=manager)    # pylint: disable=W0212
+    catalog.save()
+    loaded = manager.hydrateExperiments(workers=8)
+    assert len(loaded) == 200
+    saved = experimentmanager.ExperimentCatalog(catalog.Filepath)
+    assert saved.load()
+    assert all(entry['wiki_pageId'] == entry['expid'][2:] and entry['exp_subentries']
+               for entry in saved.Entries.values())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+""" Tests for Experiment._writeProps and the props write-behind, with a stand-in confighandler. """
+import threading
+
+import pytest
+import yaml
+
+experiment = pytest.importorskip('experiment')
+confighandler = pytest.importorskip('confighandler')
+
+
+class StandInConfighandler(object):
+    """ Relays experiment configs to a real HierarchicalConfigHandler; other config entries are given. """
+    def __init__(self, rootdir, **config):
+        self.HierarchicalConfigHandler = confighandler.HierarchicalConfigHandler(rootdir)
+        self.Config = config
+
+    def get(self, key, default=None, path=None):     # pylint: disable=W0613
+        return self.Config.get(key, default)
+
+    def getExpConfig(self, path):
+        return self.HierarchicalConfigHandler.Configs.setdefault(path, dict())
+
+    def saveExpConfig(self, path, cfg=None):
+        return self.HierarchicalConfigHandler.saveConfig(path, cfg)
+
+
+class StandInExperiment(experiment.Experiment):
+    """ An Experiment with just what is needed to save its props (a real one needs a server, etc). """
+    Confighandler = None
+
+    def __init__(self, localdirpath, confighandler):     # pylint: disable=W0231
+        self.Confighandler = confighandler
+        self.Localdirpath = localdirpath
+        self.VERBOSE = 0
+        self._wikipage = None
+        self._propslock = threading.RLock()
+        self._allowmanualpropssavetofile = False
+
+
+@pytest.fixture
+def exp(tmpdir):
+    exp = StandInExperiment(str(tmpdir), StandInConfighandler(str(tmpdir), exp_props_save_delay=3600, exp_series_dir_fmt='{expid}'))
+    exp.Props.update(expid='RS001', exp_subentries={'a': {'subentry_titledesc': 'first'}})
+    assert exp.saveProps(now=True)
+    yield exp
+    experiment._propswriter.cancel(exp)    # pylint: disable=W0212
+
+
+def readProps(exp):
+    with open(exp.Localdirpath + '/.labfluence.yml') as fd:
+        return yaml.load(fd, Loader=yaml.SafeLoader)
+
+
+def test_interrupted_flush_leaves_old_props_file(exp, monkeypatch):
+    oldprops = readProps(exp)
+    assert oldprops['expid'] == 'RS001' and 'lastsaved' in oldprops
+    exp.Props['expid'] = 'RS002'
+    assert exp.saveProps()     # scheduled, not written
+    assert readProps(exp) == oldprops
+    dump = yaml.dump
+
+    def interrupteddump(data, stream, **kwargs):
+        stream.write(dump(data, **kwargs)[:20])
+        raise RuntimeError("Interrupted while writing")
+    monkeypatch.setattr(confighandler.yaml, 'dump', interrupteddump)
+    exp.flushProps()
+    assert readProps(exp) == oldprops
+    assert experiment._propswriter.isPending(exp)    # pylint: disable=W0212
+    monkeypatch.setattr(confighandler.yaml, 'dump', dump)
+    exp.flushProps()
+    assert readProps(exp)['expid'] == 'RS002'
+    assert not experiment._propswriter.isPending(exp)    # pylint: disable=W0212
+
+
+def test_props_changed_while_writing_are_not_written(exp, monkeypatch):
+    dump = yaml.dump
+
+    def changingdump(data, stream, **kwargs):
+        # (as if another thread added a subentry while the file is written)
+        exp.Subentries['b'] = {'subentry_titledesc': 'second'}
+        return dump(data, stream, **kwargs)
+    monkeypatch.setattr(confighandler.yaml, 'dump', changingdump)
+    assert exp.saveProps(now=True)
+    assert list(readProps(exp)['exp_subentries']) == ['a']
+    assert list(exp.Subentries) == ['a', 'b']
+    # The new 'lastsaved' is brought back into Props, so the next save does not consider the file newer:
+    assert exp.Props['lastsaved'] == readProps(exp)['lastsaved']
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+""" Tests for experiment.ExperimentProxy, with a stand-in Experiment class (loading a real one needs a confighandler). """
+import threading
+
+import pytest
+
+experiment = pytest.importorskip('experiment')
+ExperimentProxy = experiment.ExperimentProxy
+
+
+class StandInExperiment(object):
+    """ Records how many experiments are made; Props are the groupdict passed as props. """
+    made = []
+
+    def __init__(self, props=None, localdir=None, manager=None, **kwargs):   # pylint: disable=W0613
+        self.Props = dict(props)
+        self.Localdirpath = localdir
+        self.Title = 'loaded'
+        StandInExperiment.made.append(self)
+
+    @property
+    def Expid(self):
+        return self.Props.get('expid')
+
+
+class StandInManager(object):
+    def __init__(self):
+        self.Updated = []
+
+    def updateCatalogEntry(self, proxy):
+        self.Updated.append(proxy)
+
+
+@pytest.fixture
+def standin(monkeypatch):
+    StandInExperiment.made = []
+    monkeypatch.setattr(experiment, 'Experiment', StandInExperiment)
+    return StandInExperiment
+
+
+def makeProxy(**kwargs):
+    return ExperimentProxy('/data/2014/RS123 Some experiment', {'expid': 'RS123', 'exp_titledesc': 'Some experiment'},
+                           **kwargs)
+
+
+def test_proxy_attributes_do_not_load(standin):
+    proxy = makeProxy()
+    assert proxy.Expid == 'RS123'
+    assert proxy.Localdirpath == '/data/2014/RS123 Some experiment'
+    assert proxy.Foldername == 'RS123 Some experiment'
+    assert proxy.Parentdirpath == '/data/2014'
+    assert proxy.Groupdict['exp_titledesc'] == 'Some experiment'
+    assert repr(proxy) == 'e>RS123 Some experiment'
+    assert not proxy.isLoaded and standin.made == []
+
+
+def test_getprop_uses_groupdict_and_cached_entry(standin):
+    proxy = makeProxy(cached={'wiki_pageId': '1234', 'exp_subentries': None})
+    assert proxy.getProp('expid') == 'RS123'
+    assert proxy.getProp('wiki_pageId') == '1234'
+    # exp_subentries is None in the cached entry, so it is unknown:
+    assert proxy.getProp('exp_subentries', default='unknown', load=False) == 'unknown'
+    assert not proxy.isLoaded
+    proxy.invalidateCache()
+    assert proxy.getProp('wiki_pageId', load=False) is None
+    assert not proxy.isLoaded
+
+
+def test_other_attributes_load_the_experiment_once(standin):
+    manager = StandInManager()
+    proxy = makeProxy(manager=manager)
+    assert proxy.Title == 'loaded'
+    assert proxy.isLoaded and len(standin.made) == 1
+    assert proxy.Experiment is standin.made[0]
+    assert manager.Updated == [proxy]
+    proxy.Title = 'changed'
+    assert standin.made[0].Title == 'changed' and len(standin.made) == 1
+    assert proxy == standin.made[0] and proxy == proxy
+    assert proxy != makeProxy()
+    with pytest.raises(AttributeError):
+        proxy.__missing_dunder__      # pylint: disable=W0104
+
+
+def test_concurrent_loading_keeps_the_first_experiment(standin):
+    proxy = makeProxy()
+    start = threading.Event()
+    loaded = []
+    def load():
+        start.wait()
+        loaded.append(proxy.Experiment)
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    assert all(exp is proxy.Experiment for exp in loaded)
+    assert proxy.Experiment in standin.made
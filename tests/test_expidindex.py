@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+""" Tests for expidindex.ExpidIndex: building, incremental updates and range queries. """
+import pytest
+
+from expidindex import ExpidIndex
+
+
+def test_build_sorted_and_skip_unparsable():
+    index = ExpidIndex(['RS010', 'RS002', 'notanexpid', 'RS100', 'RS002', 'RS000'])
+    assert list(index) == ['RS000', 'RS002', 'RS010', 'RS100']
+    assert index.getIndices() == [0, 2, 10, 100]
+    assert 'RS010' in index and 'notanexpid' not in index
+    assert index.getNextIndex() == 101
+    assert ExpidIndex().getNextIndex() == 1
+
+
+def test_regex_index():
+    index = ExpidIndex(['RS12-3', 'RS7-1', 'XY99'], regex_str=r'RS([0-9]+)-')
+    assert list(index) == ['RS7-1', 'RS12-3']
+    assert index.parseIndex('XY99') is None
+
+
+def test_getrange():
+    index = ExpidIndex(['RS%03d' % i for i in (1, 5, 10, 20, 340, 341)])
+    assert index.getRange('RS010', 'RS340') == ['RS010', 'RS020', 'RS340']
+    assert index.getRange(first=340) == ['RS340', 'RS341']
+    assert index.getRange(last='RS005') == ['RS001', 'RS005']
+    assert index.getRange(11, 19) == []
+    assert index.getRange() == list(index)
+
+
+def test_getrange_with_index_zero():
+    index = ExpidIndex(['RS000', 'RS001', 'RS002'])
+    assert index.getRange('RS000', 'RS000') == ['RS000']
+    assert index.getRange(0, 1) == ['RS000', 'RS001']
+
+
+@pytest.mark.parametrize('limits', [('notanexpid', None), (None, 'notanexpid'), ('RS001', '')])
+def test_getrange_unparsable_expid_raises(limits):
+    index = ExpidIndex(['RS001', 'RS002'])
+    with pytest.raises(ValueError):
+        index.getRange(*limits)
+
+
+def test_add_and_remove():
+    index = ExpidIndex(['RS001', 'RS010'])
+    assert index.add('RS005')
+    assert not index.add('RS005') and not index.add('notanexpid')
+    assert list(index) == ['RS001', 'RS005', 'RS010']
+    # Expids with the same index are kept in the order they were added:
+    assert index.add('RS5')
+    assert list(index) == ['RS001', 'RS005', 'RS5', 'RS010']
+    index.remove('RS005')
+    index.remove('RS999')
+    assert list(index) == ['RS001', 'RS5', 'RS010'] and 'RS005' not in index
+    assert index.getIndices() == [1, 5, 10]
+
+
+def test_update_appends_or_rebuilds():
+    index = ExpidIndex(['RS001', 'RS010'])
+    index.update(['RS012', 'RS011', 'RS010', 'notanexpid'])
+    assert list(index) == ['RS001', 'RS010', 'RS011', 'RS012']
+    index.update(['RS010x', 'RS003', 'RS020', 'RS003'])
+    # The existing RS010 stays before the new expid with the same index:
+    assert list(index) == ['RS001', 'RS003', 'RS010', 'RS010x', 'RS011', 'RS012', 'RS020']
+    assert index.getIndices() == [1, 3, 10, 10, 11, 12, 20]
+    assert len(index) == 7
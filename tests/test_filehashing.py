@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+""" Tests for the filehashing and renamedetection digest helpers. """
+import hashlib
+
+import filehashing
+from filehashing import hashFile, filesMatch, resolveDigesttype, FAST_DIGESTTYPE, treeHashFile, diffTreeHashes, digestEntry
+from renamedetection import fullDigest
+
+
+def test_fast_digesttype_is_resolved(tmpdir):
+    filepath = tmpdir.join('data.bin')
+    filepath.write_binary(b'some data' * 1000)
+    digests = hashFile(str(filepath), ('fast', 'md5'))
+    assert set(digests) == {FAST_DIGESTTYPE, 'md5'}
+    assert resolveDigesttype('fast') == FAST_DIGESTTYPE
+    assert fullDigest(str(filepath), 'fast') == digests[FAST_DIGESTTYPE]
+    assert fullDigest(str(filepath)) == hashlib.md5(b'some data' * 1000).hexdigest()
+
+
+def test_filesMatch_fast(tmpdir):
+    filepath1, filepath2 = tmpdir.join('a.bin'), tmpdir.join('b.bin')
+    filepath1.write_binary(b'abc' * 100)
+    filepath2.write_binary(b'abc' * 100)
+    assert filesMatch(str(filepath1), str(filepath2), 'fast')
+    filepath2.write_binary(b'abd' * 100)
+    assert not filesMatch(str(filepath1), str(filepath2), 'fast')
+
+
+def test_treehash_chunks(tmpdir):
+    filepath = tmpdir.join('big.bin')
+    data = b'x' * 2500 + b'y' * 2500
+    filepath.write_binary(data)
+    treehash = treeHashFile(str(filepath), 'sha256', chunksize=1000, workers=4)
+    assert treehash['digesttype'] == 'tree-sha256' and treehash['size'] == 5000
+    assert treehash['chunks'] == [hashlib.sha256(data[i:i+1000]).hexdigest() for i in range(0, 5000, 1000)]
+    root = hashlib.sha256(b''.join(hashlib.sha256(data[i:i+1000]).digest() for i in range(0, 5000, 1000))).hexdigest()
+    assert treehash['root'] == root
+    filepath.write_binary(data[:3500] + b'z' + data[3501:])
+    assert diffTreeHashes(treehash, treeHashFile(str(filepath), 'sha256', chunksize=1000)) == [3]
+
+
+def test_tree_digest_only_does_not_read_the_whole_file(tmpdir, monkeypatch):
+    filepath = tmpdir.join('data.bin')
+    filepath.write_binary(b'some data' * 1000)
+    def fail(*args, **kwargs):
+        raise AssertionError("hashFile called with %s %s" % (args, kwargs))
+    monkeypatch.setattr(filehashing, 'hashFile', fail)
+    entry = digestEntry(str(filepath), ('tree-sha256', ))
+    treehash = treeHashFile(str(filepath), 'sha256')
+    assert entry == {'tree-sha256': treehash['root'], 'tree-sha256-chunks': treehash['chunks'],
+                     'tree-chunksize': treehash['chunksize']}
+
+
+def test_digest_entry_with_plain_and_tree_digests(tmpdir, monkeypatch):
+    filepath = tmpdir.join('data.bin')
+    filepath.write_binary(b'some data' * 1000)
+    calls = []
+    def recordingHashFile(filepath, digesttypes, *args, **kwargs):
+        calls.append(list(digesttypes))
+        return hashFile(filepath, digesttypes, *args, **kwargs)
+    monkeypatch.setattr(filehashing, 'hashFile', recordingHashFile)
+    entry = digestEntry(str(filepath), ('md5', 'tree-sha256', 'sha1'))
+    assert calls == [['md5', 'sha1']]
+    assert entry['md5'] == hashlib.md5(b'some data' * 1000).hexdigest()
+    assert entry['sha1'] == hashlib.sha1(b'some data' * 1000).hexdigest()
+    assert 'tree-sha256' in entry and 'tree-sha256-chunks' in entry
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+""" Tests for fileindex.LocalFileIndex. """
+import os
+import pytest
+
+import fileindex
+from fileindex import LocalFileIndex
+
+
+def makeTree(tmpdir):
+    tmpdir.join('sub', 'data.txt').write('x', ensure=True)
+    tmpdir.join('top.txt').write('y')
+    # A symlink cycle: sub/loop -> the experiment folder.
+    os.symlink(str(tmpdir), str(tmpdir.join('sub', 'loop')))
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason="no symlinks")
+@pytest.mark.parametrize('usescandir', [True, False])
+def test_walk_does_not_follow_symlinked_dirs(tmpdir, monkeypatch, usescandir):
+    if not usescandir:
+        monkeypatch.setattr(fileindex, 'scandir', None)
+    makeTree(tmpdir)
+    index = LocalFileIndex(str(tmpdir))
+    walked = [(os.path.relpath(dirpath, str(tmpdir)), sorted(dirnames), sorted(filenames))
+              for dirpath, dirnames, filenames in index.walk()]
+    # Like os.walk: the symlink is listed in dirnames, but not walked into.
+    assert walked == [('.', ['sub'], ['top.txt']), ('sub', ['loop'], ['data.txt'])]
+    assert sorted(walked) == sorted((os.path.relpath(dirpath, str(tmpdir)), sorted(dirnames), sorted(filenames))
+                                    for dirpath, dirnames, filenames in os.walk(str(tmpdir)))
+    assert index.checkUnchanged()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+""" Tests for filemanager.Filemanager, with a stand-in experiment and wiki page. """
+import os
+import time
+import threading
+
+import pytest
+
+filemanager = pytest.importorskip('filemanager')
+Filemanager = filemanager.Filemanager
+
+
+class StandInExperiment(object):
+    def __init__(self, localdir, config=None):
+        self.Localdirpath = localdir
+        self.Confighandler = dict(config or {})
+        self.Server = None
+
+    def getUpdatedAttachmentsList(self):
+        return []
+
+
+class UploadRecorder(object):
+    """ uploadAttachment stand-in that records the max number of concurrent uploads. """
+    def __init__(self):
+        self.Active = 0
+        self.MaxActive = 0
+        self.Uploaded = []
+        self._lock = threading.Lock()
+
+    def __call__(self, filepath, att_info=None, digesttype=None):    # pylint: disable=W0613
+        with self._lock:
+            self.Active += 1
+            self.MaxActive = max(self.MaxActive, self.Active)
+        time.sleep(0.05)
+        with self._lock:
+            self.Active -= 1
+            self.Uploaded.append(os.path.basename(filepath))
+        return True
+
+
+def makeFilemanager(tmpdir, monkeypatch, nfiles=4):
+    localdir = str(tmpdir)
+    filepaths = []
+    for i in range(nfiles):
+        filepaths.append(os.path.join(localdir, 'file%s.txt' % i))
+        with open(filepaths[-1], 'w') as fd:
+            fd.write('content %s' % i)
+    fm = Filemanager(StandInExperiment(localdir))
+    monkeypatch.setattr(fm, 'getLocalFilelist', lambda *args, **kwargs: [(None, fp, None) for fp in filepaths])
+    monkeypatch.setattr(fm, 'getAttachmentList', lambda *args, **kwargs: [])
+    monkeypatch.setattr(fm, 'saveFileshistory', lambda: None)
+    monkeypatch.setattr(fm, 'getCachedDigest', lambda filepath, digesttype: 'abc123')
+    recorder = UploadRecorder()
+    monkeypatch.setattr(fm, 'uploadAttachment', recorder)
+    return fm, recorder
+
+
+def test_xmlrpc_uploads_are_made_one_at_a_time(tmpdir, monkeypatch):
+    fm, recorder = makeFilemanager(tmpdir, monkeypatch)
+    assert fm.AttachmentTransport is None
+    result = fm.syncAttachments(workers=4)
+    assert sorted(recorder.Uploaded) == ['file%s.txt' % i for i in range(4)]
+    assert len(result['uploaded']) == 4 and not result['failed']
+    assert recorder.MaxActive == 1
+
+
+@pytest.mark.skipif(filemanager.ThreadPoolExecutor is None, reason="concurrent.futures is not available")
+def test_streaming_uploads_are_concurrent(tmpdir, monkeypatch):
+    fm, recorder = makeFilemanager(tmpdir, monkeypatch)
+    fm._attachmenttransport = object()     # pylint: disable=W0212
+    result = fm.syncAttachments(workers=4)
+    assert len(result['uploaded']) == 4
+    assert recorder.MaxActive > 1
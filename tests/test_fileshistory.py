@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+""" Tests for fileshistory.FileshistoryStore. """
+import sqlite3
+from datetime import datetime
+import yaml
+
+from fileshistory import FileshistoryStore
+
+
+def test_entries_with_same_or_no_datetime_are_kept(tmpdir):
+    dt = datetime(2014, 5, 1, 12, 0, 0)
+    history = {'RS123 exp/data.txt': [{'datetime': dt, 'md5': 'aaa'},
+                                      {'datetime': dt, 'md5': 'bbb'},
+                                      {'md5': 'ccc'},
+                                      {'md5': 'ddd'}]}
+    ymlpath = tmpdir.join('files_history.yml')
+    ymlpath.write(yaml.dump(history))
+    store = FileshistoryStore(str(tmpdir.join('files_history.sqlite')))
+    assert store.importYaml(str(ymlpath)) == 4
+    entries = store['RS123 exp/data.txt']
+    assert [entry['md5'] for entry in entries] == ['aaa', 'bbb', 'ccc', 'ddd']
+    assert entries[0]['datetime'] == dt and entries[2]['datetime'] is None
+
+
+def test_multiple_digests_in_one_entry(tmpdir):
+    store = FileshistoryStore(str(tmpdir.join('files_history.sqlite')))
+    store.append('a.txt', {'datetime': datetime(2014, 5, 1), 'md5': 'aaa', 'sha1': 'fff', 'tree-chunksize': 1024})
+    store.append('a.txt', {'datetime': datetime(2014, 5, 1), 'md5': 'bbb'})
+    assert store['a.txt'] == [{'datetime': datetime(2014, 5, 1), 'md5': 'aaa', 'sha1': 'fff', 'tree-chunksize': 1024},
+                              {'datetime': datetime(2014, 5, 1), 'md5': 'bbb'}]
+    assert store.findByDigest('bbb') == ['a.txt']
+
+
+def test_store_without_entryid_is_migrated(tmpdir):
+    dbpath = str(tmpdir.join('files_history.sqlite'))
+    conn = sqlite3.connect(dbpath)
+    conn.executescript("""
+        CREATE TABLE digests (relpath TEXT NOT NULL, datetime TEXT, digesttype TEXT NOT NULL,
+                              digest TEXT, isjson INTEGER DEFAULT 0);
+        INSERT INTO digests VALUES ('a.txt', '2014-05-01T00:00:00', 'md5', 'aaa', 0);
+        INSERT INTO digests VALUES ('a.txt', '2014-05-01T00:00:00', 'sha1', 'fff', 0);
+        INSERT INTO digests VALUES ('a.txt', '2014-05-02T00:00:00', 'md5', 'bbb', 0);
+    """)
+    conn.commit()
+    conn.close()
+    store = FileshistoryStore(dbpath)
+    store.append('a.txt', {'datetime': datetime(2014, 5, 2), 'md5': 'ccc'})
+    assert [sorted(entry) for entry in store['a.txt']] == [['datetime', 'md5', 'sha1'], ['datetime', 'md5'],
+                                                           ['datetime', 'md5']]
+    assert [entry['md5'] for entry in store['a.txt']] == ['aaa', 'bbb', 'ccc']
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+""" Tests for localwatcher.LocalExperimentsWatcher, with a stand-in ExperimentManager. """
+import os
+import threading
+
+import pytest
+
+localwatcher = pytest.importorskip('localwatcher')
+LocalExperimentsWatcher = localwatcher.LocalExperimentsWatcher
+
+needsinotify = pytest.mark.skipif(localwatcher.inotify_simple is None, reason="inotify_simple is not installed")
+
+
+class RecordingLock(object):
+    """ Re-entrant lock that records if it is held (by any thread). """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.Depth = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        self.Depth += 1
+
+    def __exit__(self, *args):
+        self.Depth -= 1
+        self._lock.release()
+
+
+class StandInExperiment(object):
+    """ A loaded experiment; records whether subentries were re-parsed with the manager's lock held. """
+    isLoaded = True
+
+    def __init__(self, manager, path):
+        self.Manager = manager
+        self.Localdirpath = path
+        self.Reparsed = []
+
+    def parseLocaldirSubentries(self):
+        self.Reparsed.append(self.Manager.Lock.Depth > 0)
+
+
+class StandInManager(object):
+    """ mergeLocalExperiments lists the experiment directory; every folder is an experiment. """
+    def __init__(self, rootdir, expsdir):
+        self.Rootdir = rootdir
+        self.ExpsDir = expsdir
+        self.Confighandler = object()
+        self.Lock = RecordingLock()
+        self.ExperimentsById = {}
+        self.Merges = 0
+        self.mergeLocalExperiments()
+        self.Merges = 0
+
+    def getLocalExpSubDir(self):
+        return self.ExpsDir
+
+    def mergeLocalExperiments(self):
+        with self.Lock:
+            self.Merges += 1
+            for foldername in sorted(os.listdir(self.ExpsDir)):
+                if foldername not in self.ExperimentsById:
+                    self.ExperimentsById[foldername] = StandInExperiment(self, os.path.join(self.ExpsDir, foldername))
+
+
+@pytest.fixture
+def tree(tmpdir):
+    """ rootdir with the current year folder (local_exp_subDir) and a folder from a previous year. """
+    rootdir = str(tmpdir)
+    expsdir = os.path.join(rootdir, '2015_Aarhus')
+    for path in (os.path.join(expsdir, 'RS101 New'), os.path.join(rootdir, '2014_Aarhus', 'RS001 Old')):
+        os.makedirs(path)
+    return rootdir, expsdir
+
+
+def test_periodic_rescan_without_inotify(tree):
+    manager = StandInManager(*tree)
+    watcher = LocalExperimentsWatcher(manager, rescaninterval=1000, useinotify=False)
+    assert not watcher.UsingInotify
+    assert watcher.poll() == 0 and manager.Merges == 0
+    watcher.RescanInterval = -1
+    os.makedirs(os.path.join(tree[1], 'RS102 Added'))
+    watcher.poll()
+    assert manager.Merges == 1 and 'RS102 Added' in manager.ExperimentsById
+
+
+@needsinotify
+def test_watches_only_the_merged_folders(tree):
+    rootdir, expsdir = tree
+    manager = StandInManager(rootdir, expsdir)
+    watcher = LocalExperimentsWatcher(manager)
+    try:
+        assert sorted(watcher._wdsbypath) == [expsdir, os.path.join(expsdir, 'RS101 New')]  # pylint: disable=W0212
+        # A new folder in a previous year's folder is not merged, so nothing happens:
+        os.makedirs(os.path.join(rootdir, '2014_Aarhus', 'RS002 Old too'))
+        assert watcher.poll(timeout=0.1) == 0 and manager.Merges == 0
+        # A new experiment folder is merged and watched:
+        os.makedirs(os.path.join(expsdir, 'RS102 Added'))
+        assert watcher.poll(timeout=1) > 0
+        assert manager.Merges == 1
+        assert os.path.join(expsdir, 'RS102 Added') in watcher._wdsbypath     # pylint: disable=W0212
+    finally:
+        watcher.stop()
+
+
+@needsinotify
+def test_subentry_changes_are_applied_with_the_manager_lock(tree):
+    manager = StandInManager(*tree)
+    watcher = LocalExperimentsWatcher(manager)
+    exp = manager.ExperimentsById['RS101 New']
+    watcher.start(interval=0.05)
+    try:
+        os.makedirs(os.path.join(exp.Localdirpath, 'RS101a Subentry'))
+        for _ in range(100):
+            if exp.Reparsed:
+                break
+            threading.Event().wait(0.05)
+    finally:
+        watcher.stop()
+    assert exp.Reparsed == [True]
+    assert manager.Merges == 0
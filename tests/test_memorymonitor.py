@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+""" Tests for memorymonitor: SpillDict and MemoryReporter phases. """
+import pytest
+
+from memorymonitor import SpillDict, MemoryReporter, tracemalloc
+
+
+def test_spilldict_spill_roundtrip():
+    d = SpillDict(name='test-spill')
+    d['RS001'] = ['a', 'b']
+    d['RS002'] = ['c']
+    d.spill()
+    assert d.Spilled
+    d['RS003'] = ['d']
+    assert sorted(d) == ['RS001', 'RS002', 'RS003']
+    assert d['RS001'] == ['a', 'b'] and d['RS003'] == ['d']
+    del d['RS002']
+    assert 'RS002' not in d and len(d) == 2
+    d.close()
+    assert len(d) == 0 and not d.Spilled
+
+
+@pytest.mark.skipif(tracemalloc is None, reason="tracemalloc requires python 3.4+")
+def test_memoryreporter_nested_phases_with_same_name_make_one_section():
+    reporter = MemoryReporter(topn=3)
+    with reporter.phase('planning'):
+        pass
+    with reporter.phase('copy'):
+        for _ in range(5):
+            with reporter.phase('copy'):
+                pass
+    assert [stat[0] for stat in reporter.Phasestats] == ['planning', 'copy']
+    assert reporter.report().count("After phase 'copy'") == 1
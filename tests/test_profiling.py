@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+""" Tests for profiling: PhaseProfiler phase times, nested phases and output files; ProfilerGroup. """
+import os
+import time
+import pstats
+from contextlib import contextmanager
+
+import pytest
+
+from profiling import PhaseProfiler, ProfilerGroup, NullProfiler
+
+
+def busy(seconds):
+    """ Spin (rather than sleep), so there is something for the profiler to see. """
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def test_invalid_mode(tmpdir):
+    with pytest.raises(ValueError):
+        PhaseProfiler(str(tmpdir), mode='nonsense')
+
+
+def test_repeated_phases_are_accumulated(tmpdir):
+    profiler = PhaseProfiler(str(tmpdir))
+    for _ in range(3):
+        with profiler.phase('copy'):
+            busy(0.01)
+    assert list(profiler.Phasetimes) == ['copy']
+    assert profiler.Phasetimes['copy'] >= 0.03
+    assert profiler.CurrentPhase is None
+
+
+def test_nested_phase_pauses_outer(tmpdir):
+    profiler = PhaseProfiler(str(tmpdir))
+    with profiler.phase('planning'):
+        assert profiler.CurrentPhase == 'planning'
+        with profiler.phase('remote-scan:my remote'):
+            assert profiler.CurrentPhase == 'remote-scan:my remote'
+            busy(0.02)
+        assert profiler.CurrentPhase == 'planning'
+    # The outer phase's wall time includes the inner phase:
+    assert profiler.Phasetimes['planning'] >= profiler.Phasetimes['remote-scan:my remote'] >= 0.02
+    profiler.finish()
+    # Only the inner phase did the busy work; the outer profile must not include it:
+    outer = pstats.Stats(os.path.join(str(tmpdir), 'planning.pstats'))
+    inner = pstats.Stats(os.path.join(str(tmpdir), 'remote-scan_my_remote.pstats'))
+    assert not any(func[2] == 'busy' for func in outer.stats)
+    assert any(func[2] == 'busy' for func in inner.stats)
+
+
+def test_finish_cprofile_writes_summary_and_pstats(tmpdir):
+    outdir = os.path.join(str(tmpdir), 'profile')
+    profiler = PhaseProfiler(outdir, topn=5)
+    with profiler.phase('local-parse'):
+        busy(0.01)
+    summaryfile = profiler.finish()
+    assert summaryfile == os.path.join(outdir, 'summary.txt')
+    summary = open(summaryfile).read()
+    assert "Phase 'local-parse'" in summary
+    assert os.path.isfile(os.path.join(outdir, 'local-parse.pstats'))
+
+
+def test_finish_sample_writes_collapsed_stacks(tmpdir):
+    profiler = PhaseProfiler(str(tmpdir), mode='sample', interval=0.001)
+    with profiler.phase('copy'):
+        busy(0.1)
+    summary = open(profiler.finish()).read()
+    assert "Phase 'copy'" in summary and "samples" in summary
+    collapsed = open(os.path.join(str(tmpdir), 'copy.collapsed')).read()
+    assert 'busy (test_profiling.py:' in collapsed
+
+
+class RecordingProfiler(NullProfiler):
+    """ Records the order in which phases are entered and exited. """
+    def __init__(self, tag, events):
+        self.Tag = tag
+        self.Events = events
+
+    @contextmanager
+    def phase(self, name):
+        self.Events.append(('enter', self.Tag, name))
+        yield
+        self.Events.append(('exit', self.Tag, name))
+
+    def finish(self):
+        return self.Tag
+
+
+def test_profilergroup_nests_profilers_in_order():
+    events = []
+    group = ProfilerGroup(RecordingProfiler('a', events), RecordingProfiler('b', events))
+    with group.phase('copy'):
+        events.append('body')
+    assert events == [('enter', 'a', 'copy'), ('enter', 'b', 'copy'), 'body',
+                      ('exit', 'b', 'copy'), ('exit', 'a', 'copy')]
+    assert group.finish() == ['a', 'b']
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+""" Tests for records: the __slots__ layout, interning and pickling of ExpRecord and SubentryRecord. """
+import sys
+import pickle
+
+import pytest
+
+from records import ExpRecord, SubentryRecord
+
+
+@pytest.mark.parametrize('record', [ExpRecord('RS123', '/data/RS123 Exp', 'Exp', '20140301', '1234'),
+                                    SubentryRecord('RS123', 'a', '/data/RS123 Exp/RS123a Sub', 'Sub', '20140302')])
+def test_records_have_slots_and_no_dict(record):
+    assert not hasattr(record, '__dict__')
+    assert all(hasattr(record, attr) for attr in type(record).__slots__)
+    with pytest.raises(AttributeError):
+        record.Unknown = 1
+    # A slotted record is (much) smaller than the groupdict it replaces:
+    groupdict = {attr: getattr(record, attr) for attr in type(record).__slots__}
+    assert sys.getsizeof(record) < sys.getsizeof(groupdict)
+
+
+def test_slots_layout():
+    assert ExpRecord.__slots__ == ('Expid', 'Path', 'Titledesc', 'Date', 'PageId')
+    assert SubentryRecord.__slots__ == ('Expid', 'Subidx', 'Path', 'Titledesc', 'Date')
+
+
+def test_expids_are_interned():
+    # Build the strings at runtime, so they are not the same constant:
+    expid1, expid2 = "".join(['RS', '123']), "".join(['RS1', '23'])
+    assert expid1 is not expid2
+    a, b = SubentryRecord(expid1, 'a'), SubentryRecord(expid2, 'b')
+    assert a.Expid is b.Expid
+    assert ExpRecord(expid2).Expid is a.Expid
+
+
+@pytest.mark.parametrize('protocol', range(pickle.HIGHEST_PROTOCOL + 1))
+def test_pickle_roundtrip(protocol):
+    exprecord = ExpRecord('RS123', '/data/RS123 Exp', 'Exp', '20140301')
+    subrecord = SubentryRecord('RS123', 'a', '/data/RS123 Exp/RS123a Sub')
+    for record in (exprecord, subrecord):
+        copy = pickle.loads(pickle.dumps(record, protocol))
+        assert copy == record and copy is not record
+        assert copy.Expid is record.Expid
+
+
+def test_fromgroupdict():
+    record = ExpRecord.fromGroupdict({'expid': 'RS123', 'exp_titledesc': 'Exp', 'date1': None, 'date2': '20140301'},
+                                     path='/data/RS123 Exp')
+    assert record == ExpRecord('RS123', '/data/RS123 Exp', 'Exp', '20140301')
+    assert record.Groupdict == {'expid': 'RS123', 'exp_titledesc': 'Exp', 'date': '20140301'}
+    with pytest.raises(KeyError):
+        SubentryRecord.fromGroupdict({'expid': 'RS123'})
+    assert ExpRecord('RS123') != SubentryRecord('RS123', 'a')
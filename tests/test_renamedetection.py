@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+""" Tests for renamedetection.LocalRenameIndex. """
+import os
+
+from renamedetection import LocalRenameIndex, PARTIAL_DIGEST_BYTES
+
+
+def makeFiles(tmpdir, localcontent, remotecontent):
+    """ Makes remote/RS123a_gel01.tif and local/RS123a_gel01 renamed.tif with the same size and mtime. """
+    remotefile = tmpdir.join('remote', 'RS123a_gel01.tif')
+    localfile = tmpdir.join('local', 'RS123a_gel01 renamed.tif')
+    remotefile.write_binary(remotecontent, ensure=True)
+    localfile.write_binary(localcontent, ensure=True)
+    os.utime(str(localfile), (1400000000, 1400000000))
+    os.utime(str(remotefile), (1400000000, 1400000000))
+    return str(remotefile), str(localfile)
+
+
+def test_renamed_file_is_found(tmpdir):
+    content = os.urandom(4*PARTIAL_DIGEST_BYTES)
+    remotefile, localfile = makeFiles(tmpdir, content, content)
+    index = LocalRenameIndex(str(tmpdir.join('local')))
+    assert index.findRenamed(remotefile) == localfile
+
+
+def test_file_edited_in_the_middle_is_not_a_rename(tmpdir):
+    content = bytearray(os.urandom(4*PARTIAL_DIGEST_BYTES))
+    edited = bytearray(content)
+    edited[2*PARTIAL_DIGEST_BYTES] ^= 0xff     # same size, same first and last 64 kB
+    remotefile, _ = makeFiles(tmpdir, bytes(edited), bytes(content))
+    index = LocalRenameIndex(str(tmpdir.join('local')))
+    assert index.findRenamed(remotefile) is None
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+""" Tests for the syncbudget module and the --time-budget/--max-bytes command line options. """
+import json
+import pytest
+
+from syncbudget import SyncBudget, parse_duration, parse_bytesize
+from syncmanager import parseargs
+
+
+@pytest.mark.parametrize('duration, seconds', [
+    ('90', 90), ('45m', 2700), ('45 min', 2700), ('2h', 7200), ('1h30m', 5400), ('1.5h', 5400),
+    ('2 hours 5 minutes', 7500), (' 3d ', 3*86400), (120, 120), (None, None), ('', None)])
+def test_parse_duration(duration, seconds):
+    assert parse_duration(duration) == seconds
+
+
+@pytest.mark.parametrize('duration', ['m45', '5mh', '1..5h', '45 mx', 'h', '1h 30', '5ms', '-5m'])
+def test_parse_duration_rejects_garbage(duration):
+    with pytest.raises(ValueError):
+        parse_duration(duration)
+
+
+@pytest.mark.parametrize('size, nbytes', [
+    ('1024', 1024), ('10b', 10), ('500M', 500*1024**2), ('2G', 2*1024**3), ('2gb', 2*1024**3),
+    ('2GiB', 2*1024**3), ('1.5T', int(1.5*1024**4)), (None, None)])
+def test_parse_bytesize(size, nbytes):
+    assert parse_bytesize(size) == nbytes
+
+
+@pytest.mark.parametrize('size', ['5bb', '5kbb', '5x', 'k', '5ib', 'G2'])
+def test_parse_bytesize_rejects_garbage(size):
+    with pytest.raises(ValueError):
+        parse_bytesize(size)
+
+
+def test_bad_budget_is_a_usage_error(capsys):
+    with pytest.raises(SystemExit) as excinfo:
+        parseargs(['sync', '--time-budget', 'm45'])
+    assert excinfo.value.code == 2
+    assert 'm45' in capsys.readouterr().err
+    argns = parseargs(['--memory-budget', '2G', 'sync', '--time-budget', '1h30m', '--max-bytes', '50G'])
+    assert (argns.time_budget, argns.max_bytes, argns.memory_budget) == (5400, 50*1024**3, 2*1024**3)
+
+
+def test_allow_max_bytes():
+    budget = SyncBudget(max_bytes=1000)
+    assert budget.allow(600)
+    budget.record(600, 1.0)
+    assert not budget.allow(500)
+    assert budget.reason(500) == 'max_bytes'
+    assert budget.allow(400)
+    budget.record(400, 1.0)
+    assert budget.exhausted() and not budget.allow(1)
+
+
+def test_allow_time_budget():
+    budget = SyncBudget(time_budget=100, safety=1.0)
+    assert budget.allow(10**12)         # No throughput measured yet.
+    budget.record(1000, 10.0)           # 100 bytes/s
+    assert budget.allow(5000)           # ~50 s
+    assert not budget.allow(50000)      # ~500 s
+    assert budget.reason(50000) == 'time_budget'
+
+
+def test_defer_writeRemainder_and_resume(tmpdir):
+    remainderfile = str(tmpdir.join('sub', 'remainder.json'))
+    budget = SyncBudget(max_bytes=100, remainderfile=remainderfile)
+    budget.Current = dict(remote='nas', expid='RS101')
+    budget.defer('/sat/RS101 exp', '/local/RS101 exp', nbytes=500)
+    assert budget.writeRemainder() == remainderfile
+    with open(remainderfile) as fd:
+        deferred = json.load(fd)['deferred']
+    assert deferred == [dict(remote='nas', expid='RS101', satellitepath='/sat/RS101 exp',
+                             localpath='/local/RS101 exp', bytes=500, reason='max_bytes')]
+    # The next run syncs the deferred experiment first, then the newest:
+    nextbudget = SyncBudget(max_bytes=100, remainderfile=remainderfile)
+    assert nextbudget.isResumed('nas', 'RS101')
+    assert nextbudget.prioritize('nas', ['RS099', 'RS101', 'RS200']) == ['RS101', 'RS200', 'RS099']
+    # Nothing deferred: the remainder file is removed.
+    nextbudget.writeRemainder()
+    assert not tmpdir.join('sub', 'remainder.json').exists()
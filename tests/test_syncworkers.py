@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+""" Tests for syncworkers.runShards, with a stand-in satellite location that copies new files. """
+import os
+import shutil
+
+from syncworkers import runShards
+
+
+class CopyLocation(object):
+    """
+    Stand-in satellite location: syncToLocalDir copies files that do not exist locally.
+    Each location made writes a file to locationparams['madedir'], so tests can count them.
+    """
+    def __init__(self, locationparams):
+        self.LocationParams = locationparams
+        self.VerifyFailures = []
+        with open(os.path.join(locationparams['madedir'], 'location-%s-%s' % (os.getpid(), id(self))), 'w'):
+            pass
+
+    def syncToLocalDir(self, satellitepath, localpath, verbosity=0, dryrun=False, budget=None, verify=False):   # pylint: disable=W0613
+        for filename in sorted(os.listdir(satellitepath)):
+            destpath = os.path.join(localpath, filename)
+            if os.path.exists(destpath) or dryrun:
+                continue
+            if not os.path.isdir(localpath):
+                os.makedirs(localpath)
+            nbytes = os.path.getsize(os.path.join(satellitepath, filename))
+            shutil.copy2(os.path.join(satellitepath, filename), destpath)
+            budget.record(nbytes, 0.001)
+            if filename.startswith('bad'):
+                self.VerifyFailures.append((os.path.join(satellitepath, filename), destpath))
+
+
+def copyLocationFactory(locationparams):
+    """ Module-level, so it can be sent to the worker processes. """
+    return CopyLocation(locationparams)
+
+
+def makeRemote(tmpdir, nexps=6):
+    """ Returns sync items (expid, satellitepath, localpath) for nexps experiments with two subentries each. """
+    items = []
+    for i in range(nexps):
+        expid = 'RS%03d' % (100 + i)
+        for subidx in 'ab':
+            satellitepath = tmpdir.join('remote', '%s%s data' % (expid, subidx))
+            for n in range(3):
+                satellitepath.join('%sfile%s.dat' % ('bad' if i == 2 and n == 0 else '', n)).write('%s %s %s' % (expid, subidx, n), ensure=True)
+            items.append((expid, str(satellitepath), '%s/%s exp/%s%s data' % ('%s', expid, expid, subidx)))
+    return items
+
+
+def listTree(rootdir):
+    return sorted((os.path.relpath(os.path.join(dirpath, filename), rootdir), open(os.path.join(dirpath, filename)).read())
+                  for dirpath, _, filenames in os.walk(rootdir) for filename in filenames)
+
+
+def syncInto(tmpdir, items, name, workers):
+    localdir, madedir = tmpdir.join(name), tmpdir.join(name + '-made')
+    madedir.ensure(dir=True)
+    items = [(expid, satellitepath, localpath % localdir) for expid, satellitepath, localpath in items]
+    results = runShards(dict(name='nas', madedir=str(madedir)), items, workers, factory=copyLocationFactory)
+    return results, listTree(str(localdir)), len(madedir.listdir())
+
+
+def test_parallel_sync_gives_the_same_copies_as_serial(tmpdir):
+    items = makeRemote(tmpdir)
+    serial, serialtree, serialmade = syncInto(tmpdir, items, 'serial', workers=1)
+    parallel, paralleltree, parallelmade = syncInto(tmpdir, items, 'parallel', workers=3)
+    assert len(serialtree) == 6*2*3
+    assert paralleltree == serialtree
+    for key in ('expids', 'items', 'bytes_copied', 'shards', 'errors'):
+        assert parallel[key] == serial[key]
+    assert serial['shards'] == 6
+    assert len(serial['verifyfailures']) == len(parallel['verifyfailures']) == 2
+    # One location per worker process, not one per shard (experiment):
+    assert serialmade == 1
+    assert 1 <= parallelmade <= 3
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+""" Tests for tracing: spans, the traced decorator and the trace-event JSON output. """
+import os
+import json
+import threading
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def enabled():
+    """ Enables tracing with an empty event list, and restores the disabled state afterwards. """
+    tracing.clearEvents()
+    tracing.enableTracing()
+    yield
+    tracing.enableTracing(False)
+    tracing.clearEvents()
+
+
+@tracing.traced('copyFolder', argnames=('src',))
+def copyFolder(src, dest, dryrun=False):    # pylint: disable=W0613
+    return dest
+
+
+def test_disabled_records_nothing():
+    tracing.clearEvents()
+    assert not tracing.isTracing()
+    with tracing.span('sync'):
+        pass
+    assert copyFolder('a', 'b') == 'b'
+    assert tracing.getEvents() == []
+
+
+def test_span_records_complete_event(enabled):
+    with tracing.span('sync', remote='nanodrop'):
+        pass
+    with pytest.raises(KeyError):
+        with tracing.span('failing'):
+            raise KeyError('x')
+    events = tracing.getEvents()
+    assert [event['name'] for event in events] == ['sync', 'failing']
+    event = events[0]
+    assert event['ph'] == 'X' and event['dur'] >= 0
+    assert event['args'] == {'remote': 'nanodrop'}
+    assert event['pid'] == os.getpid() and event['tid'] == threading.current_thread().ident
+
+
+def test_traced_records_selected_args(enabled):
+    assert copyFolder('RS001', dest='/local', dryrun=True) == '/local'
+    events = tracing.getEvents()
+    assert len(events) == 1
+    assert events[0]['name'] == 'copyFolder'
+    assert events[0]['args'] == {'src': 'RS001'}
+    assert copyFolder.__name__ == 'copyFolder'
+
+
+def test_spans_from_threads(enabled):
+    def work(i):
+        with tracing.span('work', i=i):
+            pass
+    threads = [threading.Thread(target=work, args=(i,), name='worker-thread-%s' % i) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(event['args']['i'] for event in tracing.getEvents()) == [0, 1, 2, 3]
+
+
+def test_writetrace_adds_thread_metadata(enabled, tmpdir):
+    with tracing.span('local'):
+        pass
+    tracing.addEvents([{'name': 'remote', 'cat': 'labfluence', 'ph': 'X', 'ts': 0, 'dur': 1,
+                        'pid': -1, 'tid': 7, 'args': {}}])
+    filepath = tracing.writeTrace(os.path.join(str(tmpdir), 'sub', 'trace.json'))
+    with open(filepath) as fd:
+        trace = json.load(fd)
+    events = trace['traceEvents']
+    metadata = {(event['pid'], event['tid']): event['args']['name'] for event in events if event['ph'] == 'M'}
+    assert metadata[(os.getpid(), threading.current_thread().ident)] == threading.current_thread().name
+    assert metadata[(-1, 7)] == 'worker--1'
+    assert sorted(event['name'] for event in events if event['ph'] == 'X') == ['local', 'remote']
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+""" Tests for wikifetch.WikiFetchPool, against a local stand-in XML-RPC server. """
+import time
+import threading
+import pytest
+try:
+    from xmlrpc.server import SimpleXMLRPCServer
+except ImportError:
+    from SimpleXMLRPCServer import SimpleXMLRPCServer  # python 2
+
+from conftest import StandInWiki, StandInServer, QuietRequestHandler
+from wikifetch import WikiFetchPool
+
+
+class SlowWiki(StandInWiki):
+    """ Stand-in wiki where each call takes <delay> seconds; records the max number of concurrent calls. """
+    def __init__(self, pages, delay=0.1):
+        StandInWiki.__init__(self, pages)
+        self.Delay = delay
+        self.Active = 0
+        self.MaxActive = 0
+        self._lock = threading.Lock()
+
+    def getPage(self, pageid):
+        with self._lock:
+            self.Active += 1
+            self.MaxActive = max(self.MaxActive, self.Active)
+        try:
+            time.sleep(self.Delay)
+            return StandInWiki.getPage(self, pageid)
+        finally:
+            with self._lock:
+                self.Active -= 1
+
+
+def makePages(n):
+    return [dict(id=str(100 + i), title='RS%03d Exp' % i, parentId='1', version='1', content='') for i in range(n)]
+
+
+@pytest.fixture
+def flaky_server():
+    """ Stand-in XML-RPC server that answers the first <failures> requests with HTTP 503. """
+    state = dict(failures=0, requests=0)
+    class FlakyHandler(QuietRequestHandler):
+        def do_POST(self):
+            state['requests'] += 1
+            if state['failures'] > 0:
+                state['failures'] -= 1
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            QuietRequestHandler.do_POST(self)
+    wiki = StandInWiki(makePages(3))
+    server = SimpleXMLRPCServer(('127.0.0.1', 0), requestHandler=FlakyHandler, logRequests=False, allow_none=True)
+    server.register_instance(wiki)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%s/' % server.server_address[1], state, wiki
+    server.shutdown()
+    server.server_close()
+
+
+def test_transient_errors_are_retried_with_backoff(flaky_server):
+    url, state, _ = flaky_server
+    state['failures'] = 2
+    pool = WikiFetchPool(StandInServer(url), maxconnections=1, retries=3, backoff=0.1)
+    starttime = time.time()
+    page = pool.call('getPage', '101')
+    assert page['id'] == '101'
+    assert state['requests'] == 3
+    assert time.time() - starttime >= 0.1 + 0.2    # backoff, then 2*backoff
+
+
+def test_gives_up_after_retries(flaky_server):
+    url, state, _ = flaky_server
+    state['failures'] = 10
+    pool = WikiFetchPool(StandInServer(url), maxconnections=1, retries=2, backoff=0.01)
+    assert pool.call('getPage', '101') is None
+    assert state['requests'] == 3
+
+
+def test_fault_is_not_retried(flaky_server):
+    url, state, _ = flaky_server
+    pool = WikiFetchPool(StandInServer(url), maxconnections=2, retries=3, backoff=0.01)
+    assert pool.call('getPage', 'no-such-page') is None   # KeyError on the server -> xmlrpc Fault.
+    assert state['requests'] == 1
+
+
+def test_concurrency_is_limited_to_maxconnections(xmlrpc_server):
+    wiki = SlowWiki(makePages(9), delay=0.2)
+    pool = WikiFetchPool(StandInServer(xmlrpc_server(wiki)), maxconnections=3)
+    results = pool.fetchPages([page['id'] for page in makePages(9)])
+    assert sorted(results) == sorted(wiki.Pages)
+    assert all(results[pageid]['id'] == pageid for pageid in results)
+    assert wiki.MaxActive == 3
+
+
+def test_single_connection_without_clientfactory(xmlrpc_server):
+    class SharedServer(object):
+        """ Server object without a clone method. """
+        def __init__(self, url):
+            self.Client = StandInServer(url)
+        def getPage(self, pageid):
+            return self.Client.getPage(pageid)
+        def getAttachments(self, pageid):
+            return self.Client.getAttachments(pageid)
+    wiki = SlowWiki(makePages(4), delay=0.05)
+    pool = WikiFetchPool(SharedServer(xmlrpc_server(wiki)), maxconnections=4)
+    assert pool.MaxConnections == 1
+    results = pool.fetch([page['id'] for page in makePages(4)])
+    assert wiki.MaxActive == 1
+    assert all(result['page'] is not None and result['attachments'] == [] for result in results.values())
+
+
+class TokenWiki(SlowWiki):
+    """ SlowWiki with the Confluence XML-RPC API: confluence2.<method>(token, pageid). """
+    def __init__(self, pages, token, delay=0.1):
+        SlowWiki.__init__(self, pages, delay)
+        self.Token = token
+
+    def _dispatch(self, method, params):
+        api, methodname = method.split('.')
+        if api != 'confluence2' or params[0] != self.Token:
+            raise ValueError("Not logged in")
+        return getattr(self, methodname)(*params[1:])
+
+
+class LoggedInServer(object):
+    """ Server object without a clone method, with the XML-RPC endpoint and login token of the labfluence server. """
+    def __init__(self, url, token):
+        self.AppUrl = url
+        self.Logintoken = token
+        self.Calls = 0
+
+    def getPage(self, pageid):
+        self.Calls += 1
+
+
+def test_pooled_clients_from_appurl_and_token(xmlrpc_server):
+    wiki = TokenWiki(makePages(8), token='secret', delay=0.2)
+    server = LoggedInServer(xmlrpc_server(wiki), 'secret')
+    pool = WikiFetchPool(server, maxconnections=4)
+    assert pool.MaxConnections == 4
+    results = pool.fetch([page['id'] for page in makePages(8)])
+    assert all(results[pageid]['page']['id'] == pageid and results[pageid]['attachments'] == [] for pageid in results)
+    assert wiki.MaxActive == 4
+    assert server.Calls == 0
+    # A failing call (e.g. wrong token) gives None:
+    server.Logintoken = 'expired'
+    assert WikiFetchPool(server, maxconnections=2, retries=0).fetchPages(['100']) == {'100': None}
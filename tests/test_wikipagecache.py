@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+""" Tests for wikipagecache.WikiPageCache, against local stand-in XML-RPC and REST servers. """
+import json
+import threading
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+    from urllib.request import build_opener
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler  # python 2
+    from urlparse import urlparse, parse_qs
+    from urllib2 import build_opener
+import pytest
+
+from conftest import StandInWiki, StandInServer
+from wikipagecache import WikiPageCache, listChildrenWithVersions
+
+
+def makePages(n=5, version=1):
+    return [dict(id=str(100 + i), title='RS%03d Exp %s' % (i, i), parentId='1', version=str(version),
+                 content='<h2>RS%03da Subentry</h2>' % i) for i in range(n)]
+
+
+@pytest.fixture
+def restwiki():
+    """ Stand-in REST server for GET /rest/api/content/<id>/child/page?expand=version (paginated). """
+    wiki = StandInWiki(makePages(7))
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):   # pylint: disable=W0221
+            pass
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parentid = url.path.split('/')[4]
+            limit, start = int(query['limit'][0]), int(query.get('start', ['0'])[0])
+            pages = sorted((page for page in wiki.Pages.values() if page['parentId'] == parentid), key=lambda page: page['id'])
+            results = [dict(id=page['id'], type='page', title=page['title'], version=dict(number=int(page['version'])))
+                       for page in pages[start:start+limit]]
+            links = dict(next='/next') if start + limit < len(pages) else {}
+            body = json.dumps(dict(results=results, start=start, limit=limit, size=len(results), _links=links)).encode('utf-8')
+            wiki.Calls.append(('rest', start))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    httpd = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    class RestServer(object):
+        BaseUrl = 'http://127.0.0.1:%s' % httpd.server_address[1]
+        UrlOpener = build_opener()
+        def getChildren(self, pageid):
+            raise AssertionError("getChildren should not be used when the REST API is available.")
+    yield wiki, RestServer()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_xmlrpc_listing_without_versions_does_not_serve_cached_pages(tmpdir, xmlrpc_server):
+    wiki = StandInWiki(makePages())
+    server = StandInServer(xmlrpc_server(wiki))
+    cache = WikiPageCache(str(tmpdir))
+    for page in makePages():
+        cache.putPage(page)
+    children = cache.listChildren(server, '1')
+    assert sorted(child['id'] for child in children) == [page['id'] for page in makePages()]
+    # The XML-RPC page summaries have no version, so the cached pages cannot be validated and must be refetched:
+    assert all(cache.getPage(child['id'], child.get('version')) is None for child in children)
+    # ... but they are kept for offline use:
+    assert cache.getPage('100', allowstale=True)['title'] == 'RS000 Exp 0'
+
+
+def test_cached_listing_when_offline(tmpdir, xmlrpc_server):
+    wiki = StandInWiki(makePages())
+    cache = WikiPageCache(str(tmpdir))
+    children = cache.listChildren(StandInServer(xmlrpc_server(wiki)), '1')
+    reloaded = WikiPageCache(str(tmpdir))
+    assert reloaded.listChildren(None, '1') == children
+
+
+def test_rest_listing_revalidates_by_version(tmpdir, restwiki):
+    wiki, server = restwiki
+    cache = WikiPageCache(str(tmpdir))
+    for page in wiki.Pages.values():
+        cache.putPage(page)
+    wiki.Pages['103']['version'] = '2'      # Page edited on the wiki.
+    children = cache.listChildren(server, '1')
+    assert len(children) == 7
+    versions = {child['id']: child['version'] for child in children}
+    assert versions['103'] == '2' and versions['100'] == '1'
+    assert cache.getPage('100', versions['100'])['id'] == '100'
+    assert cache.getPage('103', versions['103']) is None
+    assert cache.getPage('103', allowstale=True) is None     # Outdated page was dropped.
+
+
+def test_rest_listing_is_paginated(restwiki):
+    wiki, server = restwiki
+    children = listChildrenWithVersions(server, '1', limit=3)
+    assert [child['id'] for child in children] == sorted(wiki.Pages)
+    assert [call for call in wiki.Calls if call[0] == 'rest'] == [('rest', 0), ('rest', 3), ('rest', 6)]
+
+
+def test_rest_listing_requires_opener():
+    class NoOpener(object):
+        BaseUrl = 'http://127.0.0.1:1'
+    assert listChildrenWithVersions(NoOpener(), '1') is None
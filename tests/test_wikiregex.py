@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+""" Tests for the wiki regex helpers in experiment: the compiled regex LRU cache, deriveHeaderRegexFmt and splitWikiSubentries. """
+import re
+from collections import OrderedDict
+
+import pytest
+
+experiment = pytest.importorskip('experiment')
+
+SUBENTRY_REGEX_FMT = (r'(?P<subentry_xhtml><h2>(?P<expid>{expid}){subentry_idx} (?P<subentry_titledesc>.+?)</h2>.*?)'
+                      r'(?=<h2>|<h1>|$)')
+
+
+@pytest.fixture
+def regexcache(monkeypatch):
+    """ An empty regex cache with room for 3 regexes. """
+    cache = OrderedDict()
+    monkeypatch.setattr(experiment, '_wikiregexcache', cache)
+    monkeypatch.setattr(experiment, 'WIKI_REGEX_CACHE_SIZE', 3)
+    return cache
+
+
+def test_compiled_regexes_are_cached_per_expid(regexcache):
+    prog = experiment.compileWikiRegex(SUBENTRY_REGEX_FMT, 'RS123')
+    assert experiment.compileWikiRegex(SUBENTRY_REGEX_FMT, 'RS123') is prog
+    assert experiment.compileWikiRegex(SUBENTRY_REGEX_FMT, 'RS124') is not prog
+    assert prog.flags & re.DOTALL and prog.flags & re.MULTILINE
+    assert prog.search('<h2>RS123b Title</h2>body').group('subentry_idx') == 'b'
+    assert list(regexcache) == [(SUBENTRY_REGEX_FMT, 'RS123'), (SUBENTRY_REGEX_FMT, 'RS124')]
+
+
+def test_regex_cache_evicts_least_recently_used(regexcache):
+    progs = {expid: experiment.compileWikiRegex(SUBENTRY_REGEX_FMT, expid) for expid in ('RS1', 'RS2', 'RS3')}
+    experiment.compileWikiRegex(SUBENTRY_REGEX_FMT, 'RS1')     # RS1 is now the most recently used
+    experiment.compileWikiRegex(SUBENTRY_REGEX_FMT, 'RS4')     # evicts RS2
+    assert [expid for _, expid in regexcache] == ['RS3', 'RS1', 'RS4']
+    assert experiment.compileWikiRegex(SUBENTRY_REGEX_FMT, 'RS1') is progs['RS1']
+    assert (SUBENTRY_REGEX_FMT, 'RS2') not in regexcache
+    experiment.compileWikiRegex(SUBENTRY_REGEX_FMT, 'RS2')     # evicts RS3
+    assert [expid for _, expid in regexcache] == ['RS4', 'RS1', 'RS2']
+
+
+def test_compile_errors(regexcache):
+    with pytest.raises((TypeError, AttributeError)):
+        experiment.compileWikiRegex(None, 'RS123')
+    with pytest.raises(re.error):
+        experiment.compileWikiRegex('(unbalanced')
+    assert not regexcache
+
+
+def test_derive_header_regex_fmt():
+    header = experiment.deriveHeaderRegexFmt(SUBENTRY_REGEX_FMT)
+    assert header == r'<h2>(?P<expid>{expid}){subentry_idx} (?P<subentry_titledesc>.+?)</h2>'
+    assert experiment.deriveHeaderRegexFmt(None) is None
+    assert experiment.deriveHeaderRegexFmt(r'<h2>{expid}{subentry_idx}</h2>') is None
+    # The header must include the subentry index:
+    assert experiment.deriveHeaderRegexFmt(r'(?P<subentry_xhtml><h2>{expid}</h2>.*?)(?=<h2>)') is None
+
+
+def test_split_matches_full_regex(regexcache):
+    xhtml = ('<h2>RS123a First</h2><p>one</p>'
+             '<h2>RS123b Second</h2><p>two</p><p>more</p>'
+             '<h2>RS123c Third</h2>')
+    headerprog = experiment.compileWikiRegex(experiment.deriveHeaderRegexFmt(SUBENTRY_REGEX_FMT), 'RS123')
+    split = list(experiment.splitWikiSubentries(xhtml, headerprog))
+    full = [match.groupdict() for match in experiment.compileWikiRegex(SUBENTRY_REGEX_FMT, 'RS123').finditer(xhtml)]
+    assert [gd['subentry_idx'] for gd in split] == ['a', 'b', 'c']
+    assert split == full
+    assert list(experiment.splitWikiSubentries('<p>no subentries</p>', headerprog)) == []